@@ -0,0 +1,115 @@
+import multiprocessing
+import time
+import headless
+import scenario
+from pathfinder import PLANNER_SETTINGS
+from smath import *
+
+# ==================================
+
+# Candidate branches as planner setting overrides, most promising first: the greedy planner itself,
+# then forced tangent sides around obstacles and weaker or stronger push away from the target line
+CANDIDATES = [
+	{},
+	{ "tangentSide": 1 },
+	{ "tangentSide": -1 },
+	{ "pushAwayStrength": 0.2 },
+	{ "pushAwayStrength": 0.8 },
+	{ "tangentSide": 1, "pushAwayStrength": 0.2 },
+	{ "tangentSide": -1, "pushAwayStrength": 0.2 },
+	{ "tangentSide": 1, "pushAwayStrength": 0.8 },
+	{ "tangentSide": -1, "pushAwayStrength": 0.8 },
+]
+
+# Steps left violating a constraint outweigh everything else
+FAILED_STEP_COST = 1000.0
+
+# Lower is better: unresolved steps, then the mean distance to the target direction line in attraction
+# distances of the settings the path was planned with, then the final heading error in degrees / 180
+def scorePath(pathData, targetPosition, targetVelocity, attractionDistance):
+	offsets = 0.0
+	for x, y in pathData["points"]:
+		offsets += abs((x - targetPosition.x) * targetVelocity.y - (y - targetPosition.y) * targetVelocity.x)
+
+	headingError = abs(angleDifference(pathData["rotations"][-1], velocityToAngle(targetVelocity)))
+	return len(pathData["failedSteps"]) * FAILED_STEP_COST + offsets / (len(pathData["points"]) * attractionDistance) + headingError / 180.0
+
+# ==================================
+
+# Runs in a pool worker set up by headless.initWorker. Returns the path data, None when the deadline
+# passes first, so abandoned candidates free their worker right away
+def planCandidate(position, velocity, targetPosition, targetVelocity, settings, deadline):
+	pathfinder = headless.worker.pathfinder
+	for name, value in settings.iteritems():
+		setattr(pathfinder, name, value)
+
+	for pointIndex in pathfinder.generatePath(position, velocity, targetPosition, targetVelocity):
+		if time.time() > deadline:
+			return None
+
+	return scenario.pathToData({ "points": pathfinder.pathPoints, "rotations": pathfinder.pathOrientations, "failedSteps": pathfinder.failedSteps })
+
+# ==================================
+
+# Plans the greedy path in the calling process while the other candidates run on a process pool, and returns the
+# best scoring path finished when timeLimit seconds are up. The greedy path is always waited for, so the response
+# time is the larger of timeLimit and one plain getPath, and more time lets more candidates finish.
+# Configure the planner settings on the pathfinder attribute
+class AnytimePlanner(object):
+	def __init__(self, obstaclesPath, workers=None, compiled=False, distanceFieldResolution=None, candidates=None):
+		workers = workers or multiprocessing.cpu_count()
+		headless.prepareObstacles(obstaclesPath, compiled, distanceFieldResolution)
+
+		self.local = headless.Worker(obstaclesPath, compiled, distanceFieldResolution)
+		self.pathfinder = self.local.pathfinder
+		self.candidates = CANDIDATES if candidates is None else candidates
+		self.pool = multiprocessing.Pool(workers, initializer=headless.initWorker, initargs=(obstaclesPath, compiled, distanceFieldResolution))
+
+	def close(self):
+		self.pool.terminate()
+		self.pool.join()
+
+	# Returns getPath results plus the "settings" of the chosen candidate, its "score" and the number of "candidates" scored
+	def getPath(self, position, velocity, targetPosition, targetVelocity, timeLimit):
+		deadline = time.time() + timeLimit
+		baseSettings = dict((name, getattr(self.pathfinder, name)) for name in PLANNER_SETTINGS)
+
+		pending = []
+		for overrides in self.candidates:
+			if overrides:
+				settings = dict(baseSettings)
+				settings.update(overrides)
+				pending.append((settings, self.pool.apply_async(planCandidate, (position, velocity, targetPosition, targetVelocity, settings, deadline))))
+
+		path = self.pathfinder.getPath(position, velocity, targetPosition, targetVelocity)
+		bestData = scenario.pathToData(path)
+		bestSettings = baseSettings
+		bestScore = scorePath(bestData, targetPosition, targetVelocity, baseSettings["attractionDistance"])
+		scored = 1
+
+		for settings, result in pending:
+			try:
+				data = result.get(max(deadline - time.time(), 0.0))
+			except multiprocessing.TimeoutError:
+				continue
+
+			if data is None:
+				continue
+
+			scored += 1
+			score = scorePath(data, targetPosition, targetVelocity, settings["attractionDistance"])
+			if score < bestScore:
+				bestData = data
+				bestSettings = settings
+				bestScore = score
+
+		return {
+			"points": [vec2f(x, y) for x, y in bestData["points"]],
+			"rotations": bestData["rotations"],
+			"failedSteps": bestData["failedSteps"],
+			"settings": bestSettings,
+			"score": bestScore,
+			"candidates": scored,
+		}
+
+# ==================================
@@ -0,0 +1,603 @@
+import numpy as np
+import constraints
+import pathfinder
+from smath import vec2f, radians, TurnLimit, ROTATION_45, inverseRotation
+
+# ==================================
+
+def dotArray(a, b):
+	return a[..., 0] * b[..., 0] + a[..., 1] * b[..., 1]
+
+def lengthArray(v):
+	return np.sqrt(dotArray(v, v))
+
+def normalizeArray(v):
+	return v / lengthArray(v)[..., np.newaxis]
+
+# angle conversions follow smath operation for operation so results round the same way
+def radiansArray(deg):
+	return (deg / 180.0) * np.pi
+
+def degreesArray(rad):
+	return rad * 180.0 / np.pi
+
+def crossArray(a, b):
+	return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+def perpendicularArray(v):
+	return np.stack((-v[..., 1], v[..., 0]), axis=-1)
+
+# Rotates by (cos, sin) pairs, either scalars or arrays matching v
+def rotateByArray(v, cos, sin):
+	result = np.empty(np.broadcast(v[..., 0], cos).shape + (2,))
+	result[..., 0] = v[..., 0] * cos - v[..., 1] * sin
+	result[..., 1] = v[..., 0] * sin + v[..., 1] * cos
+	return result
+
+def turnArray(turnLimit, current, desired):
+	left = crossArray(current, desired) >= 0
+	cos = np.where(left, turnLimit.left[0], turnLimit.right[0])
+	sin = np.where(left, turnLimit.left[1], turnLimit.right[1])
+	return rotateByArray(current, cos, sin)
+
+def velocityToAngleArray(v):
+	return degreesArray(np.arctan2(v[..., 1], v[..., 0]))
+
+def angleToVelocityArray(deg):
+	radAngle = radiansArray(deg)
+	return np.stack((np.cos(radAngle), np.sin(radAngle)), axis=-1)
+
+def signArray(a):
+	return np.where(a < 0, -1.0, 1.0)
+
+def toAgentArray(data, count=None):
+	result = np.atleast_2d(np.asarray(data, dtype=np.float64))
+	if count is not None and result.shape[0] != count:
+		result = np.broadcast_to(result, (count, 2))
+
+	return np.array(result)
+
+# Most cells of the broad phase grid of a circle kernel
+GRID_CELLS_LIMIT = 1 << 20
+
+# Sortable int64 key of the integer cell coordinates x, y, scalars or arrays
+def getCellKey(x, y):
+	return (np.asarray(x, dtype=np.int64) << 32) + (np.asarray(y, dtype=np.int64) + 0x80000000)
+
+# ==================================
+
+# Runs of consecutive circle constraints are checked together: every agent looks for the first
+# violated circle after its cursor, so the sequential order of the scalar loop is preserved.
+# Broad phase: a uniform grid over the circles, every cell lists the circles whose violation bounds reach into it
+# in constraint order, padded to the fullest cell with a sentinel circle nothing violates. Agents only test the
+# circles of their cell, in chunks bounding the agents x candidates temporaries
+class BatchCircleKernel(object):
+	def __init__(self, circles):
+		self.constraints = circles
+		self.centers = np.array([(c.center.x, c.center.y) for c in circles], dtype=np.float64).reshape(-1, 2)
+		self.violateDistance = np.array([c.violateDistance for c in circles], dtype=np.float64)
+		self.violateDistanceSq = self.violateDistance ** 2
+		self.buildGrid()
+
+	def buildGrid(self):
+		count = len(self.constraints)
+		# a little slack so rounding never leaves a violated circle out of the cell of a point
+		reach = self.violateDistance * (1.0 + 1e-9) + 1e-9
+		lower = (self.centers - reach[:, np.newaxis]).min(axis=0) if count else np.zeros(2)
+		upper = (self.centers + reach[:, np.newaxis]).max(axis=0) if count else np.ones(2)
+
+		# every circle reaches into at most 2 x 2 cells, at most GRID_CELLS_LIMIT cells in all
+		extent = upper - lower
+		self.cellSize = max(2.0 * reach.max() if count else 1.0, np.sqrt(extent[0] * extent[1] / GRID_CELLS_LIMIT), 1e-9)
+		self.origin = lower
+		self.gridSize = np.maximum(np.floor(extent / self.cellSize).astype(np.intp) + 1, 1)
+
+		first = np.floor((self.centers - reach[:, np.newaxis] - lower) / self.cellSize).astype(np.intp)
+		last = np.floor((self.centers + reach[:, np.newaxis] - lower) / self.cellSize).astype(np.intp)
+		cells = []
+		indices = []
+		for dx in (0, 1):
+			for dy in (0, 1):
+				reached = (first[:, 0] + dx <= last[:, 0]) & (first[:, 1] + dy <= last[:, 1])
+				cells.append((first[reached, 1] + dy) * self.gridSize[0] + first[reached, 0] + dx)
+				indices.append(np.flatnonzero(reached))
+		cells = np.concatenate(cells)
+		indices = np.concatenate(indices)
+
+		# one more cell, empty, for points outside the grid
+		cellsCount = self.gridSize[0] * self.gridSize[1]
+		order = np.lexsort((indices, cells))
+		cells = cells[order]
+		indices = indices[order]
+		cellCounts = np.bincount(cells, minlength=cellsCount + 1)
+		cellStarts = np.concatenate(([0], np.cumsum(cellCounts)[:-1]))
+
+		self.cellCircles = np.full((cellsCount + 1, max(cellCounts.max(), 1)), count, dtype=np.intp)
+		self.cellCircles[cells, np.arange(cells.size) - cellStarts[cells]] = indices
+		# when cells hold most of the circles anyway every point tests them all, without the lookup
+		self.isGridded = self.cellCircles.shape[1] * 2 < count
+		if not self.isGridded:
+			self.cellCircles = np.arange(max(count, 1)).reshape(1, -1)
+		self.paddedCenters = np.vstack((self.centers, [(np.inf, np.inf)]))
+		self.paddedViolateDistanceSq = np.append(self.violateDistanceSq, 0.0)
+		self.chunkSize = max(1, (1 << 18) // self.cellCircles.shape[1])
+
+	# Candidate circles of every point, points x fullest cell indices, the sentinel count past the real ones
+	def candidates(self, points):
+		if not self.isGridded:
+			return np.broadcast_to(self.cellCircles, (points.shape[0], self.cellCircles.shape[1]))
+
+		cell = np.floor((points - self.origin) / self.cellSize)
+		inside = (cell >= 0).all(axis=1) & (cell < self.gridSize).all(axis=1)
+		cellIndex = np.full(points.shape[0], self.cellCircles.shape[0] - 1, dtype=np.intp)
+		cellIndex[inside] = cell[inside, 1].astype(np.intp) * self.gridSize[0] + cell[inside, 0].astype(np.intp)
+		return self.cellCircles[cellIndex]
+
+	# Index of the first circle from cursor on violated by every point, -1 for none
+	def firstHits(self, points, cursor):
+		result = np.full(points.shape[0], -1, dtype=np.intp)
+		for start in xrange(0, points.shape[0], self.chunkSize):
+			chunk = slice(start, start + self.chunkSize)
+			candidates = self.candidates(points[chunk])
+			offsets = points[chunk, np.newaxis, :] - self.paddedCenters[candidates]
+			hits = dotArray(offsets, offsets) < self.paddedViolateDistanceSq[candidates]
+			hits &= candidates >= cursor[chunk, np.newaxis]
+
+			rows = np.flatnonzero(hits.any(axis=1))
+			result[start + rows] = candidates[rows, hits[rows].argmax(axis=1)]
+
+		return result
+
+	def resolve(self, oldPos, oldVelocity, pos, velocity):
+		count = pos.shape[0]
+		violated = np.zeros(count, dtype=bool)
+		cursor = np.zeros(count, dtype=np.intp)
+		rows = np.arange(count)
+
+		while rows.size:
+			hitIndex = self.firstHits(pos[rows], cursor[rows])
+			hasHit = hitIndex >= 0
+			rows = rows[hasHit]
+			if not rows.size:
+				break
+
+			hitIndex = hitIndex[hasHit]
+			pos[rows], velocity[rows] = self.suggestPoints(oldPos[rows], pos[rows], hitIndex)
+			violated[rows] = True
+			cursor[rows] = hitIndex + 1
+
+		return violated
+
+	# Agents whose points violate any of the circles, nothing is moved
+	def violated(self, pos, velocity):
+		return self.firstHits(pos, np.zeros(pos.shape[0], dtype=np.intp)) >= 0
+
+	# Vectorized CircleCollisionConstraint.suggestPoint
+	def suggestPoints(self, prevPoint, point, index):
+		center = self.centers[index]
+		toCenter = center - prevPoint
+		distanceToCenter = lengthArray(toCenter)
+		sin = np.clip(self.violateDistance[index] / distanceToCenter, -1, 1)
+		cos = np.sqrt(1.0 - sin ** 2)
+
+		distanceToLine = (point[:, 0] - center[:, 0]) * toCenter[:, 1] - (point[:, 1] - center[:, 1]) * toCenter[:, 0]
+		sideSign = np.where(distanceToLine > 0, -1.0, 1.0)
+
+		toCenter /= distanceToCenter[:, np.newaxis]
+		rotatedVector = rotateByArray(toCenter, cos, sin * sideSign)
+		rotatedVector = rotateByArray(rotatedVector, constraints.TANGENT_SLACK[0], constraints.TANGENT_SLACK[1] * sideSign)
+		point = prevPoint + rotatedVector * (distanceToCenter * cos)[:, np.newaxis]
+		with np.errstate(invalid='ignore'):
+			velocity = normalizeArray(point - prevPoint)
+
+		# the scalar version fails on a domain error when the previous point is already inside,
+		# push such agents out to the violation distance instead and keep the tangent direction
+		inside = sin >= 1
+		if inside.any():
+			point[inside] = center[inside] - toCenter[inside] * self.violateDistance[index][inside, np.newaxis]
+			velocity[inside] = rotatedVector[inside]
+
+		return (point, velocity)
+
+# ==================================
+
+# Vectorized PolylineCollisionConstraint built from its flat segment data. Polylines with a segment grid
+# only test the segments of the grid cell of every point, as nearestSegment does, the cells are padded to
+# the fullest one with a sentinel segment nothing comes near
+class BatchPolylineKernel(object):
+	def __init__(self, polyline):
+		self.constraint = polyline
+		segments = np.frombuffer(polyline.segments, dtype=np.float64).reshape(-1, constraints.SEGMENT_STRIDE)
+		self.starts = segments[:, constraints.SEGMENT_START_X:constraints.SEGMENT_START_Y + 1]
+		self.directions = segments[:, constraints.SEGMENT_DIR_X:constraints.SEGMENT_DIR_Y + 1]
+		self.lengths = segments[:, constraints.SEGMENT_LENGTH]
+		self.violateDistance = polyline.violateDistance
+		self.violateDistanceSq = polyline.violateDistanceSq
+
+		count = len(self.lengths)
+		self.paddedStarts = np.vstack((self.starts, [(np.inf, 0.0)]))
+		self.paddedDirections = np.vstack((self.directions, [(1.0, 0.0)]))
+		self.paddedLengths = np.append(self.lengths, 0.0)
+
+		if polyline.cells is None:
+			self.cellKeys = None
+			self.cellSegments = np.arange(max(count, 1)).reshape(1, -1)
+		else:
+			keys = sorted(polyline.cells)
+			self.cellKeys = np.array([getCellKey(x, y) for x, y in keys], dtype=np.int64)
+			# one more cell, empty, for points in no cell of the polyline
+			self.cellSegments = np.full((len(keys) + 1, max(len(cell) for cell in polyline.cells.itervalues())), count, dtype=np.intp)
+			for row, key in enumerate(keys):
+				cell = polyline.cells[key]
+				self.cellSegments[row, :len(cell)] = cell
+
+		# bound the size of the agents x segments temporaries
+		self.chunkSize = max(1, (1 << 18) // self.cellSegments.shape[1])
+
+	# Candidate segments of every point, points x fullest cell indices, the sentinel count past the real ones
+	def candidates(self, points):
+		if self.cellKeys is None:
+			return np.broadcast_to(self.cellSegments, (points.shape[0], self.cellSegments.shape[1]))
+
+		cells = np.floor(points / self.constraint.cellSize).astype(np.int64)
+		keys = getCellKey(cells[:, 0], cells[:, 1])
+		row = np.minimum(np.searchsorted(self.cellKeys, keys), len(self.cellKeys) - 1)
+		row = np.where(self.cellKeys[row] == keys, row, len(self.cellKeys))
+		return self.cellSegments[row]
+
+	# Returns the squared distance, closest point and index of the nearest segment for every point
+	def nearestSegments(self, points):
+		count = points.shape[0]
+		distanceSq = np.empty(count)
+		closest = np.empty((count, 2))
+		index = np.empty(count, dtype=np.intp)
+
+		for start in xrange(0, count, self.chunkSize):
+			chunk = slice(start, start + self.chunkSize)
+			segments = self.candidates(points[chunk])
+			starts = self.paddedStarts[segments]
+			directions = self.paddedDirections[segments]
+			offsets = points[chunk, np.newaxis, :] - starts
+			t = np.clip(dotArray(offsets, directions), 0.0, self.paddedLengths[segments])
+			candidates = starts + directions * t[..., np.newaxis]
+			delta = candidates - points[chunk, np.newaxis, :]
+			candidatesDistanceSq = dotArray(delta, delta)
+
+			nearest = candidatesDistanceSq.argmin(axis=1)
+			rows = np.arange(nearest.size)
+			index[chunk] = segments[rows, nearest]
+			distanceSq[chunk] = candidatesDistanceSq[rows, nearest]
+			closest[chunk] = candidates[rows, nearest]
+
+		return (distanceSq, closest, index)
+
+	def resolve(self, oldPos, oldVelocity, pos, velocity):
+		if not self.lengths.size:
+			return np.zeros(pos.shape[0], dtype=bool)
+
+		distanceSq, closest, index = self.nearestSegments(pos)
+		violated = distanceSq < self.violateDistanceSq
+		rows = np.flatnonzero(violated)
+		if rows.size:
+			pos[rows], velocity[rows] = self.suggestPoints(oldPos[rows], oldVelocity[rows], pos[rows], index[rows])
+
+		return violated
+
+	def violated(self, pos, velocity):
+		if not self.lengths.size:
+			return np.zeros(pos.shape[0], dtype=bool)
+
+		return self.nearestSegments(pos)[0] < self.violateDistanceSq
+
+	# Vectorized PolylineCollisionConstraint.suggestPoint
+	def suggestPoints(self, prevPoint, prevVelocity, point, index):
+		tangent = self.directions[index]
+		step = point - prevPoint
+		tangent = tangent * signArray(dotArray(step, tangent))[:, np.newaxis]
+		point = prevPoint + tangent * lengthArray(step)[:, np.newaxis]
+
+		rows = np.arange(point.shape[0])
+		for i in xrange(4):
+			distanceSq, closest, index = self.nearestSegments(point[rows])
+			inside = distanceSq < self.violateDistanceSq
+			rows = rows[inside]
+			if not rows.size:
+				break
+
+			closest = closest[inside]
+			index = index[inside]
+			pushDirection = point[rows] - closest
+
+			onLine = dotArray(pushDirection, pushDirection) < 1e-12
+			if onLine.any():
+				normal = np.stack((-self.directions[index, 1], self.directions[index, 0]), axis=-1)
+				normal *= signArray(dotArray(prevPoint[rows] - point[rows], normal))[:, np.newaxis]
+				pushDirection[onLine] = normal[onLine]
+
+			point[rows] = closest + normalizeArray(pushDirection) * (self.violateDistance + 0.5)
+
+		velocity = point - prevPoint
+		length = lengthArray(velocity)
+		moved = length > 0
+		velocity[moved] /= length[moved, np.newaxis]
+		velocity[~moved] = prevVelocity[~moved]
+
+		return (point, velocity)
+
+# ==================================
+
+# Fallback for constraint types without a vectorized kernel: tests agents one by one
+class BatchScalarKernel(object):
+	def __init__(self, constraint):
+		self.constraint = constraint
+
+	def resolve(self, oldPos, oldVelocity, pos, velocity):
+		violated = np.zeros(pos.shape[0], dtype=bool)
+
+		for k in xrange(pos.shape[0]):
+			point = vec2f(pos[k, 0], pos[k, 1])
+			pointVelocity = vec2f(velocity[k, 0], velocity[k, 1])
+
+			if self.constraint.willViolate(point, pointVelocity):
+				prevPoint = vec2f(oldPos[k, 0], oldPos[k, 1])
+				prevVelocity = vec2f(oldVelocity[k, 0], oldVelocity[k, 1])
+				point, pointVelocity = self.constraint.suggestPoint(prevPoint, prevVelocity, point, pointVelocity)
+				pos[k] = (point.x, point.y)
+				velocity[k] = (pointVelocity.x, pointVelocity.y)
+				violated[k] = True
+
+		return violated
+
+	def violated(self, pos, velocity):
+		return np.array([self.constraint.willViolate(vec2f(pos[k, 0], pos[k, 1]), vec2f(velocity[k, 0], velocity[k, 1]))
+			for k in xrange(pos.shape[0])], dtype=bool)
+
+# ==================================
+
+# Plans paths for N agents in lock-step, following PathFindingAlgorithm.getPath step by step
+class BatchPathFindingAlgorithm(object):
+	def __init__(self):
+		self.constraints = []
+		self.pathPointsCount = 40
+		self.playerSpeed = 10
+		self.maxSteeringAngle = radians(20)
+		self.attractionDistance = pathfinder.attractionDistance
+		self.pushAwayTreshold = 0.15
+		self.pushAwayStrength = 0.4
+		self.maxConstraintPasses = 32
+		self.backwardFilterWindow = None
+		self.filteringMode = "backward"
+		self.smoothingWindow = 8
+
+	def compileConstraints(self):
+		kernels = []
+		circles = []
+
+		for constraint in self.constraints:
+			if type(constraint) is constraints.CircleCollisionConstraint:
+				circles.append(constraint)
+				continue
+
+			if circles:
+				kernels.append(BatchCircleKernel(circles))
+				circles = []
+
+			if type(constraint) is constraints.PolylineCollisionConstraint:
+				kernels.append(BatchPolylineKernel(constraint))
+			else:
+				kernels.append(BatchScalarKernel(constraint))
+
+		if circles:
+			kernels.append(BatchCircleKernel(circles))
+
+		return kernels
+
+	# All inputs are N x 2 arrays (targets may also be a single row shared by every agent).
+	# Returns N x (pathPointsCount + 1) x 2 points, N x (pathPointsCount + 1) rotations in degrees and
+	# N x (pathPointsCount + 1) flags of the points left violating constraints after maxConstraintPasses
+	def getPaths(self, positions, velocities, targetPositions, targetVelocities):
+		playerPos = toAgentArray(positions)
+		count = playerPos.shape[0]
+		playerVelocity = toAgentArray(velocities, count)
+		targetPos = toAgentArray(targetPositions, count)
+		targetVelocity = toAgentArray(targetVelocities, count)
+
+		attractionDistance = self.attractionDistance
+		playerSpeed = self.playerSpeed
+		turnLimit = TurnLimit(self.maxSteeringAngle, pathfinder.steeringAngleTolerance)
+		kernels = self.compileConstraints()
+
+		targetFront = targetVelocity
+		targetRight = perpendicularArray(targetVelocity)
+		subTargetLeft = rotateByArray(targetVelocity, *ROTATION_45)
+		subTargetRight = rotateByArray(targetVelocity, *inverseRotation(ROTATION_45))
+
+		pathPoints = np.empty((count, self.pathPointsCount + 1, 2))
+		pathOrientations = np.empty((count, self.pathPointsCount + 1))
+		pathPoints[:, 0] = playerPos
+		pathOrientations[:, 0] = velocityToAngleArray(playerVelocity)
+		pathFailed = np.zeros((count, self.pathPointsCount + 1), dtype=bool)
+		isSmoothing = self.filteringMode == "smooth"
+		if isSmoothing:
+			pathVelocities = np.empty((count, self.pathPointsCount + 1, 2))
+			pathContacts = np.zeros((count, self.pathPointsCount + 1), dtype=bool)
+			pathVelocities[:, 0] = playerVelocity
+
+		oldPos = playerPos
+		oldVelocity = playerVelocity
+
+		for i in xrange(self.pathPointsCount):
+			rightCos = dotArray(playerVelocity, targetRight)
+			offset = playerPos - targetPos
+			distanceToTargetDirectionLine = offset[:, 0] * targetVelocity[:, 1] - offset[:, 1] * targetVelocity[:, 0]
+			isAttractionMode = np.abs(distanceToTargetDirectionLine) > attractionDistance
+			side = distanceToTargetDirectionLine > 0
+			sideSign = np.where(side, 1.0, -1.0)
+
+			# attraction
+			subTargetVelocity = np.where(side[:, np.newaxis], subTargetLeft, subTargetRight)
+			newVelocity = np.where(isAttractionMode[:, np.newaxis], playerVelocity + subTargetVelocity, playerVelocity)
+
+			# push away from the target direction line
+			stabilizationFactor = 1 - (np.abs(distanceToTargetDirectionLine) / attractionDistance)
+			relativeRightCos = rightCos * sideSign
+			shouldStickToTargetDirection = ~isAttractionMode & (relativeRightCos < 0.1)
+			isPushingAway = ~isAttractionMode & (relativeRightCos > self.pushAwayTreshold)
+
+			pushedVelocity = playerVelocity + targetRight * (-sideSign * stabilizationFactor * self.pushAwayStrength)[:, np.newaxis]
+			keepsSign = signArray(rightCos) == signArray(dotArray(pushedVelocity, targetRight))
+			newVelocity = np.where((isPushingAway & keepsSign)[:, np.newaxis], pushedVelocity, newVelocity)
+			shouldStickToTargetDirection |= isPushingAway & ~keepsSign
+
+			# stick to the target direction line
+			followTargetVelocity = targetRight * distanceToTargetDirectionLine[:, np.newaxis] + targetFront * (self.playerSpeed * 2)
+			followTargetVelocity = normalizeArray(followTargetVelocity)
+			newVelocity = np.where(shouldStickToTargetDirection[:, np.newaxis], followTargetVelocity, newVelocity)
+
+			playerVelocity = self.filterSteering(oldVelocity, normalizeArray(newVelocity), turnLimit)
+			playerPos = playerPos + playerVelocity * playerSpeed
+
+			# check for constraints violation
+			shouldFilterBackward = np.zeros(count, dtype=bool)
+			rows = np.arange(count)
+			passes = 0
+
+			while rows.size and kernels and passes < self.maxConstraintPasses:
+				pos = playerPos[rows]
+				velocity = playerVelocity[rows]
+				violated = np.zeros(rows.size, dtype=bool)
+
+				for kernel in kernels:
+					violated |= kernel.resolve(oldPos[rows], oldVelocity[rows], pos, velocity)
+
+				playerPos[rows] = pos
+				playerVelocity[rows] = velocity
+				shouldFilterBackward[rows[violated]] = True
+				rows = rows[violated]
+				passes += 1
+
+			pathFailed[rows, i + 1] = passes >= self.maxConstraintPasses
+
+			# store point info in output
+			pathPoints[:, i + 1] = playerPos
+			pathOrientations[:, i + 1] = velocityToAngleArray(playerVelocity)
+
+			if isSmoothing:
+				pathVelocities[:, i + 1] = playerVelocity
+				pathContacts[:, i + 1] = shouldFilterBackward
+				oldPos = playerPos
+				oldVelocity = playerVelocity
+				continue
+
+			# apply backward filtering
+			rows = np.flatnonzero(shouldFilterBackward)
+			lastIndex = 2 if self.backwardFilterWindow is None else max(2, i + 1 - self.backwardFilterWindow)
+			for j in xrange(i + 1, lastIndex, -1):
+				if not rows.size:
+					break
+
+				rows = self.filterBackwardStep(pathPoints, pathOrientations, rows, j, turnLimit)
+
+			oldPos = playerPos
+			oldVelocity = playerVelocity
+
+		if isSmoothing:
+			self.smoothPaths(pathPoints, pathOrientations, pathVelocities, pathContacts, turnLimit, kernels)
+
+		return { "points": pathPoints, "rotations": pathOrientations, "failed": pathFailed }
+
+	def filterSteering(self, currentVelocity, newVelocity, turnLimit):
+		exceeds = dotArray(currentVelocity, newVelocity) < turnLimit.minCos
+		filtered = turnArray(turnLimit, currentVelocity, newVelocity)
+
+		return np.where(exceeds[:, np.newaxis], filtered, newVelocity)
+
+	# PathFindingAlgorithm.smoothPath for every agent, pathPoints holds the unsmoothed points on entry
+	def smoothPaths(self, pathPoints, pathOrientations, pathVelocities, pathContacts, turnLimit, kernels):
+		count, pointsCount = pathContacts.shape
+		stepLengths = lengthArray(np.diff(pathPoints, axis=1))
+		points = pathPoints.copy()
+		headings = pathVelocities.copy()
+		planned = pathPoints.copy()
+		moved = np.zeros((count, pointsCount), dtype=bool)
+
+		reach = np.zeros(count, dtype=int)
+		for k in xrange(pointsCount - 1, 2, -1):
+			reach = np.where(pathContacts[:, k], self.smoothingWindow, reach)
+			isReached = reach > 0
+			reach -= isReached
+			exceeds = dotArray(headings[:, k], headings[:, k - 1]) < turnLimit.minCos
+			reach = np.where(isReached & ~exceeds, 0, reach)
+
+			rows = np.flatnonzero(isReached & exceeds)
+			if not rows.size:
+				continue
+
+			headings[rows, k - 1] = turnArray(turnLimit, headings[rows, k], headings[rows, k - 1])
+			points[rows, k - 2] = points[rows, k - 1] - headings[rows, k - 1] * stepLengths[rows, k - 2][:, np.newaxis]
+			moved[rows, k - 2] = True
+
+			joinStep = points[rows, k - 2] - points[rows, k - 3]
+			joinLength = lengthArray(joinStep)
+			rows = rows[joinLength > 0]
+			headings[rows, k - 2] = joinStep[joinLength > 0] / joinLength[joinLength > 0][:, np.newaxis]
+
+		shifted = np.zeros(count, dtype=bool)
+		for k in xrange(1, pointsCount):
+			exceeds = dotArray(headings[:, k - 1], headings[:, k]) < turnLimit.minCos
+			headings[:, k] = np.where(exceeds[:, np.newaxis], turnArray(turnLimit, headings[:, k - 1], headings[:, k]), headings[:, k])
+			shifted |= exceeds
+
+			step = points[:, k] - points[:, k - 1]
+			step = np.where(exceeds[:, np.newaxis], headings[:, k] * lengthArray(step)[:, np.newaxis], step)
+			pathPoints[:, k] = np.where(shifted[:, np.newaxis], pathPoints[:, k - 1] + step, points[:, k])
+
+			# moved points go back to the planned ones when blocked, up to smoothingWindow steps before them are backward filtered
+			rows = np.flatnonzero(shifted | moved[:, k])
+			blocked = np.zeros(rows.size, dtype=bool)
+			for kernel in kernels:
+				blocked |= kernel.violated(pathPoints[rows, k], headings[rows, k])
+			rows = rows[blocked]
+
+			pathPoints[rows, k] = planned[rows, k]
+			headings[rows, k] = pathVelocities[rows, k]
+			shifted[rows] = False
+			pathOrientations[:, k] = velocityToAngleArray(headings[:, k])
+
+			blockedRows = rows
+			for j in xrange(k, max(2, k - self.smoothingWindow), -1):
+				if not rows.size:
+					break
+
+				rows = self.filterBackwardStep(pathPoints, pathOrientations, rows, j, turnLimit)
+
+			# the filtered points are checked too, blocked ones go back to the planned ones
+			for j in xrange(max(1, k - self.smoothingWindow), k):
+				if not blockedRows.size:
+					break
+
+				blocked = np.zeros(blockedRows.size, dtype=bool)
+				for kernel in kernels:
+					blocked |= kernel.violated(pathPoints[blockedRows, j], angleToVelocityArray(pathOrientations[blockedRows, j]))
+				rows = blockedRows[blocked]
+				pathPoints[rows, j] = planned[rows, j]
+				pathOrientations[rows, j] = velocityToAngleArray(pathVelocities[rows, j])
+
+	# One backward filtering step for the given agents, returns the agents that still need filtering
+	def filterBackwardStep(self, pathPoints, pathOrientations, rows, j, turnLimit):
+		srcVelocity = -angleToVelocityArray(pathOrientations[rows, j])
+		destVelocity = -angleToVelocityArray(pathOrientations[rows, j - 1])
+
+		filtered = dotArray(srcVelocity, destVelocity) < turnLimit.minCos
+		rows = rows[filtered]
+		srcVelocity = srcVelocity[filtered]
+		destVelocity = destVelocity[filtered]
+
+		filteredVelocity = turnArray(turnLimit, srcVelocity, destVelocity)
+
+		pathPoints[rows, j - 1] = pathPoints[rows, j] + filteredVelocity * self.playerSpeed
+		pathOrientations[rows, j - 1] = velocityToAngleArray(-filteredVelocity)
+		diff = normalizeArray(pathPoints[rows, j - 1] - pathPoints[rows, j - 2])
+		pathOrientations[rows, j - 2] = velocityToAngleArray(diff)
+
+		return rows
@@ -0,0 +1,216 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import scenario
+from pathfinder import PathFindingAlgorithm
+from smath import radians
+from spatialindex import ConstraintGrid
+from tracing import Tracer, MemorySink
+
+# ==================================
+
+CIRCLE_MARGIN = 20
+MIN_RADIUS = 5
+MAX_RADIUS = 30
+
+# Generates condition.json and obstacles.json data: a corridor between two polyline walls with
+# the player on the left, the target on the right and non overlapping circles in between.
+# The corridor area grows with the obstacles count so the density stays the same
+def generateScenario(rng, obstaclesCount, speed=40, maxSteering=10, wallPointsCount=8, density=25.0):
+	height = max(900.0, math.sqrt(obstaclesCount * 1e6 / density / 3.0))
+	width = height * 3.0
+
+	playerPosition = (100.0, height / 2 + rng.uniform(-100, 100))
+	targetPosition = (width - 300.0, height / 2 + rng.uniform(-100, 100))
+	playerAngle = radians(rng.uniform(-45, 45))
+	targetAngle = radians(rng.uniform(-60, 60))
+
+	condition = {
+		"player": {
+			"position": { "x": playerPosition[0], "y": playerPosition[1] },
+			"direction": { "x": math.cos(playerAngle), "y": math.sin(playerAngle) },
+			"speed": speed,
+			"maxSteering": maxSteering,
+		},
+		"target": {
+			"position": { "x": targetPosition[0], "y": targetPosition[1] },
+			"direction": { "x": math.cos(targetAngle), "y": math.sin(targetAngle) },
+		},
+	}
+
+	data = []
+	for wallY in (0.0, height):
+		points = []
+		for i in xrange(wallPointsCount):
+			x = width * i / float(max(wallPointsCount - 1, 1))
+			points.append({ "x": x, "y": wallY + rng.uniform(-40, 40) })
+		data.append({ "type": "polyline", "points": points })
+
+	# circles keep clear of each other, the walls and the player start, spacing is checked with a spatial hash
+	spacing = MAX_RADIUS * 2 + CIRCLE_MARGIN * 2 + speed
+	cells = {}
+	wallClearance = MAX_RADIUS + CIRCLE_MARGIN * 2 + 40
+	playerClearance = MAX_RADIUS + CIRCLE_MARGIN + speed * 2
+
+	for i in xrange(obstaclesCount):
+		for attempt in xrange(50):
+			x = rng.uniform(0, width)
+			y = rng.uniform(wallClearance, height - wallClearance)
+			if (x - playerPosition[0]) ** 2 + (y - playerPosition[1]) ** 2 < playerClearance ** 2:
+				continue
+
+			cell = (int(x // spacing), int(y // spacing))
+			neighbours = [cells.get((cell[0] + dx, cell[1] + dy)) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+			if any(n is not None and (n[0] - x) ** 2 + (n[1] - y) ** 2 < spacing ** 2 for n in neighbours):
+				continue
+
+			cells[cell] = (x, y)
+			data.append({ "type": "circle", "position": { "x": x, "y": y }, "radius": rng.uniform(MIN_RADIUS, MAX_RADIUS) })
+			break
+
+	return (condition, { "data": data })
+
+# ==================================
+
+def percentile(sortedValues, fraction):
+	if not sortedValues:
+		return 0.0
+
+	index = int(math.ceil(fraction * len(sortedValues))) - 1
+	return sortedValues[min(max(index, 0), len(sortedValues) - 1)]
+
+# Plans every scenario once for latency and once more with a tracer attached for the per phase timing
+def runCell(scenarios, pathPointsCount, useIndex, filteringMode="backward", continuousCollision=False):
+	pathfinder = PathFindingAlgorithm()
+	pathfinder.pathPointsCount = pathPointsCount
+	pathfinder.filteringMode = filteringMode
+	pathfinder.continuousCollision = continuousCollision
+	traceSink = MemorySink()
+	tracer = Tracer(traceSink)
+
+	latencies = []
+	pointsCount = 0
+	failures = 0
+
+	for conditionData, obstaclesData in scenarios:
+		constraints = scenario.loadConstraints(obstaclesData)
+		condition = scenario.parseCondition(conditionData)
+		pathfinder.constraints = constraints
+		pathfinder.constraintIndex = ConstraintGrid.fromConstraints(constraints) if useIndex else None
+		pathfinder.maxSteeringAngle = radians(conditionData['player']['maxSteering'])
+
+		pathfinder.tracer = None
+		path = scenario.planCondition(pathfinder, condition)
+		latencies.append(pathfinder.executionTime)
+		pointsCount += len(path['points'])
+		# steps left violating a constraint after maxConstraintPasses
+		if path['failedSteps']:
+			failures += 1
+
+		pathfinder.tracer = tracer
+		scenario.planCondition(pathfinder, condition)
+
+	totalTime = sum(latencies)
+	latencies.sort()
+	trace = traceSink.summary()
+
+	return {
+		"scenarios": len(scenarios),
+		"failures": failures,
+		"points": pointsCount,
+		"totalTime": totalTime,
+		"pointsPerSecond": pointsCount / totalTime if totalTime > 0 else 0.0,
+		"latencyMean": totalTime / len(latencies) if latencies else 0.0,
+		"latencyP50": percentile(latencies, 0.5),
+		"latencyP99": percentile(latencies, 0.99),
+		"phases": trace["phases"],
+		"counters": trace["counters"],
+	}
+
+def getRevision():
+	try:
+		directory = os.path.dirname(os.path.abspath(__file__))
+		with open(os.devnull, 'w') as devnull:
+			return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=directory, stderr=devnull).decode('ascii').strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def runBenchmark(seed, obstaclesCounts, pathPointsCounts, steeringAngles, scenariosCount, useIndex=True, dumpDirectory=None, filteringMode="backward", continuousCollision=False):
+	results = []
+
+	for obstaclesCount in obstaclesCounts:
+		for maxSteering in steeringAngles:
+			rng = random.Random("%s-%d-%s" % (seed, obstaclesCount, maxSteering))
+			scenarios = [generateScenario(rng, obstaclesCount, maxSteering=maxSteering) for i in xrange(scenariosCount)]
+
+			if dumpDirectory is not None:
+				for i, (conditionData, obstaclesData) in enumerate(scenarios):
+					name = "%d_%s_%d" % (obstaclesCount, maxSteering, i)
+					with open(os.path.join(dumpDirectory, "condition_%s.json" % name), 'w') as f:
+						json.dump(conditionData, f, indent=4)
+					with open(os.path.join(dumpDirectory, "obstacles_%s.json" % name), 'w') as f:
+						json.dump(obstaclesData, f, indent=4)
+
+			for pathPointsCount in pathPointsCounts:
+				result = runCell(scenarios, pathPointsCount, useIndex, filteringMode, continuousCollision)
+				result["obstacles"] = obstaclesCount
+				result["maxSteering"] = maxSteering
+				result["pathPointsCount"] = pathPointsCount
+				results.append(result)
+
+	return {
+		"meta": {
+			"revision": getRevision(),
+			"python": platform.python_version(),
+			"platform": platform.platform(),
+			"seed": seed,
+			"scenarios": scenariosCount,
+			"index": useIndex,
+			"filtering": filteringMode,
+			"continuous": continuousCollision,
+		},
+		"results": results,
+	}
+
+# ==================================
+
+def parseList(text, itemType):
+	return [itemType(item) for item in text.split(',') if item]
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Times getPath over generated scenarios and reports JSON.')
+	parser.add_argument('--seed', default='0')
+	parser.add_argument('--obstacles', default='0,10,100,1000', help='comma separated circle counts')
+	parser.add_argument('--path-points', default='40,160', help='comma separated pathPointsCount values')
+	parser.add_argument('--steering', default='10,20,45', help='comma separated max steering angles in degrees')
+	parser.add_argument('--scenarios', type=int, default=20, help='scenarios per obstacles count and steering angle')
+	parser.add_argument('--no-index', action='store_true', help='check constraints without the spatial index')
+	parser.add_argument('--filtering', default='backward', choices=('backward', 'smooth'), help='backward filtering or windowed smoothing')
+	parser.add_argument('--continuous', action='store_true', help='use swept constraint tests')
+	parser.add_argument('--dump', default=None, help='directory to write the generated condition/obstacles files to')
+	parser.add_argument('-o', '--output', default='-', help='JSON report file, stdout if omitted or -')
+	args = parser.parse_args(argv)
+
+	report = runBenchmark(args.seed, parseList(args.obstacles, int), parseList(args.path_points, int),
+		parseList(args.steering, float), args.scenarios, not args.no_index, args.dump, args.filtering, args.continuous)
+
+	if args.output == '-':
+		json.dump(report, sys.stdout, indent=4, sort_keys=True)
+		sys.stdout.write('\n')
+	else:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=4, sort_keys=True)
+
+	return 0
+
+# ==================================
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
+
+# ==================================
@@ -1,5 +1,8 @@
-from smath import vec2f, rotate, degrees
+from smath import vec2f, rotation, rotateBy, inverseRotation, radians, dot, cross, clamp
+from array import array
+from itertools import izip
 import math
+import threading
 
 # ==================================
 
@@ -7,46 +10,63 @@ class Constraint(object):
 	def __init__(self):
 		pass
 
-	def suggestPoint(self, point, velocity):
+	# Returns a (point, velocity) replacing a violating step from prevPoint. side asks to pass the constraint
+	# turning left (1) or right (-1), constraints without a choice ignore it
+	def suggestPoint(self, prevPoint, prevVelocity, point, velocity, side=None):
 		return (point, velocity)
 
 	def willViolate(self, point, velocity):
 		return False
 
+	# Swept test of the step from start to end: returns the earliest fraction of the step in [0, 1]
+	# at which the constraint is violated, None if the whole step is clear
+	def timeOfImpact(self, start, end):
+		return 1.0 if self.willViolate(end, end - start) else None
+
+	# Axis aligned box (minX, minY, maxX, maxY) outside of which the constraint is never violated,
+	# None if the constraint may be violated anywhere
+	def getBounds(self):
+		return None
+
 # ==================================
 
+# Extra turn past the tangent, keeps suggested points clear of the violation distance
+TANGENT_SLACK = rotation(radians(2))
+CIRCLE_MARGIN = 20
+
 class CircleCollisionConstraint(Constraint):
 	def __init__(self, center, radius):
 		super(CircleCollisionConstraint, self).__init__()
 
 		self.center = center
 		self.radius = radius
-		self.margin = 20
+		self.margin = CIRCLE_MARGIN
 
 		self.violateDistance = self.radius + self.margin
 		self.violateDistanceSq = self.violateDistance ** 2
-		self.distanceSq = 0
 	
-	def suggestPoint(self, prevPoint, prevVelocity, point, velocity):
+	def suggestPoint(self, prevPoint, prevVelocity, point, velocity, side=None):
 		# get tangent point
 		toCenter = self.center - prevPoint
-		print('toCenter: %s' % toCenter)
-		print('prevPoint: %s' % prevPoint)
 		distanceToCenter = toCenter.length()
-		print('distanceToCenter: %1.3f' % distanceToCenter)
-		sin = self.violateDistance / distanceToCenter
-		print('sin: %1.3f' % sin)
+		sin = min(self.violateDistance / distanceToCenter, 1.0)
 		cos = math.sqrt(1.0 - sin ** 2)
-		print('cos: %1.3f' % cos)
-		angle = math.asin(sin)
-		print('angle: %1.3f' % angle)
 		
 		distanceToLine = (point.x - self.center.x) * toCenter.y - (point.y - self.center.y) * toCenter.x
-		print(distanceToLine)
 		sideSign = -1 if distanceToLine > 0 else 1
+		if side is not None:
+			sideSign = side
 
+		# sin and cos already describe the tangent angle, rotate by it and then by the slack
 		toCenter.normalize()
-		rotatedVector = rotate(toCenter, (degrees(angle) + 2) * sideSign)
+		tangentRotation = (cos, sin * sideSign)
+		slackRotation = TANGENT_SLACK if sideSign > 0 else inverseRotation(TANGENT_SLACK)
+		rotatedVector = rotateBy(rotateBy(toCenter, tangentRotation), slackRotation)
+
+		# the previous point is already inside, push it out to the violation distance keeping the tangent direction
+		if sin >= 1.0:
+			return (self.center - toCenter * self.violateDistance, rotatedVector)
+
 		point = prevPoint + rotatedVector * (distanceToCenter * cos)
 		velocity = point - prevPoint
 		velocity.normalize()
@@ -54,24 +74,271 @@ class CircleCollisionConstraint(Constraint):
 		return (point, velocity)
 
 	def willViolate(self, point, velocity):
-		self.targetOffset = point - self.center
-		self.distanceSq = self.targetOffset.lengthSq()
-		
-		return self.distanceSq < self.violateDistanceSq
+		return (point - self.center).lengthSq() < self.violateDistanceSq
+
+	# Steps starting inside only count when they end inside too, as with willViolate
+	def timeOfImpact(self, start, end):
+		startOffset = start - self.center
+		c = startOffset.lengthSq() - self.violateDistanceSq
+		if c < 0:
+			return 1.0 if (end - self.center).lengthSq() < self.violateDistanceSq else None
+
+		return sweepCircle(startOffset, end - start, self.violateDistanceSq)
+
+	def getBounds(self):
+		return (self.center.x - self.violateDistance, self.center.y - self.violateDistance,
+			self.center.x + self.violateDistance, self.center.y + self.violateDistance)
 
 # ==================================
 
+# Flat per-segment layout of PolylineCollisionConstraint.segments
+SEGMENT_STRIDE = 10
+SEGMENT_START_X, SEGMENT_START_Y, SEGMENT_DIR_X, SEGMENT_DIR_Y, SEGMENT_LENGTH, SEGMENT_INV_LENGTH, \
+	SEGMENT_MIN_X, SEGMENT_MIN_Y, SEGMENT_MAX_X, SEGMENT_MAX_Y = range(SEGMENT_STRIDE)
+
 class PolylineCollisionConstraint(Constraint):
-	def __init__(self, points):
+	def __init__(self, points, margin=20):
 		super(PolylineCollisionConstraint, self).__init__()
 
 		self.points = points
+		self.margin = margin
+		self.violateDistance = self.margin
+		self.violateDistanceSq = self.violateDistance ** 2
+
+		# Segment lookup grid, polylines with few segments are scanned directly
+		self.gridThreshold = 8
+		self.cellSize = max(self.violateDistance * 4.0, 1.0)
+		self.cells = None
+
+		self.buildSegments()
+
+	def buildSegments(self):
+		self.segments = array('d')
+		self.segmentsCount = max(len(self.points) - 1, 0)
+		pad = self.violateDistance
+
+		for i in xrange(self.segmentsCount):
+			a = self.points[i]
+			b = self.points[i + 1]
+			delta = b - a
+			length = delta.length()
+			invLength = 1.0 / length if length > 0 else 0.0
+
+			self.segments.extend((a.x, a.y, delta.x * invLength, delta.y * invLength, length, invLength,
+				min(a.x, b.x) - pad, min(a.y, b.y) - pad, max(a.x, b.x) + pad, max(a.y, b.y) + pad))
+
+		if self.points:
+			xs = [point.x for point in self.points]
+			ys = [point.y for point in self.points]
+			self.bounds = (min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad)
+		else:
+			self.bounds = None
+
+		if self.segmentsCount > self.gridThreshold:
+			self.buildGrid()
+
+	def buildGrid(self):
+		self.cells = {}
+		invCellSize = 1.0 / self.cellSize
+		segments = self.segments
+
+		for i in xrange(self.segmentsCount):
+			offset = i * SEGMENT_STRIDE
+			x0 = int(math.floor(segments[offset + SEGMENT_MIN_X] * invCellSize))
+			y0 = int(math.floor(segments[offset + SEGMENT_MIN_Y] * invCellSize))
+			x1 = int(math.floor(segments[offset + SEGMENT_MAX_X] * invCellSize))
+			y1 = int(math.floor(segments[offset + SEGMENT_MAX_Y] * invCellSize))
+
+			for x in xrange(x0, x1 + 1):
+				for y in xrange(y0, y1 + 1):
+					self.cells.setdefault((x, y), []).append(i)
+
+	def candidateSegments(self, point):
+		if self.cells is None:
+			return xrange(self.segmentsCount)
+
+		key = (int(math.floor(point.x / self.cellSize)), int(math.floor(point.y / self.cellSize)))
+		return self.cells.get(key, ())
+
+	# Returns (distanceSq, closestX, closestY, segmentIndex) of the nearest segment inside the violation
+	# distance of the point, None if there is no such segment
+	def nearestSegment(self, point):
+		segments = self.segments
+		px = point.x
+		py = point.y
+		nearest = None
+		nearestDistanceSq = self.violateDistanceSq
+
+		for i in self.candidateSegments(point):
+			offset = i * SEGMENT_STRIDE
+			if px < segments[offset + SEGMENT_MIN_X] or px > segments[offset + SEGMENT_MAX_X] or \
+				py < segments[offset + SEGMENT_MIN_Y] or py > segments[offset + SEGMENT_MAX_Y]:
+				continue
+
+			ax = segments[offset + SEGMENT_START_X]
+			ay = segments[offset + SEGMENT_START_Y]
+			dirX = segments[offset + SEGMENT_DIR_X]
+			dirY = segments[offset + SEGMENT_DIR_Y]
+			t = clamp((px - ax) * dirX + (py - ay) * dirY, 0.0, segments[offset + SEGMENT_LENGTH])
+			closestX = ax + dirX * t
+			closestY = ay + dirY * t
+			distanceSq = (px - closestX) ** 2 + (py - closestY) ** 2
+
+			if distanceSq < nearestDistanceSq:
+				nearestDistanceSq = distanceSq
+				nearest = (distanceSq, closestX, closestY, i)
+
+		return nearest
+
+	# Slides the step along the nearest segment and pushes the result out of the violation distance
+	def suggestPoint(self, prevPoint, prevVelocity, point, velocity, side=None):
+		nearest = self.nearestSegment(point)
+		if nearest is not None:
+			segmentIndex = nearest[3]
+		else:
+			# the step may have passed through the polyline, slide along the first segment it crossed
+			hit = self.sweepSegments(prevPoint, point)
+			if hit is None:
+				return (point, velocity)
+			segmentIndex = hit[1]
+
+		offset = segmentIndex * SEGMENT_STRIDE
+		tangent = vec2f(self.segments[offset + SEGMENT_DIR_X], self.segments[offset + SEGMENT_DIR_Y])
+		step = point - prevPoint
+		if side is not None and cross(step, tangent) != 0:
+			if cross(step, tangent) * side < 0:
+				tangent = -tangent
+		elif dot(step, tangent) < 0:
+			tangent = -tangent
+
+		point = prevPoint + tangent * step.length()
+
+		for i in xrange(4):
+			nearest = self.nearestSegment(point)
+			if nearest is None:
+				break
+
+			# push away from the closest point, towards the side of the previous point if exactly on the line
+			pushDirection = vec2f(point.x - nearest[1], point.y - nearest[2])
+			if pushDirection.lengthSq() < 1e-12:
+				segmentOffset = nearest[3] * SEGMENT_STRIDE
+				pushDirection = vec2f(-self.segments[segmentOffset + SEGMENT_DIR_Y], self.segments[segmentOffset + SEGMENT_DIR_X])
+				if dot(prevPoint - point, pushDirection) < 0:
+					pushDirection = -pushDirection
+
+			pushDirection.normalize()
+			point = vec2f(nearest[1], nearest[2]) + pushDirection * (self.violateDistance + 0.5)
+
+		velocity = point - prevPoint
+		if velocity.lengthSq() > 0:
+			velocity.normalize()
+		else:
+			velocity = prevVelocity
 
-	def suggestPoint(self, point, velocity):
 		return (point, velocity)
 
 	def willViolate(self, point, velocity):
-		return False
+		return self.nearestSegment(point) is not None
+
+	# Returns (time, segmentIndex) of the first segment the step from start to end comes within
+	# the violation distance of, None if there is no such segment
+	def sweepSegments(self, start, end):
+		segments = self.segments
+		margin = self.violateDistance
+		delta = end - start
+		minX = min(start.x, end.x)
+		minY = min(start.y, end.y)
+		maxX = max(start.x, end.x)
+		maxY = max(start.y, end.y)
+		first = None
+
+		for i in self.candidateSegmentsInBox(minX, minY, maxX, maxY):
+			offset = i * SEGMENT_STRIDE
+			if maxX < segments[offset + SEGMENT_MIN_X] or minX > segments[offset + SEGMENT_MAX_X] or \
+				maxY < segments[offset + SEGMENT_MIN_Y] or minY > segments[offset + SEGMENT_MAX_Y]:
+				continue
+
+			ax = segments[offset + SEGMENT_START_X]
+			ay = segments[offset + SEGMENT_START_Y]
+			dirX = segments[offset + SEGMENT_DIR_X]
+			dirY = segments[offset + SEGMENT_DIR_Y]
+			length = segments[offset + SEGMENT_LENGTH]
+
+			# step in segment space: u along the segment, v across it
+			u0 = (start.x - ax) * dirX + (start.y - ay) * dirY
+			v0 = (start.y - ay) * dirX - (start.x - ax) * dirY
+			du = delta.x * dirX + delta.y * dirY
+			dv = delta.y * dirX - delta.x * dirY
+
+			t = sweepCapsule(u0, v0, du, dv, length, margin)
+			if t is not None and (first is None or t < first[0]):
+				first = (t, i)
+
+		return first
+
+	def candidateSegmentsInBox(self, minX, minY, maxX, maxY):
+		if self.cells is None:
+			return xrange(self.segmentsCount)
+
+		invCellSize = 1.0 / self.cellSize
+		x0 = int(math.floor(minX * invCellSize))
+		y0 = int(math.floor(minY * invCellSize))
+		x1 = int(math.floor(maxX * invCellSize))
+		y1 = int(math.floor(maxY * invCellSize))
+
+		found = set()
+		for x in xrange(x0, x1 + 1):
+			for y in xrange(y0, y1 + 1):
+				found.update(self.cells.get((x, y), ()))
+
+		return sorted(found)
+
+	# Steps starting inside only count when they end inside too, as with willViolate
+	def timeOfImpact(self, start, end):
+		if self.nearestSegment(start) is not None:
+			return 1.0 if self.nearestSegment(end) is not None else None
+
+		hit = self.sweepSegments(start, end)
+		return hit[0] if hit is not None else None
+
+	def getBounds(self):
+		return self.bounds
+
+# ==================================
+
+# Earliest t in [0, 1] at which offset + delta * t enters the circle of the given squared radius
+# around the origin, None if it doesn't. Offset is expected outside the circle
+def sweepCircle(offset, delta, radiusSq):
+	a = delta.lengthSq()
+	b = dot(offset, delta)
+	if a == 0 or b >= 0:
+		return None
+
+	discriminant = b * b - a * (offset.lengthSq() - radiusSq)
+	if discriminant <= 0:
+		return None
+
+	t = (-b - math.sqrt(discriminant)) / a
+	return t if t <= 1.0 else None
+
+# Earliest t in [0, 1] at which (u0 + du * t, v0 + dv * t) comes within margin of the segment from
+# the origin to (length, 0), None if it doesn't. The start is expected outside the margin
+def sweepCapsule(u0, v0, du, dv, length, margin):
+	first = None
+
+	# side of the capsule facing the start
+	if dv != 0 and abs(v0) >= margin:
+		t = ((margin if v0 > 0 else -margin) - v0) / dv
+		if 0 <= t <= 1.0 and 0 <= u0 + du * t <= length:
+			first = t
+
+	# rounded ends
+	for endU in (0.0, length):
+		t = sweepCircle(vec2f(u0 - endU, v0), vec2f(du, dv), margin * margin)
+		if t is not None and (first is None or t < first):
+			first = t
+
+	return first
 
 # ==================================
 
@@ -95,24 +362,178 @@ class ConstraintFactory():
 		return constraint
 
 	def fromPolylineShape(self, shapeDef):
-		points = shapeDef['points']
+		points = [vec2f(point['x'], point['y']) for point in shapeDef['points']]
 		constraint = PolylineCollisionConstraint(points)
 		return constraint
 
+	# Constraints of an obstaclestore.ObstacleStore, each one built on first access
+	def fromStore(self, store):
+		return LazyConstraintList(store, self)
+
+	def fromStoreCircle(self, store, index):
+		x, y, radius = store.circle(index)
+		return CircleCollisionConstraint(vec2f(x, y), radius)
+
+	def fromStorePolyline(self, store, index):
+		margin, xs, ys = store.polyline(index)
+		return PolylineCollisionConstraint([vec2f(x, y) for x, y in izip(xs, ys)], margin)
+
 # ==================================
 
-# Tries to join 2 circle constraints. If succeeded, new constraint is placed inside a instance
-def tryJoinCircleConstraints(a, b, maxSpacing):
-	distanceVector = a.center - b.center
-	distance = distanceVector.length()
+# List of constraints counting its changes in version, so caches over it don't have to compare the constraints.
+# Call changed() after moving or reshaping a constraint in place
+class ConstraintList(list):
+	def __init__(self, constraints=()):
+		super(ConstraintList, self).__init__(constraints)
+		self.version = 0
+
+	def changed(self):
+		self.version += 1
+
+	def __reduce__(self):
+		return (ConstraintList, (list(self),))
+
+	def append(self, constraint):
+		self.version += 1
+		list.append(self, constraint)
+
+	def extend(self, constraints):
+		self.version += 1
+		list.extend(self, constraints)
+
+	def insert(self, index, constraint):
+		self.version += 1
+		list.insert(self, index, constraint)
+
+	def remove(self, constraint):
+		self.version += 1
+		list.remove(self, constraint)
+
+	def pop(self, *args):
+		self.version += 1
+		return list.pop(self, *args)
+
+	def sort(self, *args, **kwargs):
+		self.version += 1
+		list.sort(self, *args, **kwargs)
+
+	def reverse(self):
+		self.version += 1
+		list.reverse(self)
+
+	def __setitem__(self, index, value):
+		self.version += 1
+		list.__setitem__(self, index, value)
+
+	def __delitem__(self, index):
+		self.version += 1
+		list.__delitem__(self, index)
+
+	def __setslice__(self, start, end, values):
+		self.version += 1
+		list.__setslice__(self, start, end, values)
+
+	def __delslice__(self, start, end):
+		self.version += 1
+		list.__delslice__(self, start, end)
+
+	def __iadd__(self, constraints):
+		self.extend(constraints)
+		return self
+
+# Read-only sequence over the obstacles of a store in the order of the source list. Constraints are built
+# when first accessed and kept, bounds come straight from the store without building anything.
+# Building is locked, so threads sharing the list always get the same constraint objects
+class LazyConstraintList(object):
+	def __init__(self, store, factory):
+		self.store = store
+		self.factory = factory
+		self.built = {}
+		self.indices = {}
+		self.lock = threading.Lock()
+		# the store never changes
+		self.version = 0
+
+	def __len__(self):
+		return self.store.circlesCount + self.store.polylinesCount
+
+	def __iter__(self):
+		for index in xrange(len(self)):
+			yield self[index]
+
+	def __getitem__(self, index):
+		if index < 0:
+			index += len(self)
+		if index < 0 or index >= len(self):
+			raise IndexError(index)
+
+		constraint = self.built.get(index)
+		if constraint is not None:
+			return constraint
+
+		with self.lock:
+			constraint = self.built.get(index)
+			if constraint is None:
+				storeIndex = self.store.obstacleIndex(index)
+				if storeIndex < self.store.circlesCount:
+					constraint = self.factory.fromStoreCircle(self.store, storeIndex)
+				else:
+					constraint = self.factory.fromStorePolyline(self.store, storeIndex - self.store.circlesCount)
+
+				self.indices[id(constraint)] = index
+				self.built[index] = constraint
+
+		return constraint
+
+	# Index of a constraint built by this list, None for any other constraint
+	def indexOf(self, constraint):
+		return self.indices.get(id(constraint))
+
+	def getBounds(self, index):
+		index = self.store.obstacleIndex(index)
+		if index < self.store.circlesCount:
+			x, y, radius = self.store.circle(index)
+			violateDistance = radius + CIRCLE_MARGIN
+			return (x - violateDistance, y - violateDistance, x + violateDistance, y + violateDistance)
+
+		index -= self.store.circlesCount
+		margin = self.store.polylineMargin(index)
+		minX, minY, maxX, maxY = self.store.polylineBounds(index)
+		return (minX - margin, minY - margin, maxX + margin, maxY + margin)
+
+# ==================================
+
+# Smallest circle (center, radius) enclosing both circles
+def enclosingCircle(centerA, radiusA, centerB, radiusB):
+	offset = centerB - centerA
+	distance = offset.length()
+
+	if distance + radiusB <= radiusA:
+		return (centerA, radiusA)
+	if distance + radiusA <= radiusB:
+		return (centerB, radiusB)
+
+	radius = (distance + radiusA + radiusB) * 0.5
+	return (centerA + offset * ((radius - radiusA) / distance), radius)
+
+# Tries to join 2 circle constraints. If succeeded, a is replaced by a circle enclosing both of them.
+# Circles are joined when the gap between them is below maxSpacing and the result is not larger than maxRadius
+def tryJoinCircleConstraints(a, b, maxSpacing, maxRadius=None):
+	distance = (a.center - b.center).length()
 	availableDistance = a.radius + b.radius + maxSpacing
 
-	# Join constraints
-	if distance < availableDistance:
-		a.radius = distance / 2.0
-		a.center = (a.center + b.center) / 2.0
-		return True
+	if distance >= availableDistance:
+		return False
 
-	return False
+	center, radius = enclosingCircle(a.center, a.radius, b.center, b.radius)
+	if maxRadius is not None and radius > maxRadius and radius > max(a.radius, b.radius):
+		return False
+
+	# Join constraints
+	a.center = center
+	a.radius = radius
+	a.violateDistance = a.radius + a.margin
+	a.violateDistanceSq = a.violateDistance ** 2
+	return True
 
 # ==================================
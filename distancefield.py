@@ -0,0 +1,374 @@
+import hashlib
+import math
+import struct
+import numpy as np
+import constraints
+from smath import vec2f
+from spatialindex import ConstraintGrid
+
+# ==================================
+
+FIELD_MAGIC = b'VMDF'
+FIELD_VERSION = 1
+HEADER_FORMAT = '<4sI20sdddIId'
+
+# ==================================
+
+# Signed distance to the violation boundary of circle and polyline constraints, sampled on a regular grid.
+# Negative values are inside a violation distance, values are clamped to maxDistance away from obstacles.
+# Every sample also keeps the unit direction away from its nearest obstacle, bilinear lookups of both
+# replace the per constraint tests. Other constraint types are not rasterized. Obstacles added or moved
+# past the sampled area grow it. version counts the edits, every index in dependentIndexes is marked changed with it
+class DistanceField(object):
+	def __init__(self, bounds, resolution=4.0, maxDistance=32.0):
+		self.resolution = float(resolution)
+		self.maxDistance = float(maxDistance)
+		self.originX = bounds[0]
+		self.originY = bounds[1]
+		self.width = int(math.ceil((bounds[2] - bounds[0]) / self.resolution)) + 1
+		self.height = int(math.ceil((bounds[3] - bounds[1]) / self.resolution)) + 1
+
+		self.values = np.full((self.height, self.width), self.maxDistance)
+		self.gradients = np.zeros((self.height, self.width, 2))
+		self.index = ConstraintGrid(max(self.maxDistance * 4.0, self.resolution * 16.0))
+		self.digest = None
+		self.version = 0
+		self.dependentIndexes = []
+
+	@staticmethod
+	def fromConstraints(constraintsList, resolution=4.0, maxDistance=32.0, padding=None):
+		rasterized = [c for c in constraintsList if isRasterizable(c)]
+		padding = maxDistance if padding is None else padding
+		bounds = [c.getBounds() for c in rasterized]
+		bounds = [b for b in bounds if b is not None] or [(0.0, 0.0, 0.0, 0.0)]
+
+		field = DistanceField((min(b[0] for b in bounds) - padding, min(b[1] for b in bounds) - padding,
+			max(b[2] for b in bounds) + padding, max(b[3] for b in bounds) + padding), resolution, maxDistance)
+		for constraint in rasterized:
+			field.index.insert(constraint)
+			field.stamp(constraint, field.getRegion(constraint.getBounds()))
+
+		field.digest = getConstraintsDigest(rasterized, resolution, maxDistance)
+		return field
+
+	# Loads the field from cachePath when it was built from the same constraints and settings, otherwise
+	# builds it and writes the cache
+	@staticmethod
+	def fromConstraintsCached(constraintsList, cachePath, resolution=4.0, maxDistance=32.0):
+		rasterized = [c for c in constraintsList if isRasterizable(c)]
+		digest = getConstraintsDigest(rasterized, resolution, maxDistance)
+
+		field = DistanceField.load(cachePath, digest)
+		if field is not None:
+			for constraint in rasterized:
+				field.index.insert(constraint)
+			return field
+
+		field = DistanceField.fromConstraints(rasterized, resolution, maxDistance)
+		field.save(cachePath)
+		return field
+
+	# ==================================
+
+	# Sample index range (i0, j0, i1, j1) affected by an obstacle with the given violation bounds
+	def getRegion(self, bounds):
+		if bounds is None:
+			return (0, 0, self.width, self.height)
+
+		i0, j0, i1, j1 = self.getSampleRange(bounds)
+		return (max(i0, 0), max(j0, 0), min(i1, self.width), min(j1, self.height))
+
+	# Like getRegion, but not clipped to the samples of the field
+	def getSampleRange(self, bounds):
+		invResolution = 1.0 / self.resolution
+		i0 = int(math.floor((bounds[0] - self.maxDistance - self.originX) * invResolution))
+		j0 = int(math.floor((bounds[1] - self.maxDistance - self.originY) * invResolution))
+		i1 = int(math.ceil((bounds[2] + self.maxDistance - self.originX) * invResolution)) + 1
+		j1 = int(math.ceil((bounds[3] + self.maxDistance - self.originY) * invResolution)) + 1
+		return (i0, j0, i1, j1)
+
+	# Adds samples at maxDistance around the field until it covers the region of the bounds.
+	# The origin moves by whole samples, so existing samples keep their positions and values
+	def growToInclude(self, bounds):
+		if bounds is None:
+			return
+
+		i0, j0, i1, j1 = self.getSampleRange(bounds)
+		i0 = min(i0, 0)
+		j0 = min(j0, 0)
+		i1 = max(i1, self.width)
+		j1 = max(j1, self.height)
+		if i0 == 0 and j0 == 0 and i1 == self.width and j1 == self.height:
+			return
+
+		values = np.full((j1 - j0, i1 - i0), self.maxDistance)
+		gradients = np.zeros((j1 - j0, i1 - i0, 2))
+		values[-j0:self.height - j0, -i0:self.width - i0] = self.values
+		gradients[-j0:self.height - j0, -i0:self.width - i0] = self.gradients
+
+		self.values = values
+		self.gradients = gradients
+		self.originX += i0 * self.resolution
+		self.originY += j0 * self.resolution
+		self.width = i1 - i0
+		self.height = j1 - j0
+
+	def getRegionPositions(self, region):
+		i0, j0, i1, j1 = region
+		xs = self.originX + np.arange(i0, i1) * self.resolution
+		ys = self.originY + np.arange(j0, j1) * self.resolution
+		return np.meshgrid(xs, ys)
+
+	# Merges the distance to a constraint into the samples of the region
+	def stamp(self, constraint, region):
+		i0, j0, i1, j1 = region
+		if i0 >= i1 or j0 >= j1:
+			return
+
+		xs, ys = self.getRegionPositions(region)
+		if isinstance(constraint, constraints.CircleCollisionConstraint):
+			self.stampPoint(region, xs, ys, constraint.center.x, constraint.center.y, constraint.violateDistance)
+			return
+
+		segments = constraint.segments
+		for k in xrange(constraint.segmentsCount):
+			offset = k * constraints.SEGMENT_STRIDE
+			ax = segments[offset + constraints.SEGMENT_START_X]
+			ay = segments[offset + constraints.SEGMENT_START_Y]
+			dirX = segments[offset + constraints.SEGMENT_DIR_X]
+			dirY = segments[offset + constraints.SEGMENT_DIR_Y]
+			t = np.clip((xs - ax) * dirX + (ys - ay) * dirY, 0.0, segments[offset + constraints.SEGMENT_LENGTH])
+			self.stampPoint(region, xs, ys, ax + dirX * t, ay + dirY * t, constraint.violateDistance)
+
+	def stampPoint(self, region, xs, ys, closestX, closestY, violateDistance):
+		i0, j0, i1, j1 = region
+		offsetX = xs - closestX
+		offsetY = ys - closestY
+		distance = np.sqrt(offsetX ** 2 + offsetY ** 2)
+		signedDistance = distance - violateDistance
+
+		values = self.values[j0:j1, i0:i1]
+		closer = signedDistance < values
+		values[closer] = signedDistance[closer]
+
+		# samples right at the closest point have no direction, they keep pointing along +x
+		invDistance = np.where(distance > 0, 1.0 / np.maximum(distance, 1e-12), 0.0)
+		gradients = self.gradients[j0:j1, i0:i1]
+		gradients[..., 0][closer] = np.where(distance > 0, offsetX * invDistance, 1.0)[closer]
+		gradients[..., 1][closer] = (offsetY * invDistance)[closer]
+
+	# Recomputes the samples of the region from every indexed constraint near it
+	def rasterizeRegion(self, region):
+		i0, j0, i1, j1 = region
+		if i0 >= i1 or j0 >= j1:
+			return
+
+		self.values[j0:j1, i0:i1] = self.maxDistance
+		self.gradients[j0:j1, i0:i1] = 0.0
+
+		minCorner = vec2f(self.originX + i0 * self.resolution - self.maxDistance, self.originY + j0 * self.resolution - self.maxDistance)
+		maxCorner = vec2f(self.originX + i1 * self.resolution + self.maxDistance, self.originY + j1 * self.resolution + self.maxDistance)
+		for constraint in self.index.query(minCorner, maxCorner):
+			self.stamp(constraint, intersectRegions(region, self.getRegion(constraint.getBounds())))
+
+	# ==================================
+
+	# Incremental updates: only the samples around the old and new bounds of the obstacle are recomputed.
+	# Moved obstacles pass the bounds they had before the change
+	def addConstraint(self, constraint):
+		self.growToInclude(constraint.getBounds())
+		self.index.insert(constraint)
+		self.stamp(constraint, self.getRegion(constraint.getBounds()))
+		self.changed()
+
+	def removeConstraint(self, constraint):
+		if self.index.remove(constraint):
+			self.rasterizeRegion(self.getRegion(constraint.getBounds()))
+			self.changed()
+
+	def updateConstraint(self, constraint, oldBounds):
+		self.growToInclude(constraint.getBounds())
+		self.index.update(constraint)
+		self.rasterizeRegion(self.getRegion(oldBounds))
+		self.rasterizeRegion(self.getRegion(constraint.getBounds()))
+		self.changed()
+
+	def changed(self):
+		self.digest = None
+		self.version += 1
+		for index in self.dependentIndexes:
+			index.changed()
+
+	# ==================================
+
+	def sampleCell(self, x, y):
+		fx = (x - self.originX) / self.resolution
+		fy = (y - self.originY) / self.resolution
+		i = int(math.floor(fx))
+		j = int(math.floor(fy))
+		if i < 0 or j < 0 or i >= self.width - 1 or j >= self.height - 1:
+			return None
+
+		return (i, j, fx - i, fy - j)
+
+	def distance(self, point):
+		cell = self.sampleCell(point.x, point.y)
+		if cell is None:
+			return self.maxDistance
+
+		# item() returns plain floats, much cheaper than numpy scalar indexing for single lookups
+		i, j, tx, ty = cell
+		value = self.values.item
+		v00 = value(j, i)
+		v10 = value(j, i + 1)
+		v01 = value(j + 1, i)
+		v11 = value(j + 1, i + 1)
+		top = v00 + (v10 - v00) * tx
+		bottom = v01 + (v11 - v01) * tx
+		return top + (bottom - top) * ty
+
+	# Unit direction away from the nearest obstacle, zero vector where the field has no direction
+	def gradient(self, point):
+		cell = self.sampleCell(point.x, point.y)
+		if cell is None:
+			return vec2f(0.0, 0.0)
+
+		i, j, tx, ty = cell
+		gradient = self.gradients.item
+		direction = []
+		for axis in (0, 1):
+			top = gradient(j, i, axis) + (gradient(j, i + 1, axis) - gradient(j, i, axis)) * tx
+			bottom = gradient(j + 1, i, axis) + (gradient(j + 1, i + 1, axis) - gradient(j + 1, i, axis)) * tx
+			direction.append(top + (bottom - top) * ty)
+
+		length = math.sqrt(direction[0] ** 2 + direction[1] ** 2)
+		if length == 0:
+			return vec2f(0.0, 0.0)
+
+		return vec2f(direction[0] / length, direction[1] / length)
+
+	# ==================================
+
+	def save(self, path):
+		with open(path, 'wb') as f:
+			f.write(struct.pack(HEADER_FORMAT, FIELD_MAGIC, FIELD_VERSION, self.digest or b'\0' * 20, self.originX, self.originY,
+				self.resolution, self.width, self.height, self.maxDistance))
+			self.values.astype('<f8').tofile(f)
+			self.gradients.astype('<f8').tofile(f)
+
+	# Returns None if the file is missing, of another version or saved for other constraints
+	@staticmethod
+	def load(path, digest=None):
+		try:
+			f = open(path, 'rb')
+		except IOError:
+			return None
+
+		with f:
+			header = f.read(struct.calcsize(HEADER_FORMAT))
+			if len(header) != struct.calcsize(HEADER_FORMAT):
+				return None
+
+			magic, version, savedDigest, originX, originY, resolution, width, height, maxDistance = struct.unpack(HEADER_FORMAT, header)
+			if magic != FIELD_MAGIC or version != FIELD_VERSION or (digest is not None and savedDigest != digest):
+				return None
+
+			values = np.fromfile(f, dtype='<f8', count=width * height)
+			gradients = np.fromfile(f, dtype='<f8', count=width * height * 2)
+			if values.size != width * height or gradients.size != width * height * 2:
+				return None
+
+		field = DistanceField((originX, originY, originX, originY), resolution, maxDistance)
+		field.width = width
+		field.height = height
+		field.values = values.astype(np.float64).reshape(height, width)
+		field.gradients = gradients.astype(np.float64).reshape(height, width, 2)
+		field.digest = savedDigest
+		return field
+
+# ==================================
+
+# Planner constraint backed by a distance field, stands in for all the constraints rasterized into it
+class DistanceFieldConstraint(constraints.Constraint):
+	def __init__(self, field):
+		super(DistanceFieldConstraint, self).__init__()
+		self.field = field
+		self.pushSlack = 0.5
+		self.maxPushes = 4
+
+	def willViolate(self, point, velocity):
+		return self.field.distance(point) < 0
+
+	# Pushes the point out along the field gradient
+	def suggestPoint(self, prevPoint, prevVelocity, point, velocity, side=None):
+		for i in xrange(self.maxPushes):
+			distance = self.field.distance(point)
+			if distance >= 0:
+				break
+
+			direction = self.field.gradient(point)
+			if direction.lengthSq() == 0:
+				direction = -velocity
+			point = point + direction * (self.pushSlack - distance)
+
+		velocity = point - prevPoint
+		if velocity.lengthSq() > 0:
+			velocity.normalize()
+		else:
+			velocity = prevVelocity
+
+		return (point, velocity)
+
+	# Sphere tracing: every sample may advance by its distance without skipping an obstacle
+	def timeOfImpact(self, start, end):
+		delta = end - start
+		length = delta.length()
+		if self.field.distance(start) < 0:
+			return 1.0 if self.field.distance(end) < 0 else None
+
+		travelled = 0.0
+		minStep = self.field.resolution * 0.25
+		while travelled <= length:
+			point = start + delta * (travelled / length) if length > 0 else start
+			distance = self.field.distance(point)
+			if distance < 0:
+				return travelled / length if length > 0 else 0.0
+
+			travelled += max(distance, minStep)
+
+		return 1.0 if self.field.distance(end) < 0 else None
+
+# Replaces the circle and polyline constraints of the planner with one distance field constraint, the
+# other constraints are kept. Returns the field, update it through its add/remove/updateConstraint, edits
+# bump the version of the planner's new constraint index so path caches and incremental plans notice them
+def attachDistanceField(pathfinder, resolution=4.0, maxDistance=32.0, cachePath=None):
+	if cachePath is None:
+		field = DistanceField.fromConstraints(pathfinder.constraints, resolution, maxDistance)
+	else:
+		field = DistanceField.fromConstraintsCached(pathfinder.constraints, cachePath, resolution, maxDistance)
+
+	pathfinder.constraints = [DistanceFieldConstraint(field)] + [c for c in pathfinder.constraints if not isRasterizable(c)]
+	pathfinder.constraintIndex = ConstraintGrid.fromConstraints(pathfinder.constraints)
+	field.dependentIndexes.append(pathfinder.constraintIndex)
+	return field
+
+# ==================================
+
+def isRasterizable(constraint):
+	return isinstance(constraint, (constraints.CircleCollisionConstraint, constraints.PolylineCollisionConstraint))
+
+def intersectRegions(a, b):
+	return (max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3]))
+
+def getConstraintsDigest(constraintsList, resolution, maxDistance):
+	digest = hashlib.sha1(repr((FIELD_VERSION, resolution, maxDistance)).encode('ascii'))
+	for constraint in constraintsList:
+		if isinstance(constraint, constraints.CircleCollisionConstraint):
+			shape = ('circle', constraint.center.x, constraint.center.y, constraint.violateDistance)
+		else:
+			shape = ('polyline', constraint.violateDistance, tuple((point.x, point.y) for point in constraint.points))
+		digest.update(repr(shape).encode('ascii'))
+
+	return digest.digest()
+
+# ==================================
@@ -2,10 +2,15 @@ import sdl2
 import sdl2.ext
 import sys
 import ctypes
+import threading
 from itertools import tee, izip
 import math
 from smath import *
+import constraints
 from pathfinder import *
+from pathbuffer import PathBuffer
+from spatialindex import ConstraintGrid
+import obstaclecompiler
 import json
 
 conditionsPath = sys.argv[1]
@@ -14,6 +19,11 @@ obstaclesDataPath = sys.argv[2]
 width = 1600
 height = 900
 
+# Frames are only drawn when something changed, at most maxFrameRate of them a second.
+# An idle window wakes up every idleWaitMs to look for events
+maxFrameRate = 60
+idleWaitMs = 500
+
 # ==================================
 
 CLEAR_COLOR = sdl2.ext.Color(0, 128, 255)
@@ -99,12 +109,14 @@ class UIElement(sdl2.ext.Entity):
 # ==================================
 
 def stepBtnHandler(sender, *args):
+	context.swapPath()
 	if context.playbackStep + 1 < len(context.pathPoints):
 		context.playbackStep += 1
 		context.player.transform.position = context.pathPoints[context.playbackStep]
 		context.player.transform.rotation = context.pathOrientations[context.playbackStep]
 		
 		context.player.velocity = angleToVelocity(context.player.transform.rotation)
+		context.frameDirty = True
 		
 def updatePath(sender, *args):
 	position = context.player.transform.position
@@ -112,13 +124,89 @@ def updatePath(sender, *args):
 	target = context.target.transform.position
 	targetVelocity = context.target.velocity
 	
-	context.pathfinder.playerSpeed = context.player.speed
-	context.pathfinder.constraints = context.constraints
-	path = context.pathfinder.getPath(position, velocity, target, targetVelocity)
-	
-	context.playbackStep = 0
-	context.pathPoints = path["points"]
-	context.pathOrientations = path["rotations"]
+	context.planningWorker.submit(position, velocity, target, targetVelocity, context.player.speed)
+
+# ==================================
+
+# Plans on a thread of its own so the window keeps drawing. Only the newest request counts: it replaces a waiting
+# request and stops a running one after its current step. Finished paths are copied into the back buffer under
+# the lock, take() swaps it with the front buffer the UI draws from, so the UI never sees a half written path
+class PlanningWorker(object):
+	def __init__(self, pathfinder, onPublished=None):
+		self.pathfinder = pathfinder
+		self.onPublished = onPublished
+		self.lock = threading.Lock()
+		self.wakeup = threading.Condition(self.lock)
+		self.request = None
+		self.generation = 0
+		self.running = True
+
+		self.front = PathBuffer()
+		self.back = PathBuffer()
+		self.published = False
+
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def submit(self, position, velocity, targetPosition, targetVelocity, speed):
+		with self.lock:
+			self.generation += 1
+			self.request = (vec2f(position.x, position.y), vec2f(velocity.x, velocity.y),
+				vec2f(targetPosition.x, targetPosition.y), vec2f(targetVelocity.x, targetVelocity.y), speed)
+			self.wakeup.notify()
+
+	# Returns the front buffer after swapping in a newly published path, None if there is none
+	def take(self):
+		with self.lock:
+			if not self.published:
+				return None
+
+			self.front, self.back = self.back, self.front
+			self.published = False
+			return self.front
+
+	def stop(self):
+		with self.lock:
+			self.running = False
+			self.generation += 1
+			self.wakeup.notify()
+		self.thread.join()
+
+	def run(self):
+		while True:
+			with self.lock:
+				while self.request is None and self.running:
+					self.wakeup.wait()
+				if not self.running:
+					return
+
+				request = self.request
+				generation = self.generation
+				self.request = None
+
+			if self.plan(request, generation) and self.onPublished is not None:
+				self.onPublished()
+
+	def plan(self, request, generation):
+		position, velocity, targetPosition, targetVelocity, speed = request
+		pathfinder = self.pathfinder
+		pathfinder.playerSpeed = speed
+
+		for pointIndex in pathfinder.generatePath(position, velocity, targetPosition, targetVelocity):
+			if self.generation != generation:
+				# a partial plan must not be reused by the next incremental call
+				pathfinder.planKey = None
+				return False
+
+		with self.lock:
+			if self.generation != generation:
+				return False
+
+			self.back.assign(pathfinder.pathPoints, pathfinder.pathOrientations)
+			self.published = True
+
+		return True
 
 # ==================================
 	
@@ -136,17 +224,44 @@ class Context():
 		self.uiFactory = sdl2.ext.UIFactory(self.spriteFactory)
 		
 		self.lastTime = 0
+
+		# Obstacles, the target line and the attraction band are drawn once into staticLayer, redrawn when
+		# staticDirty is set. frameDirty asks for a new frame, anything changing the path or the players sets it
+		self.staticLayer = None
+		self.staticDirty = True
+		self.frameDirty = True
 		
 		self.initUI()
 		self.initPlayers()
 		
-		self.pathPoints = []
-		self.pathOrientations = []
 		self.playbackStep = 0
 		
 		self.pathfinder = PathFindingAlgorithm()
+		self.pathfinder.incrementalEnabled = True
 		self.constraintFactory = constraints.ConstraintFactory()
 		self.loadObstaclesData()
+
+		# the pathfinder belongs to the planning thread from here on, finished paths wake the event loop
+		self.pathfinder.constraints = self.constraints
+		self.pathfinder.constraintIndex = self.constraintIndex
+		self.pathReadyEvent = sdl2.SDL_RegisterEvents(1)
+		self.planningWorker = PlanningWorker(self.pathfinder, self.postPathReady)
+		self.pathPoints = self.planningWorker.front
+		self.pathOrientations = self.pathPoints.rotations
+
+	# Called on the planning thread, SDL_PushEvent may be used from any thread
+	def postPathReady(self):
+		event = sdl2.SDL_Event()
+		event.type = self.pathReadyEvent
+		sdl2.SDL_PushEvent(ctypes.byref(event))
+
+	def swapPath(self):
+		path = self.planningWorker.take()
+		if path is not None:
+			self.pathPoints = path
+			self.pathOrientations = path.rotations
+			self.playbackStep = 0
+			self.frameDirty = True
 		
 	def dispatchUI(self, event):
 		self.uiProcessor.dispatch(self.world, event)
@@ -197,94 +312,134 @@ class Context():
 		self.world.process()
 		
 	def render(self):
-		self.renderer.clear(CLEAR_COLOR)
-		
-		self.player.render(self.renderer)
-		self.target.render(self.renderer)
-		
-		#Render target line
-		targetLineFrom = vec2f(0, ((-self.target.transform.position.x) / self.target.velocity.x) * self.target.velocity.y + self.target.transform.position.y)
-		targetLineTo = vec2f(width, ((width - self.target.transform.position.x) / self.target.velocity.x) * self.target.velocity.y + self.target.transform.position.y)
-		adLineFrom1 = vec2f(0, ((-self.target.transform.position.x) / self.target.velocity.x) * self.target.velocity.y + self.target.transform.position.y)
-		adLineTo1 = vec2f(width, ((width - self.target.transform.position.x) / self.target.velocity.x) * self.target.velocity.y + self.target.transform.position.y)
-		adLineFrom2 = vec2f(0, ((-self.target.transform.position.x) / self.target.velocity.x) * self.target.velocity.y + self.target.transform.position.y)
-		adLineTo2 = vec2f(width, ((width - self.target.transform.position.x) / self.target.velocity.x) * self.target.velocity.y + self.target.transform.position.y)
-		adLineFrom1 += vec2f(0, -attractionDistance)
-		adLineFrom2 += vec2f(0, attractionDistance)
-		adLineTo1 += vec2f(0, -attractionDistance)
-		adLineTo2 += vec2f(0, attractionDistance)
-		self.renderer.draw_line((int(targetLineFrom.x), int(targetLineFrom.y), int(targetLineTo.x), int(targetLineTo.y)), YELLOW_COLOR)
-		self.renderer.draw_line((int(adLineFrom1.x), int(adLineFrom1.y), int(adLineTo1.x), int(adLineTo1.y)), YELLOW2_COLOR)
-		self.renderer.draw_line((int(adLineFrom2.x), int(adLineFrom2.y), int(adLineTo2.x), int(adLineTo2.y)), YELLOW2_COLOR)
+		self.swapPath()
+		sdlRenderer = self.renderer.sdlrenderer
+		if self.staticDirty:
+			self.renderStaticLayer()
+
+		if self.staticLayer is not None:
+			sdl2.SDL_RenderCopy(sdlRenderer, self.staticLayer, None, None)
+		else:
+			self.renderStatic()
 		
 		# Render path
-		for pfrom, pto in pairwise(self.pathPoints):
-			self.renderer.draw_line((int(pfrom.x), int(pfrom.y), int(pto.x), int(pto.y)), RED_COLOR)
-			self.renderer.fill((int(pto.x) - 1, int(pto.y) - 1, 3, 3), RED_COLOR)
-		
-		# Render obstacles
-		for obstacle in self.obstacles:
-			obstacle.render(self.renderer)
+		xs = self.pathPoints.xs
+		ys = self.pathPoints.ys
+		for k in xrange(1, len(self.pathPoints)):
+			self.renderer.draw_line((int(xs[k - 1]), int(ys[k - 1]), int(xs[k]), int(ys[k])), RED_COLOR)
+			self.renderer.fill((int(xs[k]) - 1, int(ys[k]) - 1, 3, 3), RED_COLOR)
 
 		# Render players
+		self.player.render(self.renderer)
+		self.target.render(self.renderer)
+
 		self.renderer.copy(self.stepBtn, srcrect=(0, 0, 100, 40), dstrect=(20, 20, 100, 40))
 		self.renderer.copy(self.createPathBtn, srcrect=(0, 0, 100, 40), dstrect=(140, 20, 100, 40))
 		
 		self.renderer.present()
+		self.frameDirty = False
 
-	def loadObstaclesData(self):
-		self.obstacles = []
-		self.constraints = []
+	# Renders the static layer into a target texture, drawing it straight into every frame instead
+	# where render targets aren't supported
+	def renderStaticLayer(self):
+		sdlRenderer = self.renderer.sdlrenderer
+		self.staticDirty = False
 
-		contraintFactory = constraints.ConstraintFactory()
+		if self.staticLayer is None:
+			if not sdl2.SDL_RenderTargetSupported(sdlRenderer):
+				return
 
-		with open(obstaclesDataPath) as f:
-			obstaclesData = json.load(f)
-			obstaclesData = obstaclesData['data']
+			self.staticLayer = sdl2.SDL_CreateTexture(sdlRenderer, sdl2.SDL_PIXELFORMAT_RGBA8888, sdl2.SDL_TEXTUREACCESS_TARGET, width, height)
+			if not self.staticLayer:
+				self.staticLayer = None
+				return
 
-			for obstacleData in obstaclesData:
-				obstacleType = obstacleData['type']
+		sdl2.SDL_SetRenderTarget(sdlRenderer, self.staticLayer)
+		self.renderStatic()
+		sdl2.SDL_SetRenderTarget(sdlRenderer, None)
 
-				obstacle = None
-				if obstacleType == 'circle':
-					diameter = obstacleData['radius'] * 2
-					obstacle = CircleObstacle(self.obstacleSprite, (diameter, diameter))
-					position = vec2f(obstacleData['position']['x'], obstacleData['position']['y'])
-					obstacle.transform.position = position
+	def renderStatic(self):
+		self.renderer.clear(CLEAR_COLOR)
 
-				elif obstacleType == 'polyline':
-					linePoints = []
-					pointsData = obstacleData['points']
+		#Render target line
+		targetPosition = self.target.transform.position
+		targetVelocity = self.target.velocity
+		lineFromY = ((-targetPosition.x) / targetVelocity.x) * targetVelocity.y + targetPosition.y
+		lineToY = ((width - targetPosition.x) / targetVelocity.x) * targetVelocity.y + targetPosition.y
+		bandWidth = self.pathfinder.attractionDistance
+		self.renderer.draw_line((0, int(lineFromY), width, int(lineToY)), YELLOW_COLOR)
+		self.renderer.draw_line((0, int(lineFromY - bandWidth), width, int(lineToY - bandWidth)), YELLOW2_COLOR)
+		self.renderer.draw_line((0, int(lineFromY + bandWidth), width, int(lineToY + bandWidth)), YELLOW2_COLOR)
 
-					for pointData in pointsData:
-						point = vec2f(pointData['x'], pointData['y'])
-						linePoints.append(point)
+		# Render obstacles
+		for obstacle in self.obstacles:
+			obstacle.render(self.renderer)
 
-					obstacle = PolylineObstacle(linePoints)
+	def invalidateStatic(self):
+		self.staticDirty = True
+		self.frameDirty = True
 
-				if obstacle != None:
-					self.obstacles.append(obstacle)
+	def loadObstaclesData(self):
+		self.obstacles = []
 
-				# Create constraint for this collision
-				constraint = contraintFactory.fromShapeDef(obstacleData)
-				self.constraints.append(constraint)
+		# obstacles are drawn the way the planner sees them after compilation
+		self.constraints = obstaclecompiler.loadObstacles(obstaclesDataPath)
+
+		for constraint in self.constraints:
+			obstacle = None
+			if isinstance(constraint, constraints.CircleCollisionConstraint):
+				diameter = constraint.radius * 2
+				obstacle = CircleObstacle(self.obstacleSprite, (diameter, diameter))
+				obstacle.transform.position = constraint.center
+
+			elif isinstance(constraint, constraints.PolylineCollisionConstraint):
+				obstacle = PolylineObstacle(constraint.points)
+
+			if obstacle != None:
+				self.obstacles.append(obstacle)
+
+		self.constraintIndex = ConstraintGrid.fromConstraints(self.constraints)
+		self.invalidateStatic()
 		
 # ==================================
 
 def run():
 	running = True
 	event = sdl2.SDL_Event()
+	frameTime = 1000 / maxFrameRate
+	lastFrameTime = 0
 	
 	while running:
+		# sleep until an event arrives, nothing else changes the window
+		if not context.frameDirty:
+			sdl2.SDL_WaitEventTimeout(None, idleWaitMs)
+
 		while sdl2.SDL_PollEvent(ctypes.byref(event)) != 0:
 			if event.type == sdl2.SDL_QUIT:
 				running = False
 				break
+
+			# the texture contents are lost along with the render targets
+			if event.type == sdl2.SDL_RENDER_TARGETS_RESET:
+				context.invalidateStatic()
+			elif event.type == sdl2.SDL_WINDOWEVENT:
+				context.frameDirty = True
+			elif event.type == context.pathReadyEvent:
+				context.swapPath()
+
+			context.dispatchUI(event)
 			
-		context.dispatchUI(event)	
-		context.processWorld()
-		context.render()
+		if running and context.frameDirty:
+			context.processWorld()
+
+			delay = lastFrameTime + frameTime - sdl2.SDL_GetTicks()
+			if 0 < delay <= frameTime:
+				sdl2.SDL_Delay(delay)
+
+			lastFrameTime = sdl2.SDL_GetTicks()
+			context.render()
 		
+	context.planningWorker.stop()
 	return 0
 	
 # ==================================
@@ -0,0 +1,142 @@
+import argparse
+import collections
+import distancefield
+import json
+import multiprocessing
+import sys
+import obstaclecompiler
+import obstaclestore
+import scenario
+from pathfinder import PathFindingAlgorithm
+from spatialindex import ConstraintGrid
+
+# ==================================
+
+# Per process planner, set up once by the pool initializer
+worker = None
+
+class Worker(object):
+	def __init__(self, obstaclesPath, compiled=False, distanceFieldResolution=None):
+		self.pathfinder = PathFindingAlgorithm()
+
+		# stores are mapped and their obstacles built on demand, every worker shares the same pages
+		if obstaclestore.isStoreFile(obstaclesPath):
+			self.store, self.constraints, self.pathfinder.constraintIndex = obstaclestore.openStore(obstaclesPath)
+		else:
+			if compiled:
+				self.constraints = obstaclecompiler.loadObstacles(obstaclesPath)
+			else:
+				self.constraints = scenario.loadConstraintsFile(obstaclesPath)
+			self.pathfinder.constraintIndex = ConstraintGrid.fromConstraints(self.constraints)
+
+		self.pathfinder.constraints = self.constraints
+		if distanceFieldResolution is not None:
+			distancefield.attachDistanceField(self.pathfinder, distanceFieldResolution, cachePath=obstaclesPath + '.sdf')
+
+	def planLine(self, line):
+		try:
+			condition = scenario.parseCondition(json.loads(line))
+			path = scenario.planCondition(self.pathfinder, condition)
+			return json.dumps(scenario.pathToData(path))
+		except Exception as e:
+			return json.dumps({ "error": "%s: %s" % (type(e).__name__, e) })
+
+def initWorker(obstaclesPath, compiled=False, distanceFieldResolution=None):
+	global worker
+	worker = Worker(obstaclesPath, compiled, distanceFieldResolution)
+
+def planChunk(lines):
+	return [worker.planLine(line) for line in lines]
+
+# Compiles and rasterizes once up front, the workers then all read the cached results
+def prepareObstacles(obstaclesPath, compiled=False, distanceFieldResolution=None):
+	if distanceFieldResolution is not None:
+		Worker(obstaclesPath, compiled, distanceFieldResolution)
+	elif compiled and not obstaclestore.isStoreFile(obstaclesPath):
+		obstaclecompiler.loadObstacles(obstaclesPath)
+
+# ==================================
+
+def readChunks(stream, chunkSize):
+	chunk = []
+	for line in stream:
+		if not line.strip():
+			continue
+
+		chunk.append(line)
+		if len(chunk) >= chunkSize:
+			yield chunk
+			chunk = []
+
+	if chunk:
+		yield chunk
+
+# Plans every scenario line of the input stream and writes one result line per scenario in input order.
+# At most maxPendingChunks chunks are in flight, so memory use doesn't depend on the input size
+def run(obstaclesPath, inputStream, outputStream, workers=None, chunkSize=64, maxPendingChunks=None, compiled=False, distanceFieldResolution=None):
+	workers = workers or multiprocessing.cpu_count()
+	maxPendingChunks = maxPendingChunks or workers * 4
+
+	prepareObstacles(obstaclesPath, compiled, distanceFieldResolution)
+	pool = multiprocessing.Pool(workers, initializer=initWorker, initargs=(obstaclesPath, compiled, distanceFieldResolution))
+	pending = collections.deque()
+	scenariosCount = 0
+
+	def writeResults(results):
+		for result in results:
+			outputStream.write(result)
+			outputStream.write('\n')
+
+	try:
+		for chunk in readChunks(inputStream, chunkSize):
+			pending.append(pool.apply_async(planChunk, (chunk,)))
+			scenariosCount += len(chunk)
+
+			if len(pending) >= maxPendingChunks:
+				writeResults(pending.popleft().get())
+
+		while pending:
+			writeResults(pending.popleft().get())
+
+		pool.close()
+	finally:
+		pool.terminate()
+		pool.join()
+
+	outputStream.flush()
+	return scenariosCount
+
+# ==================================
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Plans paths for JSONL scenarios (condition.json objects, one per line) without a window.')
+	parser.add_argument('obstacles', help='obstacles JSON file loaded once per worker, or an obstaclestore file')
+	parser.add_argument('scenarios', nargs='?', default='-', help='JSONL scenarios file, stdin if omitted or -')
+	parser.add_argument('-o', '--output', default='-', help='JSONL output file, stdout if omitted or -')
+	parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes, CPU count by default')
+	parser.add_argument('--chunk-size', type=int, default=64, help='scenarios sent to a worker at once')
+	parser.add_argument('--max-pending', type=int, default=None, help='chunks in flight, 4 per worker by default')
+	parser.add_argument('--compiled', action='store_true', help='merge obstacles and cache them next to the obstacles file')
+	parser.add_argument('--distance-field', type=float, default=None, metavar='RESOLUTION',
+		help='check obstacles against a distance field of this cell size, cached next to the obstacles file')
+	args = parser.parse_args(argv)
+
+	inputStream = sys.stdin if args.scenarios == '-' else open(args.scenarios)
+	outputStream = sys.stdout if args.output == '-' else open(args.output, 'w')
+
+	try:
+		run(args.obstacles, inputStream, outputStream, args.workers, args.chunk_size, args.max_pending, args.compiled, args.distance_field)
+	finally:
+		if inputStream is not sys.stdin:
+			inputStream.close()
+		if outputStream is not sys.stdout:
+			outputStream.close()
+
+	return 0
+
+# ==================================
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
+
+# ==================================
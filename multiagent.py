@@ -0,0 +1,231 @@
+import argparse
+import json
+import math
+import random
+import sys
+import timeit
+import benchmark
+import constraints
+import scenario
+from pathfinder import PathFindingAlgorithm, PLANNER_SETTINGS
+from smath import *
+from spatialindex import ConstraintGrid
+
+# ==================================
+
+# Another agent seen as a circle of its own radius around its predicted position, grown by the radius of the
+# planning agent. The center moves every step
+class AgentConstraint(constraints.CircleCollisionConstraint):
+	def __init__(self, agentIndex, radius):
+		super(AgentConstraint, self).__init__(vec2f(), radius)
+		self.agentIndex = agentIndex
+		self.margin = radius
+		self.violateDistance = self.radius + self.margin
+		self.violateDistanceSq = self.violateDistance ** 2
+
+# Uniform grid over agent centers, rebuilt from scratch every step: a rebuild is linear in the agent count
+# and much cheaper than keeping cells up to date while every agent moves
+class AgentHash(object):
+	def __init__(self, cellSize):
+		self.cellSize = float(cellSize)
+		self.invCellSize = 1.0 / self.cellSize
+		self.cells = {}
+		self.resetStats()
+
+	def rebuild(self, agentConstraints):
+		cells = {}
+		invCellSize = self.invCellSize
+		for constraint in agentConstraints:
+			key = (int(math.floor(constraint.center.x * invCellSize)), int(math.floor(constraint.center.y * invCellSize)))
+			cell = cells.get(key)
+			if cell is None:
+				cells[key] = [constraint]
+			else:
+				cell.append(constraint)
+		self.cells = cells
+
+	# Agents whose circles may overlap the bounding box of the segment a-b grown by reach, in agent order,
+	# without the agent excluded and those up to afterIndex
+	def query(self, a, b, reach, excludedIndex, afterIndex=-1):
+		invCellSize = self.invCellSize
+		x0 = int(math.floor((min(a.x, b.x) - reach) * invCellSize))
+		y0 = int(math.floor((min(a.y, b.y) - reach) * invCellSize))
+		x1 = int(math.floor((max(a.x, b.x) + reach) * invCellSize))
+		y1 = int(math.floor((max(a.y, b.y) + reach) * invCellSize))
+
+		result = []
+		cells = self.cells
+		for x in xrange(x0, x1 + 1):
+			for y in xrange(y0, y1 + 1):
+				cell = cells.get((x, y))
+				if cell:
+					for constraint in cell:
+						if constraint.agentIndex != excludedIndex and constraint.agentIndex > afterIndex:
+							result.append(constraint)
+
+		result.sort(key=lambda constraint: constraint.agentIndex)
+		self.stats['queries'] += 1
+		self.stats['candidates'] += len(result)
+		return result
+
+	def resetStats(self):
+		self.stats = { 'queries': 0, 'candidates': 0 }
+
+# Constraint index of one agent: the static constraints from a ConstraintGrid followed by the other agents
+# from the shared AgentHash, so the planner checks both through its usual index queries
+class AgentConstraintIndex(object):
+	def __init__(self, staticIndex, agentHash, agentIndex, reach):
+		self.staticIndex = staticIndex
+		self.agentHash = agentHash
+		self.agentIndex = agentIndex
+		self.reach = reach
+
+	def query(self, a, b, after=None):
+		if isinstance(after, AgentConstraint):
+			return self.agentHash.query(a, b, self.reach, self.agentIndex, after.agentIndex)
+
+		return self.staticIndex.query(a, b, after) + self.agentHash.query(a, b, self.reach, self.agentIndex)
+
+# ==================================
+
+# Plans all agents together one step at a time. Before every step each agent's position is predicted one step
+# ahead along its current heading, the predictions are hashed and every agent checks its step against the
+# predictions of the agents around it besides its static constraints. Agents are conditions in the
+# scenario.parseCondition form, settings is an object with the PLANNER_SETTINGS attributes as for planPath
+class MultiAgentPlanner(object):
+	def __init__(self, constraintSet, constraintIndex=None, agentRadius=15.0, settings=None):
+		self.constraints = constraintSet
+		self.constraintIndex = constraintIndex
+		self.agentRadius = agentRadius
+		self.settings = settings
+		self.stats = None
+
+	def createPlanner(self, agentHash, agentIndex, reach):
+		planner = PathFindingAlgorithm()
+		if self.settings is not None:
+			for name in PLANNER_SETTINGS:
+				setattr(planner, name, getattr(self.settings, name))
+
+		planner.constraints = self.constraints
+		planner.constraintIndex = AgentConstraintIndex(self.constraintIndex, agentHash, agentIndex, reach)
+		return planner
+
+	# Returns the getPath results of every agent, timings of the run are left in stats
+	def getPaths(self, agents):
+		if self.constraintIndex is None:
+			self.constraintIndex = ConstraintGrid.fromConstraints(self.constraints)
+
+		agentConstraints = [AgentConstraint(agentIndex, self.agentRadius) for agentIndex in xrange(len(agents))]
+		reach = self.agentRadius * 2
+		maxSpeed = max([agent['speed'] for agent in agents] or [0])
+		agentHash = AgentHash(max(reach * 2, maxSpeed, 1.0))
+
+		planners = []
+		generators = []
+		for agentIndex, agent in enumerate(agents):
+			planner = self.createPlanner(agentHash, agentIndex, reach)
+			planner.playerSpeed = agent['speed']
+			planners.append(planner)
+			generators.append(planner.generatePath(agent['position'], agent['velocity'], agent['targetPosition'], agent['targetVelocity']))
+			agentConstraints[agentIndex].center = agent['position'] + agent['velocity'] * agent['speed']
+
+		stepTimes = []
+		hashTime = 0.0
+		active = len(agents)
+
+		while active > 0:
+			stepStart = timeit.default_timer()
+			agentHash.rebuild(agentConstraints)
+			hashTime += timeit.default_timer() - stepStart
+
+			active = 0
+			for agentIndex, generator in enumerate(generators):
+				if generator is None:
+					continue
+
+				try:
+					next(generator)
+					active += 1
+				except StopIteration:
+					generators[agentIndex] = None
+
+			# predictions for the next step, agents that are done keep going straight
+			for agentIndex, planner in enumerate(planners):
+				position, velocity = planner.pathStates[-1]
+				if generators[agentIndex] is None:
+					velocity = angleToVelocity(planner.pathOrientations[-1])
+				agentConstraints[agentIndex].center = position + velocity * planner.playerSpeed
+
+			if active > 0:
+				stepTimes.append(timeit.default_timer() - stepStart)
+
+		queries = max(agentHash.stats['queries'], 1)
+		totalTime = sum(stepTimes)
+		self.stats = {
+			"agents": len(agents),
+			"steps": len(stepTimes),
+			"totalTime": totalTime,
+			"stepTimeMean": totalTime / len(stepTimes) if stepTimes else 0.0,
+			"stepTimeMax": max(stepTimes) if stepTimes else 0.0,
+			"stepTimePerAgent": totalTime / (len(stepTimes) * len(agents)) if stepTimes else 0.0,
+			"hashTimeMean": hashTime / len(stepTimes) if stepTimes else 0.0,
+			"agentCandidatesPerQuery": agentHash.stats['candidates'] / float(queries),
+		}
+
+		return [{ "points": planner.pathPoints, "rotations": planner.pathOrientations, "failedSteps": planner.failedSteps } for planner in planners]
+
+# ==================================
+
+# Agents spread over the left half of the corridor of a benchmark scenario, all heading for its target line
+def generateAgents(rng, conditionData, agentsCount, width, height):
+	base = scenario.parseCondition(conditionData)
+	agents = []
+	for i in xrange(agentsCount):
+		agent = dict(base)
+		agent['position'] = vec2f(rng.uniform(0, width * 0.5), rng.uniform(height * 0.1, height * 0.9))
+		agent['velocity'] = angleToVelocity(rng.uniform(-45, 45))
+		agents.append(agent)
+
+	return agents
+
+# The generated corridor grows with its obstacles count, obstacles scale with the agents,
+# so densities and per agent costs stay comparable between counts
+def runScaling(seed, agentsCounts, obstaclesPerAgent, agentRadius):
+	results = []
+	for agentsCount in agentsCounts:
+		rng = random.Random("%s-%d" % (seed, agentsCount))
+		conditionData, obstaclesData = benchmark.generateScenario(rng, int(agentsCount * obstaclesPerAgent))
+		constraintSet = scenario.loadConstraints(obstaclesData)
+
+		# the second wall runs along the bottom of the corridor
+		walls = [shapeDef for shapeDef in obstaclesData['data'] if shapeDef['type'] == 'polyline']
+		height = sum(point['y'] for point in walls[1]['points']) / len(walls[1]['points'])
+		agents = generateAgents(rng, conditionData, agentsCount, height * 3.0, height)
+
+		planner = MultiAgentPlanner(constraintSet, agentRadius=agentRadius)
+		paths = planner.getPaths(agents)
+		planner.stats["obstacles"] = len(constraintSet)
+		planner.stats["failedSteps"] = sum(len(path["failedSteps"]) for path in paths)
+		results.append(planner.stats)
+
+	return results
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Plans agents together avoiding each other and reports JSON step costs by agent count.')
+	parser.add_argument('--seed', default='0')
+	parser.add_argument('--agents', default='10,100,1000', help='comma separated agent counts')
+	parser.add_argument('--obstacles-per-agent', type=float, default=1.0, help='circle obstacles of the generated map per agent')
+	parser.add_argument('--radius', type=float, default=15.0, help='agent radius')
+	args = parser.parse_args(argv)
+
+	results = runScaling(args.seed, benchmark.parseList(args.agents, int), args.obstacles_per_agent, args.radius)
+	json.dump({ "results": results }, sys.stdout, indent=4, sort_keys=True)
+	sys.stdout.write('\n')
+	return 0
+
+# ==================================
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
+
+# ==================================
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import math
+import os
+import struct
+import sys
+from array import array
+import constraints
+from smath import vec2f
+
+# ==================================
+
+# Compiled obstacles file layout: header, circles as (x, y, radius) doubles, then every polyline as
+# (pointsCount, margin) followed by its (x, y) doubles. Bump the version whenever the layout or the compile step changes
+COMPILED_MAGIC = b'VMOC'
+COMPILED_VERSION = 1
+HEADER_FORMAT = '<4sI20sII'
+POLYLINE_FORMAT = '<Id'
+
+# ==================================
+
+# Merges circles whose gaps are below maxSpacing into enclosing circles of at most maxMergedRadius.
+# Circles are visited in order and join the nearby cluster that grows the least, clusters are found
+# through a spatial hash of their centers, so the cost stays close to linear
+def clusterCircles(circles, maxSpacing, maxMergedRadius):
+	cellSize = max(maxMergedRadius * 2.0 + maxSpacing, 1.0)
+	cells = {}
+	clusters = []
+
+	def cellOf(center):
+		return (int(math.floor(center.x / cellSize)), int(math.floor(center.y / cellSize)))
+
+	for circle in circles:
+		cell = cellOf(circle.center)
+		best = None
+		bestRadius = None
+
+		px = circle.center.x
+		py = circle.center.y
+		reach = circle.radius + maxSpacing
+
+		for x in xrange(cell[0] - 1, cell[0] + 2):
+			for y in xrange(cell[1] - 1, cell[1] + 2):
+				for cluster in cells.get((x, y), ()):
+					distanceSq = (cluster.center.x - px) ** 2 + (cluster.center.y - py) ** 2
+					if distanceSq >= (cluster.radius + reach) ** 2:
+						continue
+
+					# radius of constraints.enclosingCircle
+					radius = max(cluster.radius, circle.radius, (math.sqrt(distanceSq) + cluster.radius + circle.radius) * 0.5)
+					if radius <= maxMergedRadius and (best is None or radius < bestRadius):
+						best = cluster
+						bestRadius = radius
+
+		if best is None:
+			cluster = constraints.CircleCollisionConstraint(circle.center, circle.radius)
+			clusters.append(cluster)
+			cells.setdefault(cell, []).append(cluster)
+			continue
+
+		cells[cellOf(best.center)].remove(best)
+		constraints.tryJoinCircleConstraints(best, circle, maxSpacing, maxMergedRadius)
+		cells.setdefault(cellOf(best.center), []).append(best)
+
+	return clusters
+
+# Douglas-Peucker simplification. Returns the kept points and the largest distance of a dropped point to the result
+def simplifyPolyline(points, tolerance):
+	if len(points) < 3 or tolerance <= 0:
+		return (list(points), 0.0)
+
+	keep = [False] * len(points)
+	keep[0] = keep[-1] = True
+	maxDeviation = 0.0
+	stack = [(0, len(points) - 1)]
+
+	while stack:
+		first, last = stack.pop()
+		a = points[first]
+		segment = points[last] - a
+		lengthSq = segment.lengthSq()
+		farthest = None
+		farthestDistance = 0.0
+
+		for i in xrange(first + 1, last):
+			offset = points[i] - a
+			t = 0.0 if lengthSq == 0 else max(0.0, min(1.0, (offset.x * segment.x + offset.y * segment.y) / lengthSq))
+			distance = (offset - segment * t).length()
+			if farthest is None or distance > farthestDistance:
+				farthest = i
+				farthestDistance = distance
+
+		if farthest is None:
+			continue
+
+		if farthestDistance > tolerance:
+			keep[farthest] = True
+			stack.append((first, farthest))
+			stack.append((farthest, last))
+		else:
+			maxDeviation = max(maxDeviation, farthestDistance)
+
+	return ([point for point, kept in zip(points, keep) if kept], maxDeviation)
+
+# Turns obstacles.json data into the constraints the planner needs: clustered circles first, then the
+# simplified polylines. Polyline margins grow by the simplification error, so the result never lets more through
+def compileObstacles(obstaclesData, maxSpacing=40.0, maxMergedRadius=50.0, polylineTolerance=1.0):
+	factory = constraints.ConstraintFactory()
+	circles = []
+	polylines = []
+
+	for shapeDef in obstaclesData['data']:
+		constraint = factory.fromShapeDef(shapeDef)
+		if isinstance(constraint, constraints.CircleCollisionConstraint):
+			circles.append(constraint)
+		elif isinstance(constraint, constraints.PolylineCollisionConstraint):
+			points, deviation = simplifyPolyline(constraint.points, polylineTolerance)
+			polylines.append(constraints.PolylineCollisionConstraint(points, constraint.margin + deviation))
+
+	return clusterCircles(circles, maxSpacing, maxMergedRadius) + polylines
+
+# ==================================
+
+def writeDoubles(f, values):
+	if sys.byteorder != 'little':
+		values.byteswap()
+	values.tofile(f)
+
+def readDoubles(f, count):
+	values = array('d')
+	values.fromfile(f, count)
+	if sys.byteorder != 'little':
+		values.byteswap()
+	return values
+
+def writeCompiled(path, sourceDigest, compiledConstraints):
+	circles = [c for c in compiledConstraints if isinstance(c, constraints.CircleCollisionConstraint)]
+	polylines = [c for c in compiledConstraints if isinstance(c, constraints.PolylineCollisionConstraint)]
+
+	# write next to the target and rename, a reader never sees a partial file
+	temporaryPath = '%s.%d.tmp' % (path, os.getpid())
+	with open(temporaryPath, 'wb') as f:
+		f.write(struct.pack(HEADER_FORMAT, COMPILED_MAGIC, COMPILED_VERSION, sourceDigest, len(circles), len(polylines)))
+
+		circlesData = array('d')
+		for circle in circles:
+			circlesData.extend((circle.center.x, circle.center.y, circle.radius))
+		writeDoubles(f, circlesData)
+
+		for polyline in polylines:
+			f.write(struct.pack(POLYLINE_FORMAT, len(polyline.points), polyline.margin))
+			pointsData = array('d')
+			for point in polyline.points:
+				pointsData.extend((point.x, point.y))
+			writeDoubles(f, pointsData)
+
+	if os.path.exists(path):
+		os.remove(path)
+	os.rename(temporaryPath, path)
+
+# Returns the compiled constraints, None if the file is missing, of another version or compiled from other data
+def readCompiled(path, sourceDigest):
+	try:
+		f = open(path, 'rb')
+	except IOError:
+		return None
+
+	with f:
+		header = f.read(struct.calcsize(HEADER_FORMAT))
+		if len(header) != struct.calcsize(HEADER_FORMAT):
+			return None
+
+		magic, version, digest, circlesCount, polylinesCount = struct.unpack(HEADER_FORMAT, header)
+		if magic != COMPILED_MAGIC or version != COMPILED_VERSION or digest != sourceDigest:
+			return None
+
+		try:
+			result = []
+			circlesData = readDoubles(f, circlesCount * 3)
+			for i in xrange(0, len(circlesData), 3):
+				result.append(constraints.CircleCollisionConstraint(vec2f(circlesData[i], circlesData[i + 1]), circlesData[i + 2]))
+
+			for i in xrange(polylinesCount):
+				pointsCount, margin = struct.unpack(POLYLINE_FORMAT, f.read(struct.calcsize(POLYLINE_FORMAT)))
+				pointsData = readDoubles(f, pointsCount * 2)
+				points = [vec2f(pointsData[k], pointsData[k + 1]) for k in xrange(0, len(pointsData), 2)]
+				result.append(constraints.PolylineCollisionConstraint(points, margin))
+		except (EOFError, struct.error):
+			return None
+
+	return result
+
+# ==================================
+
+# Loads obstacles through the compiled cache next to the source file. The cache is keyed on the raw bytes of the
+# source and the compile parameters, a valid cache skips JSON parsing and circle merging altogether
+def loadObstacles(obstaclesPath, cachePath=None, maxSpacing=40.0, maxMergedRadius=50.0, polylineTolerance=1.0):
+	cachePath = cachePath or obstaclesPath + '.compiled'
+
+	with open(obstaclesPath, 'rb') as f:
+		source = f.read()
+
+	digest = hashlib.sha1(source)
+	digest.update(repr((maxSpacing, maxMergedRadius, polylineTolerance)).encode('ascii'))
+	digest = digest.digest()
+
+	compiled = readCompiled(cachePath, digest)
+	if compiled is not None:
+		return constraints.ConstraintList(compiled)
+
+	compiled = compileObstacles(json.loads(source.decode('utf-8')), maxSpacing, maxMergedRadius, polylineTolerance)
+	try:
+		writeCompiled(cachePath, digest, compiled)
+	except (IOError, OSError):
+		pass
+
+	return constraints.ConstraintList(compiled)
+
+# ==================================
@@ -0,0 +1,364 @@
+import argparse
+import json
+import mmap
+import struct
+import sys
+import constraints
+from spatialindex import ConstraintGrid
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+# ==================================
+
+# Columnar little-endian obstacles file, every column 8 byte values:
+#   header
+#   circle x, circle y, circle radius                       circlesCount values each
+#   polyline margin, min x, min y, max x, max y             polylinesCount values each
+#   polyline first vertex (int64)                            polylinesCount + 1 values
+#   vertex x, vertex y                                       verticesCount values each
+#   obstacle index (int64)                                   circlesCount + polylinesCount values
+#   cell key (int64)                                         cellsCount values
+#   cell first entry (int64)                                 cellsCount + 1 values
+#   cell entry (int64)                                       cellEntriesCount values
+# Obstacle indices list the obstacles in the order of the source, as indices into the circles followed
+# by the polylines. The cell columns are a ConstraintGrid of cellSize over the obstacles: the sorted keys
+# of the occupied cells and, per cell, the source positions of its obstacles in ascending order.
+# The file is mapped read-only, so every process planning on the same map shares its pages
+STORE_MAGIC = b'VMOS'
+STORE_VERSION = 2
+HEADER_FORMAT = '<4sIQQQdQQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+CIRCLE_COLUMNS = ('circleX', 'circleY', 'circleRadius')
+POLYLINE_COLUMNS = ('polylineMargin', 'polylineMinX', 'polylineMinY', 'polylineMaxX', 'polylineMaxY')
+VERTEX_COLUMNS = ('vertexX', 'vertexY')
+INTEGER_COLUMNS = ('polylineFirstVertex', 'obstacleIndex', 'cellKey', 'cellFirstEntry', 'cellEntry')
+
+def getColumnOffsets(circlesCount, polylinesCount, verticesCount, cellsCount, cellEntriesCount):
+	offsets = {}
+	offset = HEADER_SIZE
+	for name in CIRCLE_COLUMNS:
+		offsets[name] = offset
+		offset += circlesCount * 8
+	for name in POLYLINE_COLUMNS:
+		offsets[name] = offset
+		offset += polylinesCount * 8
+	offsets['polylineFirstVertex'] = offset
+	offset += (polylinesCount + 1) * 8
+	for name in VERTEX_COLUMNS:
+		offsets[name] = offset
+		offset += verticesCount * 8
+	for name, count in (('obstacleIndex', circlesCount + polylinesCount), ('cellKey', cellsCount),
+		('cellFirstEntry', cellsCount + 1), ('cellEntry', cellEntriesCount)):
+		offsets[name] = offset
+		offset += count * 8
+
+	return (offsets, offset)
+
+# Cell coordinates packed into one int64 ordered by x, then y
+def getCellKey(x, y):
+	return (x << 32) + (y + 0x80000000)
+
+# ==================================
+
+class ObstacleStore(object):
+	def __init__(self, path):
+		self.path = path
+		self.file = open(path, 'rb')
+		self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+		if len(self.data) < HEADER_SIZE:
+			self.close()
+			raise ValueError('%s is not a version %d obstacle store' % (path, STORE_VERSION))
+
+		magic, version, self.circlesCount, self.polylinesCount, self.verticesCount, self.cellSize, \
+			self.cellsCount, self.cellEntriesCount = struct.unpack_from(HEADER_FORMAT, self.data, 0)
+		if magic != STORE_MAGIC or version != STORE_VERSION:
+			self.close()
+			raise ValueError('%s is not a version %d obstacle store' % (path, STORE_VERSION))
+
+		self.offsets, size = getColumnOffsets(self.circlesCount, self.polylinesCount, self.verticesCount, self.cellsCount, self.cellEntriesCount)
+		if len(self.data) < size:
+			self.close()
+			raise ValueError('%s is truncated' % path)
+
+	def close(self):
+		self.data.close()
+		self.file.close()
+
+	def value(self, column, index):
+		return struct.unpack_from('<d', self.data, self.offsets[column] + index * 8)[0]
+
+	def integer(self, column, index):
+		return struct.unpack_from('<q', self.data, self.offsets[column] + index * 8)[0]
+
+	# Index into the circles followed by the polylines of the obstacle at a position of the source order
+	def obstacleIndex(self, position):
+		return self.integer('obstacleIndex', position)
+
+	# Source positions of the obstacles registered in a cell, ascending
+	def cellEntries(self, x, y):
+		key = getCellKey(x, y)
+		offset = self.offsets['cellKey']
+		data = self.data
+
+		# binary search over the mapped keys
+		low = 0
+		high = self.cellsCount
+		while low < high:
+			middle = (low + high) >> 1
+			if struct.unpack_from('<q', data, offset + middle * 8)[0] < key:
+				low = middle + 1
+			else:
+				high = middle
+
+		if low == self.cellsCount or struct.unpack_from('<q', data, offset + low * 8)[0] != key:
+			return ()
+
+		first, last = struct.unpack_from('<2q', data, self.offsets['cellFirstEntry'] + low * 8)
+		return struct.unpack_from('<%dq' % (last - first), data, self.offsets['cellEntry'] + first * 8)
+
+	def circle(self, index):
+		return (self.value('circleX', index), self.value('circleY', index), self.value('circleRadius', index))
+
+	def polylineMargin(self, index):
+		return self.value('polylineMargin', index)
+
+	def polylineBounds(self, index):
+		return (self.value('polylineMinX', index), self.value('polylineMinY', index),
+			self.value('polylineMaxX', index), self.value('polylineMaxY', index))
+
+	# Returns (margin, xs, ys) of a polyline
+	def polyline(self, index):
+		first, last = struct.unpack_from('<2q', self.data, self.offsets['polylineFirstVertex'] + index * 8)
+		count = last - first
+		xs = struct.unpack_from('<%dd' % count, self.data, self.offsets['vertexX'] + first * 8)
+		ys = struct.unpack_from('<%dd' % count, self.data, self.offsets['vertexY'] + first * 8)
+		return (self.polylineMargin(index), xs, ys)
+
+	# Whole column as a read-only array viewing the mapped file, needs numpy
+	def column(self, name):
+		if np is None:
+			raise RuntimeError('numpy is required for column access')
+
+		if name in CIRCLE_COLUMNS:
+			count = self.circlesCount
+		elif name in POLYLINE_COLUMNS:
+			count = self.polylinesCount
+		elif name in INTEGER_COLUMNS:
+			count = {
+				'polylineFirstVertex': self.polylinesCount + 1,
+				'obstacleIndex': self.circlesCount + self.polylinesCount,
+				'cellKey': self.cellsCount,
+				'cellFirstEntry': self.cellsCount + 1,
+				'cellEntry': self.cellEntriesCount,
+			}[name]
+			return np.frombuffer(self.data, dtype='<i8', count=count, offset=self.offsets[name])
+		else:
+			count = self.verticesCount
+
+		return np.frombuffer(self.data, dtype='<f8', count=count, offset=self.offsets[name])
+
+# ==================================
+
+# ConstraintGrid over a LazyConstraintList, the obstacles of the store are found through the cell index of the
+# file and only built when a query returns them, so opening a store registers nothing. Their check order is
+# their source position. Other constraints can still be inserted, store obstacles removed or updated, those
+# are then dropped from the store cells and kept as regular entries
+class StoreConstraintGrid(ConstraintGrid):
+	def __init__(self, lazyConstraints):
+		super(StoreConstraintGrid, self).__init__(lazyConstraints.store.cellSize)
+		self.lazyConstraints = lazyConstraints
+		self.store = lazyConstraints.store
+		# source positions of the store obstacles no longer answered from the store cells
+		self.detached = set()
+		self.nextOrder = len(lazyConstraints)
+
+	def __len__(self):
+		return len(self.entries) + len(self.lazyConstraints) - len(self.detached)
+
+	def __contains__(self, constraint):
+		key = self.keyOf(constraint)
+		return key in self.entries or (type(key) is tuple and key[1] not in self.detached)
+
+	def constraints(self):
+		entries = [(index, index) for index in xrange(len(self.lazyConstraints)) if index not in self.detached]
+		entries.extend((entry[0], entry[1]) for entry in self.entries.itervalues())
+		entries.sort(key=lambda entry: entry[0])
+		return [self.resolve(entry[1]) for entry in entries]
+
+	def keyOf(self, constraint):
+		index = self.lazyConstraints.indexOf(constraint)
+		return id(constraint) if index is None else ('store', index)
+
+	def resolve(self, value):
+		if type(value) is not int:
+			return value
+
+		# built constraints are looked up directly, most query results were returned before
+		constraint = self.lazyConstraints.built.get(value)
+		return constraint if constraint is not None else self.lazyConstraints[value]
+
+	def isStoreEntry(self, key):
+		return type(key) is tuple and key[1] not in self.detached
+
+	def insert(self, constraint, order=None):
+		key = self.keyOf(constraint)
+		if self.isStoreEntry(key):
+			# moved to the regular entries, in its own place of the check order
+			self.detached.add(key[1])
+			self.addEntry(key, key[1] if order is None else order, constraint, constraint.getBounds())
+			return
+
+		super(StoreConstraintGrid, self).insert(constraint, order)
+
+	def remove(self, constraint):
+		key = self.keyOf(constraint)
+		if self.isStoreEntry(key):
+			if self.frozen:
+				raise RuntimeError('frozen constraint grid can not be changed')
+
+			self.detached.add(key[1])
+			self.version += 1
+			return True
+
+		return super(StoreConstraintGrid, self).remove(constraint)
+
+	def orderOf(self, constraint):
+		key = self.keyOf(constraint)
+		if self.isStoreEntry(key):
+			return key[1]
+
+		return self.entries[key][0]
+
+	def collectCell(self, x, y, minOrder, found):
+		super(StoreConstraintGrid, self).collectCell(x, y, minOrder, found)
+
+		detached = self.detached
+		for index in self.store.cellEntries(x, y):
+			if index > minOrder and index not in detached:
+				found[('store', index)] = (index, index)
+
+# Opens a store and returns (store, constraints, index) ready for PathFindingAlgorithm
+def openStore(path):
+	store = ObstacleStore(path)
+	lazyConstraints = constraints.ConstraintFactory().fromStore(store)
+	return (store, lazyConstraints, StoreConstraintGrid(lazyConstraints))
+
+def isStoreFile(path):
+	with open(path, 'rb') as f:
+		return f.read(len(STORE_MAGIC)) == STORE_MAGIC
+
+# ==================================
+
+def packColumn(f, typeCode, values):
+	f.write(struct.pack('<%d%s' % (len(values), typeCode), *values))
+
+# Writes circle and polyline constraints keeping their order and a cell index of cellSize over them,
+# other constraint types are skipped
+def writeStore(path, constraintsList, cellSize=128.0):
+	obstacles = [c for c in constraintsList if isinstance(c, (constraints.CircleCollisionConstraint, constraints.PolylineCollisionConstraint))]
+	circles = [c for c in obstacles if isinstance(c, constraints.CircleCollisionConstraint)]
+	polylines = [c for c in obstacles if isinstance(c, constraints.PolylineCollisionConstraint)]
+
+	circleIndices = dict((id(c), index) for index, c in enumerate(circles))
+	polylineIndices = dict((id(c), len(circles) + index) for index, c in enumerate(polylines))
+	obstacleIndices = [circleIndices[id(c)] if id(c) in circleIndices else polylineIndices[id(c)] for c in obstacles]
+
+	firstVertices = [0]
+	for polyline in polylines:
+		firstVertices.append(firstVertices[-1] + len(polyline.points))
+
+	bounds = [polylineBounds(polyline) for polyline in polylines]
+	cellKeys, cellFirstEntries, cellEntries = buildCellIndex(obstacles, cellSize)
+
+	with open(path, 'wb') as f:
+		f.write(struct.pack(HEADER_FORMAT, STORE_MAGIC, STORE_VERSION, len(circles), len(polylines), firstVertices[-1],
+			cellSize, len(cellKeys), len(cellEntries)))
+
+		packColumn(f, 'd', [c.center.x for c in circles])
+		packColumn(f, 'd', [c.center.y for c in circles])
+		packColumn(f, 'd', [c.radius for c in circles])
+
+		packColumn(f, 'd', [polyline.margin for polyline in polylines])
+		for k in xrange(4):
+			packColumn(f, 'd', [b[k] for b in bounds])
+
+		packColumn(f, 'q', firstVertices)
+		packColumn(f, 'd', [point.x for polyline in polylines for point in polyline.points])
+		packColumn(f, 'd', [point.y for polyline in polylines for point in polyline.points])
+
+		packColumn(f, 'q', obstacleIndices)
+		packColumn(f, 'q', cellKeys)
+		packColumn(f, 'q', cellFirstEntries)
+		packColumn(f, 'q', cellEntries)
+
+# Cells of a ConstraintGrid over the obstacles with the bounds the store reports for them,
+# returns the sorted cell keys, the first entry of every cell and the entries
+def buildCellIndex(obstacles, cellSize):
+	grid = ConstraintGrid(cellSize)
+	cells = {}
+	for position, obstacle in enumerate(obstacles):
+		if isinstance(obstacle, constraints.CircleCollisionConstraint):
+			bounds = obstacle.getBounds()
+		else:
+			minX, minY, maxX, maxY = polylineBounds(obstacle)
+			margin = obstacle.margin
+			bounds = (minX - margin, minY - margin, maxX + margin, maxY + margin)
+
+		x0, y0, x1, y1 = grid.cellRange(*bounds)
+		for x in xrange(x0, x1 + 1):
+			for y in xrange(y0, y1 + 1):
+				cells.setdefault(getCellKey(x, y), []).append(position)
+
+	cellKeys = sorted(cells)
+	cellFirstEntries = [0]
+	cellEntries = []
+	for key in cellKeys:
+		cellEntries.extend(cells[key])
+		cellFirstEntries.append(len(cellEntries))
+
+	return (cellKeys, cellFirstEntries, cellEntries)
+
+def polylineBounds(polyline):
+	if not polyline.points:
+		return (0.0, 0.0, 0.0, 0.0)
+
+	xs = [point.x for point in polyline.points]
+	ys = [point.y for point in polyline.points]
+	return (min(xs), min(ys), max(xs), max(ys))
+
+def convertJson(obstaclesPath, storePath):
+	with open(obstaclesPath) as f:
+		obstaclesData = json.load(f)
+
+	factory = constraints.ConstraintFactory()
+	writeStore(storePath, [factory.fromShapeDef(shapeDef) for shapeDef in obstaclesData['data']])
+
+# ==================================
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Converts obstacles JSON into the memory mapped columnar store.')
+	parser.add_argument('obstacles', help='obstacles JSON file')
+	parser.add_argument('store', help='store file to write')
+	parser.add_argument('--compile', action='store_true', help='merge and simplify obstacles with obstaclecompiler first')
+	args = parser.parse_args(argv)
+
+	if args.compile:
+		import obstaclecompiler
+		with open(args.obstacles) as f:
+			writeStore(args.store, obstaclecompiler.compileObstacles(json.load(f)))
+	else:
+		convertJson(args.obstacles, args.store)
+
+	return 0
+
+# ==================================
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
+
+# ==================================
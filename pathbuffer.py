@@ -0,0 +1,146 @@
+from array import array
+from smath import vec2f
+
+# ==================================
+
+# Grows values, an array('d'), to hold at least count of them, at least doubling it so appends stay cheap
+def reserveArray(values, count):
+	if count > len(values):
+		values.extend(array('d', [0.0]) * max(count - len(values), len(values)))
+
+# Start and stop of a del buffer[index] on the first count values, only steps of 1 are supported
+def deletedRange(index, count):
+	if isinstance(index, slice):
+		start, stop, step = index.indices(count)
+		if step != 1:
+			raise ValueError('only contiguous ranges can be deleted')
+		return (start, max(start, stop))
+
+	if index < 0:
+		index += count
+	if index < 0 or index >= count:
+		raise IndexError('path index out of range')
+	return (index, index + 1)
+
+# ==================================
+
+# Rotations in degrees of a PathBuffer, the first len() values of an array('d') that only grows
+class RotationBuffer(object):
+	def __init__(self, capacity=0):
+		self.values = array('d', [0.0]) * capacity
+		self.count = 0
+
+	def append(self, rotation):
+		if self.count == len(self.values):
+			reserveArray(self.values, self.count + 1)
+		self.values[self.count] = rotation
+		self.count += 1
+
+	def __len__(self):
+		return self.count
+
+	def __getitem__(self, index):
+		if index < 0:
+			index += self.count
+		if index < 0 or index >= self.count:
+			raise IndexError('path index out of range')
+
+		return self.values[index]
+
+	def __setitem__(self, index, rotation):
+		if index < 0:
+			index += self.count
+		if index < 0 or index >= self.count:
+			raise IndexError('path index out of range')
+
+		self.values[index] = rotation
+
+	def __delitem__(self, index):
+		start, stop = deletedRange(index, self.count)
+		values = self.values
+		for k in xrange(stop, self.count):
+			values[k - stop + start] = values[k]
+		self.count -= stop - start
+
+	def __iter__(self):
+		values = self.values
+		for k in xrange(self.count):
+			yield values[k]
+
+# Reusable structure of arrays path: point x, point y and rotation in degrees, each an array('d').
+# The arrays only grow and len() tells how many values are in use, so a buffer handed to every getPath call
+# stops allocating once it held the longest path. The planner writes its points and rotations straight into it.
+# Indexing and iteration build vec2f points for code expecting a list of points, code reading a lot of paths
+# should take the first len() values of xs/ys and rotations.values directly
+class PathBuffer(object):
+	def __init__(self, capacity=0):
+		self.xs = array('d', [0.0]) * capacity
+		self.ys = array('d', [0.0]) * capacity
+		self.rotations = RotationBuffer(capacity)
+		self.count = 0
+
+	# Overwrites the buffer with a path of vec2f points and rotations
+	def assign(self, points, rotations):
+		count = len(points)
+		reserveArray(self.xs, count)
+		reserveArray(self.ys, count)
+		reserveArray(self.rotations.values, count)
+
+		xs = self.xs
+		ys = self.ys
+		values = self.rotations.values
+		for k, point in enumerate(points):
+			xs[k] = point.x
+			ys[k] = point.y
+			values[k] = rotations[k]
+
+		self.count = count
+		self.rotations.count = count
+
+	def append(self, point):
+		if self.count == len(self.xs):
+			reserveArray(self.xs, self.count + 1)
+			reserveArray(self.ys, self.count + 1)
+		self.xs[self.count] = point.x
+		self.ys[self.count] = point.y
+		self.count += 1
+
+	def point(self, index):
+		return vec2f(self.xs[index], self.ys[index])
+
+	def __len__(self):
+		return self.count
+
+	def __getitem__(self, index):
+		if index < 0:
+			index += self.count
+		if index < 0 or index >= self.count:
+			raise IndexError('path index out of range')
+
+		return vec2f(self.xs[index], self.ys[index])
+
+	def __setitem__(self, index, point):
+		if index < 0:
+			index += self.count
+		if index < 0 or index >= self.count:
+			raise IndexError('path index out of range')
+
+		self.xs[index] = point.x
+		self.ys[index] = point.y
+
+	def __delitem__(self, index):
+		start, stop = deletedRange(index, self.count)
+		xs = self.xs
+		ys = self.ys
+		for k in xrange(stop, self.count):
+			xs[k - stop + start] = xs[k]
+			ys[k - stop + start] = ys[k]
+		self.count -= stop - start
+
+	def __iter__(self):
+		xs = self.xs
+		ys = self.ys
+		for k in xrange(self.count):
+			yield vec2f(xs[k], ys[k])
+
+# ==================================
@@ -0,0 +1,98 @@
+import collections
+from pathfinder import PLANNER_SETTINGS
+from smath import vec2f, velocityToAngle, angleToVelocity
+
+# ==================================
+
+# Version of the constraints a planner checks against: the index keeps its own change counter, without one
+# the constraints have to count their changes, as constraints.ConstraintList and LazyConstraintList do
+def getConstraintsVersion(pathfinder):
+	if pathfinder.constraintIndex is not None:
+		return (id(pathfinder.constraintIndex), pathfinder.constraintIndex.version)
+
+	version = getattr(pathfinder.constraints, 'version', None)
+	if version is None:
+		raise ValueError('PathCache needs a constraintIndex or a constraints.ConstraintList to notice constraint changes')
+
+	return (id(pathfinder.constraints), version)
+
+# ==================================
+
+# LRU cache around PathFindingAlgorithm.getPath. Inputs are snapped to a grid of positionStep units and
+# angleStep degrees before planning, so every state in a cell shares one path. Changing the constraints clears the cache
+class PathCache(object):
+	def __init__(self, pathfinder, maxSize=1024, positionStep=0.5, angleStep=0.5):
+		self.pathfinder = pathfinder
+		self.maxSize = maxSize
+		self.positionStep = float(positionStep)
+		self.angleStep = float(angleStep)
+		self.entries = collections.OrderedDict()
+		self.constraintsVersion = None
+		self.resetStats()
+
+	def __len__(self):
+		return len(self.entries)
+
+	def clear(self):
+		self.entries.clear()
+
+	def resetStats(self):
+		self.stats = { 'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0 }
+
+	def getStats(self):
+		stats = dict(self.stats)
+		stats['size'] = len(self.entries)
+		lookups = stats['hits'] + stats['misses']
+		stats['hitRate'] = stats['hits'] / float(lookups) if lookups else 0.0
+		return stats
+
+	def quantizePosition(self, v):
+		return (int(round(v.x / self.positionStep)), int(round(v.y / self.positionStep)))
+
+	def quantizeDirection(self, v):
+		return int(round(velocityToAngle(v) / self.angleStep))
+
+	def getKey(self, position, velocity, targetPosition, targetVelocity):
+		pathfinder = self.pathfinder
+		return (self.quantizePosition(position), self.quantizeDirection(velocity),
+			self.quantizePosition(targetPosition), self.quantizeDirection(targetVelocity)) + \
+			tuple(getattr(pathfinder, name) for name in PLANNER_SETTINGS)
+
+	def getPath(self, position, velocity, targetPosition, targetVelocity):
+		pathfinder = self.pathfinder
+
+		# incremental plans depend on the previous call, they can't be shared
+		if pathfinder.incrementalEnabled:
+			return pathfinder.getPath(position, velocity, targetPosition, targetVelocity)
+
+		constraintsVersion = getConstraintsVersion(pathfinder)
+		if constraintsVersion != self.constraintsVersion:
+			if self.entries:
+				self.stats['invalidations'] += 1
+				self.entries.clear()
+			self.constraintsVersion = constraintsVersion
+
+		key = self.getKey(position, velocity, targetPosition, targetVelocity)
+		path = self.entries.pop(key, None)
+
+		if path is None:
+			self.stats['misses'] += 1
+			path = pathfinder.getPath(vec2f(key[0][0] * self.positionStep, key[0][1] * self.positionStep),
+				angleToVelocity(key[1] * self.angleStep),
+				vec2f(key[2][0] * self.positionStep, key[2][1] * self.positionStep),
+				angleToVelocity(key[3] * self.angleStep))
+			# a pathBuffer result is overwritten by the next plan and callers may change the vec2f points they get
+			# in place, entries keep immutable copies of their own
+			path = (tuple((point.x, point.y) for point in path["points"]), tuple(path["rotations"]), tuple(path["failedSteps"]))
+
+			if len(self.entries) >= self.maxSize:
+				self.entries.popitem(last=False)
+				self.stats['evictions'] += 1
+		else:
+			self.stats['hits'] += 1
+
+		self.entries[key] = path
+		points, rotations, failedSteps = path
+		return { "points": [vec2f(x, y) for x, y in points], "rotations": list(rotations), "failedSteps": list(failedSteps) }
+
+# ==================================
@@ -0,0 +1,163 @@
+import struct
+import numpy as np
+
+# ==================================
+
+# Compact paths: the start pose of every path, then one int16 heading change per step in units of angleStep
+# degrees, every step moving stepLength along the new heading. Steps the deltas can't follow within maxError,
+# those moved by constraint suggestions or backward filtering, are escape codes with their exact point and rotation.
+# Paths are encoded and decoded a step at a time for the whole batch, the decoder repeats the encoder's arithmetic
+# so every decoded point is the one the encoder checked
+CODEC_MAGIC = b'VMPC'
+CODEC_VERSION = 1
+HEADER_FORMAT = '<4sIIIddI'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+ESCAPE = -32768
+MAX_CODE = 32767
+
+def wrapAngleArray(a):
+	return (a + 180.0) % 360.0 - 180.0
+
+# Decoder step shared by both directions, returns the next rotations and points
+def advanceArray(points, rotations, codes, angleStep, stepLengths):
+	rotations = rotations + codes * angleStep
+	angles = np.radians(rotations)
+	points = points + np.stack((np.cos(angles), np.sin(angles)), axis=-1) * stepLengths[:, np.newaxis]
+	return (points, rotations)
+
+# ==================================
+
+class EncodedPaths(object):
+	def __init__(self, angleStep, maxError, lengths, stepLengths, starts, codes, escapeIndices, escapes):
+		self.angleStep = angleStep
+		self.maxError = maxError
+		# points of every path, N
+		self.lengths = lengths
+		# N
+		self.stepLengths = stepLengths
+		# x, y, rotation of the first points, N x 3
+		self.starts = starts
+		# N x (steps - 1), zero past the end of shorter paths
+		self.codes = codes
+		# flat indices into codes of the escapes, ascending, and their x, y, rotation, E x 3
+		self.escapeIndices = escapeIndices
+		self.escapes = escapes
+
+	def toBytes(self):
+		count, steps = self.codes.shape
+		return b''.join((
+			struct.pack(HEADER_FORMAT, CODEC_MAGIC, CODEC_VERSION, count, steps + 1, self.angleStep, self.maxError, len(self.escapeIndices)),
+			self.lengths.astype('<i4').tobytes(),
+			self.stepLengths.astype('<f8').tobytes(),
+			self.starts.astype('<f8').tobytes(),
+			self.codes.astype('<i2').tobytes(),
+			self.escapeIndices.astype('<i8').tobytes(),
+			self.escapes.astype('<f8').tobytes(),
+		))
+
+	@staticmethod
+	def fromBytes(data):
+		magic, version, count, pointsCount, angleStep, maxError, escapesCount = struct.unpack_from(HEADER_FORMAT, data, 0)
+		if magic != CODEC_MAGIC or version != CODEC_VERSION:
+			raise ValueError('not version %d encoded paths' % CODEC_VERSION)
+
+		offset = [HEADER_SIZE]
+		def column(dtype, size, shape):
+			values = np.frombuffer(data, dtype=dtype, count=size, offset=offset[0]).reshape(shape)
+			offset[0] += values.nbytes
+			return values
+
+		steps = max(pointsCount - 1, 0)
+		return EncodedPaths(angleStep, maxError,
+			column('<i4', count, (count,)),
+			column('<f8', count, (count,)),
+			column('<f8', count * 3, (count, 3)),
+			column('<i2', count * steps, (count, steps)),
+			column('<i8', escapesCount, (escapesCount,)),
+			column('<f8', escapesCount * 3, (escapesCount, 3)))
+
+# ==================================
+
+# points N x P x 2, rotations N x P in degrees, stepLengths a number or N values, usually the playerSpeed of
+# the paths, lengths the points of every path when some are shorter than P. Decoded points stay within maxError
+# of the source and rotations within angleStep / 2 degrees
+def encodePaths(points, rotations, stepLengths, lengths=None, angleStep=0.001, maxError=0.01):
+	points = np.asarray(points, dtype=float)
+	rotations = np.asarray(rotations, dtype=float)
+	count, pointsCount = rotations.shape
+	steps = max(pointsCount - 1, 0)
+	lengths = np.full(count, pointsCount, dtype=np.int32) if lengths is None else np.asarray(lengths, dtype=np.int32)
+	stepLengths = np.broadcast_to(np.asarray(stepLengths, dtype=float), (count,)).copy()
+
+	codes = np.zeros((count, steps), dtype=np.int16)
+	decodedPoints = points[:, 0].copy()
+	decodedRotations = rotations[:, 0].copy()
+
+	for k in xrange(1, pointsCount):
+		active = k < lengths
+		target = points[:, k]
+		quantized = np.rint(wrapAngleArray(rotations[:, k] - decodedRotations) / angleStep)
+		stepCodes = np.clip(quantized, -MAX_CODE, MAX_CODE)
+
+		nextPoints, nextRotations = advanceArray(decodedPoints, decodedRotations, stepCodes, angleStep, stepLengths)
+		error = np.sqrt(((nextPoints - target) ** 2).sum(axis=-1))
+		escaped = active & ((error > maxError) | (quantized != stepCodes))
+
+		codes[:, k - 1] = np.where(escaped, ESCAPE, np.where(active, stepCodes, 0))
+		decodedPoints = np.where(escaped[:, np.newaxis], target, nextPoints)
+		decodedRotations = np.where(escaped, rotations[:, k], nextRotations)
+
+	escapeIndices = np.flatnonzero(codes == ESCAPE)
+	rows, columns = np.divmod(escapeIndices, max(steps, 1))
+	escapes = np.column_stack((points[rows, columns + 1], rotations[rows, columns + 1]))
+	starts = np.column_stack((points[:, 0], rotations[:, 0]))
+
+	return EncodedPaths(angleStep, maxError, lengths, stepLengths, starts, codes, escapeIndices, escapes)
+
+# Returns points N x P x 2, rotations N x P in degrees wrapped to [-180; 180) and the lengths of the paths
+def decodePaths(encoded):
+	count, steps = encoded.codes.shape
+	points = np.zeros((count, steps + 1, 2))
+	rotations = np.zeros((count, steps + 1))
+
+	exact = np.zeros((count * steps, 3))
+	exact[encoded.escapeIndices] = encoded.escapes
+	exact = exact.reshape((count, steps, 3))
+
+	decodedPoints = encoded.starts[:, :2].copy()
+	decodedRotations = encoded.starts[:, 2].copy()
+	points[:, 0] = decodedPoints
+	rotations[:, 0] = decodedRotations
+
+	for k in xrange(1, steps + 1):
+		stepCodes = encoded.codes[:, k - 1].astype(float)
+		escaped = encoded.codes[:, k - 1] == ESCAPE
+
+		nextPoints, nextRotations = advanceArray(decodedPoints, decodedRotations, np.where(escaped, 0.0, stepCodes), encoded.angleStep, encoded.stepLengths)
+		decodedPoints = np.where(escaped[:, np.newaxis], exact[:, k - 1, :2], nextPoints)
+		decodedRotations = np.where(escaped, exact[:, k - 1, 2], nextRotations)
+		points[:, k] = decodedPoints
+		rotations[:, k] = wrapAngleArray(decodedRotations)
+
+	rotations[:, 0] = wrapAngleArray(rotations[:, 0])
+	return (points, rotations, encoded.lengths.copy())
+
+# ==================================
+
+# getPath results as the arrays encodePaths takes, shorter paths are padded with their last point
+def pathsToArrays(paths):
+	lengths = np.array([len(path["points"]) for path in paths], dtype=np.int32)
+	pointsCount = int(lengths.max()) if len(paths) else 0
+	points = np.zeros((len(paths), pointsCount, 2))
+	rotations = np.zeros((len(paths), pointsCount))
+
+	for n, path in enumerate(paths):
+		length = lengths[n]
+		points[n, :length] = [(point.x, point.y) for point in path["points"]]
+		rotations[n, :length] = path["rotations"]
+		points[n, length:] = points[n, length - 1]
+		rotations[n, length:] = rotations[n, length - 1]
+
+	return (points, rotations, lengths)
+
+# ==================================
@@ -1,73 +1,215 @@
 import math
-import constraints
+import timeit
 from smath import *
 
+# Default of PathFindingAlgorithm.attractionDistance
 attractionDistance = 60
+
+# Turns already clamped to the steering limit come back slightly above it,
+# compare with a tolerance so rounding doesn't trigger another filtering step
+steeringAngleTolerance = 1e-9
+
+# Planner attributes planPath takes over from its settings
+PLANNER_SETTINGS = ("pathPointsCount", "playerSpeed", "maxSteeringAngle", "attractionDistance", "pushAwayTreshold", "pushAwayStrength", "tangentSide", "backwardFilterWindow",
+	"filteringMode", "smoothingWindow", "convergenceSteps", "convergenceOffset", "convergenceHeading",
+	"continuousCollision", "maxConstraintPasses")
+
+# Stateless planning: every call runs on a planner of its own, the constraints and the index are only read and
+# the result is freshly allocated, so one loaded world can serve any number of threads. Freeze the index first
+# so queries don't update its statistics. settings is any object with the PLANNER_SETTINGS attributes,
+# usually a configured PathFindingAlgorithm. A pathBuffer, owned by the calling thread, receives the result
+def planPath(constraintSet, constraintIndex, position, velocity, targetPosition, targetVelocity, settings=None, pathBuffer=None):
+	planner = PathFindingAlgorithm()
+	planner.pathBuffer = pathBuffer
+	if settings is not None:
+		for name in PLANNER_SETTINGS:
+			setattr(planner, name, getattr(settings, name))
+
+	planner.constraints = constraintSet
+	planner.constraintIndex = constraintIndex
+	return planner.getPath(position, velocity, targetPosition, targetVelocity)
 		
 class PathFindingAlgorithm():
 	def __init__(self):
 		self.pathPoints = []
 		self.pathOrientations = []
+		# When set, the path is generated straight into this PathBuffer, getPath returns it in place of new lists.
+		# The buffer is overwritten by the next call, callers keeping a path copy it
+		self.pathBuffer = None
 		self.constraints = []
+		self.constraintIndex = None
 		self.executionTime = 0
+		self.turnLimit = None
+		self.tracer = None
 		self.pathPointsCount = 40
 		self.playerSpeed = 10
 		self.maxSteeringAngle = radians(20)
+		# Farther than this from the target direction line the player heads for the line, closer it stabilizes along it
+		self.attractionDistance = attractionDistance
 		self.logEnabled = False
 		self.pushAwayTreshold = 0.15
+		self.pushAwayStrength = 0.4
+		# Side obstacles are passed on, 1 turning left, -1 turning right, None for the side the step is already on
+		self.tangentSide = None
+		# Swept constraint tests catch steps passing through a constraint, suggestions are applied
+		# in the order of impact. After maxConstraintPasses passes a step is kept as is and reported in failedSteps
+		self.continuousCollision = False
+		self.maxConstraintPasses = 32
+		self.failedSteps = []
+		# How many points back a single backward filtering pass may reach, None for all the way to the start
+		self.backwardFilterWindow = None
+		# "backward" filters back from every constraint contact while planning, "smooth" runs a single
+		# forward-backward pass over the finished path reaching smoothingWindow points back from each contact
+		self.filteringMode = "backward"
+		self.smoothingWindow = 8
+		# Early termination: after convergenceSteps steps within convergenceOffset of the target line and
+		# convergenceHeading of its direction, the rest of the path follows the line without simulation
+		self.convergenceSteps = None
+		self.convergenceOffset = 0.01
+		self.convergenceHeading = radians(0.01)
+		self.incrementalEnabled = False
+		self.replanTolerance = 0.001
+		self.replanAngleTolerance = 0.01
+		self.pathStates = []
+		self.pathContacts = []
+		self.planKey = None
+		self.invalidStep = None
 	
 	def getPath(self, position, velocity, targetPosition, targetVelocity):
-		self.pathPoints = []
-		self.pathOrientations = []
+		for pointIndex in self.generatePath(position, velocity, targetPosition, targetVelocity):
+			pass
+
+		# Return result path
+		if self.pathBuffer is not None:
+			return { "points": self.pathPoints, "rotations": self.pathOrientations, "failedSteps": list(self.failedSteps) }
+
+		return { "points": self.pathPoints, "rotations": self.pathOrientations, "failedSteps": self.failedSteps }
+
+	# Yields (point, rotation) pairs as soon as backward filtering can no longer change them.
+	# Without backwardFilterWindow or with smoothing any earlier point may still change, so only the start
+	# point comes early. Stopping the iteration early skips the rest of the planning work
+	def iterPath(self, position, velocity, targetPosition, targetVelocity):
+		window = self.backwardFilterWindow if self.filteringMode == "backward" else None
+		emitted = 0
+
+		for pointIndex in self.generatePath(position, velocity, targetPosition, targetVelocity):
+			finalIndex = 0 if window is None else pointIndex - window - 2
+			while emitted <= finalIndex:
+				yield (self.pathPoints[emitted], self.pathOrientations[emitted])
+				emitted += 1
+
+		while emitted < len(self.pathPoints):
+			yield (self.pathPoints[emitted], self.pathOrientations[emitted])
+			emitted += 1
+
+	# Generates the path into pathPoints/pathOrientations, yields the index of every new point
+	def generatePath(self, position, velocity, targetPosition, targetVelocity):
+		startTime = timeit.default_timer()
+		tracer = self.tracer
+		logEnabled = self.logEnabled
+		if tracer is not None:
+			tracer.beginCall()
+
+		# the path keeps its own copies, callers' vectors are never stored or changed
+		position = vec2f(position.x, position.y)
+		velocity = vec2f(velocity.x, velocity.y)
+		targetPosition = vec2f(targetPosition.x, targetPosition.y)
+		targetVelocity = vec2f(targetVelocity.x, targetVelocity.y)
+
+		firstStep = 0
+		if self.incrementalEnabled:
+			firstStep = self.reusePreviousPlan(position, velocity, targetPosition, targetVelocity)
+		else:
+			self.planKey = None
+
+		if firstStep == 0:
+			# Add first trajectory point at current player state. With a pathBuffer the points and rotations
+			# go straight into it and the other lists are refilled instead of allocated again
+			if self.pathBuffer is not None:
+				self.pathPoints = self.pathBuffer
+				self.pathOrientations = self.pathBuffer.rotations
+				for pathList in (self.pathPoints, self.pathOrientations, self.pathStates, self.pathContacts, self.failedSteps):
+					del pathList[:]
+				self.pathPoints.append(position)
+				self.pathOrientations.append(velocityToAngle(velocity))
+				self.pathStates.append((position, velocity))
+				self.pathContacts.append(False)
+			else:
+				self.pathPoints = [position]
+				self.pathOrientations = [velocityToAngle(velocity)]
+				self.pathStates = [(position, velocity)]
+				self.pathContacts = [False]
+				self.failedSteps = []
+		elif tracer is not None:
+			tracer.count("reusedSteps", firstStep)
 
 		# Setup initial data for points generation
 		targetFront = targetVelocity
-		targetRight = rotate(targetVelocity, 90)
-		playerPos = position
+		targetRight = perpendicular(targetVelocity)
+		subTargetLeft = rotateBy(targetVelocity, ROTATION_45)
+		subTargetRight = rotateBy(targetVelocity, inverseRotation(ROTATION_45))
+		playerPos, playerVelocity = self.pathStates[-1]
 		targetPos = targetPosition
-		playerVelocity = velocity
 		playerSpeed = self.playerSpeed
-		playerRotation = velocityToAngle(playerVelocity)
+		attractionDistance = self.attractionDistance
 		oldVelocity = playerVelocity
 		oldPos = playerPos
 
-		# Add first trajectory point at current player state
-		self.pathPoints.append(playerPos)
-		self.pathOrientations.append(playerRotation)
+		convergenceCos = math.cos(self.convergenceHeading)
+		convergedSteps = 0
 
 		# Generate points of trajectory
-		for i in xrange(self.pathPointsCount):
-			self.log('====================')
-			self.log('point [%d]' % i)
+		i = firstStep
+		while i < self.pathPointsCount:
+			if tracer is not None:
+				phaseStart = timeit.default_timer()
+
+			if self.convergenceSteps is not None and convergedSteps >= self.convergenceSteps:
+				convergedSteps = 0
+				extendedCount = self.extendStraight(playerPos, vec2f(targetFront.x, targetFront.y), self.pathPointsCount - i)
+
+				if extendedCount > 0:
+					for pointIndex in xrange(i + 1, i + extendedCount + 1):
+						yield pointIndex
+
+					i += extendedCount
+					playerPos, playerVelocity = self.pathStates[-1]
+					oldPos = playerPos
+					oldVelocity = playerVelocity
+					if i >= self.pathPointsCount:
+						break
 
-			frontCos = dot(playerVelocity, targetFront)
 			rightCos = dot(playerVelocity, targetRight)
-			self.log('frontCos: %1.3f' % frontCos)
-			self.log('rightCos: %1.3f' % rightCos)
 			
 			distanceToTargetDirectionLine = (playerPos.x - targetPos.x) * targetVelocity.y - (playerPos.y - targetPos.y) * targetVelocity.x
 			isAttractionMode = abs(distanceToTargetDirectionLine) > attractionDistance
-			self.log('isAttractionMode: %s' % isAttractionMode)
 			side = True if distanceToTargetDirectionLine > 0 else False
 			
-			self.log('distanceToTargetDirectionLine: %1.3f' % distanceToTargetDirectionLine)
-			self.log('line side: %s' % ("left" if side else "right"))
-			
 			sideSign = 1 if side else -1
-			subTargetVelocity = rotate(targetVelocity, 45 * sideSign)
-			self.log('subTargetVelocity: %s' % subTargetVelocity)
+			subTargetVelocity = subTargetLeft if side else subTargetRight
+
+			if logEnabled:
+				self.log('====================')
+				self.log('point [%d]' % i)
+				self.log('frontCos: %1.3f' % dot(playerVelocity, targetFront))
+				self.log('rightCos: %1.3f' % rightCos)
+				self.log('isAttractionMode: %s' % isAttractionMode)
+				self.log('distanceToTargetDirectionLine: %1.3f' % distanceToTargetDirectionLine)
+				self.log('line side: %s' % ("left" if side else "right"))
+				self.log('subTargetVelocity: %s' % subTargetVelocity)
 			
 			if isAttractionMode:
-				playerVelocity += subTargetVelocity
+				playerVelocity = playerVelocity + subTargetVelocity
 			else:
 				stabilizationFactor = 1 - (abs(distanceToTargetDirectionLine) / attractionDistance)
 				
 				shouldStickToTargetDirection = rightCos * sideSign < 0.1
 				if rightCos * sideSign > self.pushAwayTreshold:
-					self.log('Is pushing velocity away')
+					if logEnabled:
+						self.log('Is pushing velocity away')
 					
 					# Predict velocity and orientation relative to the target direction line
-					newVelocity = playerVelocity + (targetRight * -sideSign) * stabilizationFactor * 0.4
+					newVelocity = playerVelocity + (targetRight * -sideSign) * stabilizationFactor * self.pushAwayStrength
 					newRightCos = dot(newVelocity, targetRight)
 					
 					oldSign = sign(rightCos)
@@ -81,113 +223,402 @@ class PathFindingAlgorithm():
 						shouldStickToTargetDirection = True
 						
 				if shouldStickToTargetDirection:
-					self.log('Is sticking velocity to the target direction')
+					if logEnabled:
+						self.log('Is sticking velocity to the target direction')
 				
 					# Find nearest position on track
 					nearestPoint = playerPos + targetRight * distanceToTargetDirectionLine
 					# Find point further along the track 2x player speed
-					nearestPoint += targetFront * self.playerSpeed * 2
+					nearestPoint.addScaled(targetFront, self.playerSpeed * 2)
 					# Get velocity in direction to the track next point
 					followTargetVelocity = nearestPoint - playerPos
 					followTargetVelocity.normalize()
 					
 					playerVelocity = followTargetVelocity
 				
-			# normalize output velocity
-			playerVelocity.normalize()
+			# normalize output velocity, it may still be the stored state of the previous step
+			playerVelocity = playerVelocity.normalized()
 			
 			# filter velocity to match physic steering capabilities
 			playerVelocity = self.filterSteering(oldVelocity, playerVelocity, self.maxSteeringAngle)
 
 			# generate new trajectory point
-			playerPos += playerVelocity * playerSpeed
+			# a new vector, the previous one is stored in the path
+			playerPos = playerPos + playerVelocity * playerSpeed
+
+			if tracer is not None:
+				phaseEnd = timeit.default_timer()
+				tracer.addPhase("steering", phaseEnd - phaseStart)
+				phaseStart = phaseEnd
 
 			# check for constraints violation
 			constraintsViolated = False
 			constraintsChecked = False
 			shouldFilterBackward = False
+			passes = 0
 
 			while not constraintsChecked or constraintsViolated:
-				constraintsViolated = False
+				if passes >= self.maxConstraintPasses:
+					self.failedSteps.append(i + 1)
+					if tracer is not None:
+						tracer.count("resolutionFailures")
+					break
+
+				if constraintsChecked and tracer is not None:
+					tracer.count("suggestionRetries")
 
-				for constraint in self.constraints:
-					if constraint.willViolate(playerPos, playerVelocity):
-						constraintsViolated = True
-						print('Constraint violated - %s! Suggesting a new point' % constraint)
-						suggestion = constraint.suggestPoint(oldPos, oldVelocity, playerPos, playerVelocity)
-						playerPos = suggestion[0]
-						playerVelocity = suggestion[1]
-						shouldFilterBackward = True
+				if self.continuousCollision:
+					playerPos, playerVelocity, constraintsViolated = self.checkConstraintsSwept(oldPos, oldVelocity, playerPos, playerVelocity)
+				else:
+					playerPos, playerVelocity, constraintsViolated = self.checkConstraints(oldPos, oldVelocity, playerPos, playerVelocity)
+				if constraintsViolated:
+					shouldFilterBackward = True
 
 				constraintsChecked = True
+				passes += 1
 
 			# store point info in output
 			self.pathPoints.append(playerPos)
 			playerRotation = velocityToAngle(playerVelocity)
 			self.pathOrientations.append(playerRotation)
 
+			if tracer is not None:
+				phaseEnd = timeit.default_timer()
+				tracer.addPhase("constraints", phaseEnd - phaseStart)
+				phaseStart = phaseEnd
+
 			# apply backward filtering
-			if shouldFilterBackward:
-				for j in xrange(i + 1, 2, -1):
-					print('shouldFilterBackward step %d' % j)
-					pFrom = (self.pathPoints[j], -angleToVelocity(self.pathOrientations[j]))
-					#velocityTo = self.pathPoints[j - 2] - self.pathPoints[j - 1]
-					#velocityTo.normalize()
-					pTo = (self.pathPoints[j - 1], -angleToVelocity(self.pathOrientations[j - 1]))
-					filterResult = self.filterSteeringAlt(pFrom, pTo, self.maxSteeringAngle)
-
-					if filterResult[0]:
-						self.pathPoints[j - 1] = filterResult[1]
-						self.pathOrientations[j - 1] = velocityToAngle(-filterResult[2])
-						if j >= 2:
-							diff = self.pathPoints[j - 1] - self.pathPoints[j - 2]
-							diff.normalize()
-							self.pathOrientations[j - 2] = velocityToAngle(diff)
-						print('filtering occured!')
-					else:
-						break
+			if shouldFilterBackward and self.filteringMode == "backward":
+				self.filterBackward(i + 1, self.backwardFilterWindow)
+
+			if tracer is not None:
+				tracer.addPhase("backwardFiltering", timeit.default_timer() - phaseStart)
+				tracer.count("simulatedSteps")
+
+			if self.convergenceSteps is not None:
+				offset = (playerPos.x - targetPos.x) * targetVelocity.y - (playerPos.y - targetPos.y) * targetVelocity.x
+				if not shouldFilterBackward and abs(offset) <= self.convergenceOffset and dot(playerVelocity, targetFront) >= convergenceCos:
+					convergedSteps += 1
+				else:
+					convergedSteps = 0
+
+			# keep the generator state, the points themselves may still change by backward filtering
+			self.pathStates.append((playerPos, playerVelocity))
+			self.pathContacts.append(shouldFilterBackward)
 
 			oldPos = playerPos	
 			oldVelocity = playerVelocity
-			
-		# Return result path
-		return { "points": self.pathPoints, "rotations": self.pathOrientations }
 
-	def filterSteering(self, currentVelocity, newVelocity, maxSteeringAngle):
-		cos = clamp(dot(currentVelocity, newVelocity), -1, 1)
-		angle = math.acos(cos)
-		
-		if angle > maxSteeringAngle:
-			right = rotate(currentVelocity, 90)
-			side = sign(dot(right, newVelocity))
-			
-			filtered = rotate(currentVelocity, degrees(maxSteeringAngle) * side)
-			return filtered
-			
+			yield i + 1
+			i += 1
+
+		if self.filteringMode == "smooth":
+			if tracer is not None:
+				phaseStart = timeit.default_timer()
+
+			self.smoothPath()
+
+			if tracer is not None:
+				tracer.addPhase("smoothing", timeit.default_timer() - phaseStart)
+
+		self.executionTime = timeit.default_timer() - startTime
+		if tracer is not None:
+			tracer.endCall(self.executionTime, len(self.pathPoints))
+
+	# Turns the points before the contact point at index towards it, at most window points back
+	def filterBackward(self, index, window):
+		tracer = self.tracer
+		lastIndex = 2 if window is None else max(2, index - window)
+		for j in xrange(index, lastIndex, -1):
+			if tracer is not None:
+				tracer.count("backwardFilterSteps")
+
+			pFrom = (self.pathPoints[j], -angleToVelocity(self.pathOrientations[j]))
+			#velocityTo = self.pathPoints[j - 2] - self.pathPoints[j - 1]
+			#velocityTo.normalize()
+			pTo = (self.pathPoints[j - 1], -angleToVelocity(self.pathOrientations[j - 1]))
+			filterResult = self.filterSteeringAlt(pFrom, pTo, self.maxSteeringAngle)
+
+			if filterResult[0]:
+				self.pathPoints[j - 1] = filterResult[1]
+				self.pathOrientations[j - 1] = velocityToAngle(-filterResult[2])
+				if j >= 2:
+					diff = self.pathPoints[j - 1] - self.pathPoints[j - 2]
+					diff.normalize()
+					self.pathOrientations[j - 2] = velocityToAngle(diff)
+			else:
+				break
+
+	# Appends up to count points going straight from position along direction at player speed. Stops before the
+	# first point violating a constraint, with continuousCollision also before a step passing through one.
+	# Returns the number of new points
+	def extendStraight(self, position, direction, count):
+		rotation = velocityToAngle(direction)
+		point = position
+		extendedCount = 0
+
+		while extendedCount < count:
+			previousPoint = point
+			point = point + direction * self.playerSpeed
+			if self.isBlocked(previousPoint, point, direction):
+				return extendedCount
+
+			self.pathPoints.append(point)
+			self.pathOrientations.append(rotation)
+			self.pathStates.append((point, direction))
+			self.pathContacts.append(False)
+			extendedCount += 1
+
+			if self.tracer is not None:
+				self.tracer.count("extendedSteps")
+
+		return extendedCount
+
+	# Every setting changes the path besides pathPointsCount, a reused plan is cut to the current count
+	def getPlanKey(self, targetPosition, targetVelocity):
+		parametersKey = (targetPosition.x, targetPosition.y, targetVelocity.x, targetVelocity.y) + \
+			tuple(getattr(self, name) for name in PLANNER_SETTINGS if name != "pathPointsCount")
+		return (parametersKey, self.getConstraintsKey())
+
+	def getConstraintsKey(self):
+		if self.constraintIndex is not None:
+			version = getattr(self.constraintIndex, 'version', None)
+		else:
+			version = getattr(self.constraints, 'version', None)
+
+		return (id(self.constraints), len(self.constraints), id(self.constraintIndex), version)
+
+	# Incremental mode: keeps the previous plan from the point the player has moved to up to the first step
+	# touched by changed constraints. Returns the number of reused steps, 0 if the path has to be planned from scratch
+	def reusePreviousPlan(self, position, velocity, targetPosition, targetVelocity):
+		previousKey = self.planKey
+		self.planKey = self.getPlanKey(targetPosition, targetVelocity)
+		invalidStep = self.invalidStep
+		self.invalidStep = None
+
+		if previousKey != self.planKey or len(self.pathStates) != len(self.pathPoints) or len(self.pathContacts) != len(self.pathPoints):
+			return 0
+		# the previous plan has to be in the current pathBuffer, or in lists when there is none
+		if self.pathBuffer is not None and self.pathPoints is not self.pathBuffer or \
+			self.pathBuffer is None and not isinstance(self.pathPoints, list):
+			return 0
+
+		rotation = velocityToAngle(velocity)
+		start = None
+		for k in xrange(len(self.pathPoints)):
+			if (self.pathPoints[k] - position).lengthSq() <= self.replanTolerance ** 2 and \
+				abs(angleDifference(self.pathOrientations[k], rotation)) <= self.replanAngleTolerance:
+				start = k
+				break
+
+		if start is None:
+			return 0
+
+		end = len(self.pathPoints) if invalidStep is None else invalidStep
+		end = min(end, start + self.pathPointsCount + 1)
+		if end - start < 2:
+			return 0
+
+		# cut in place, the points may live in the pathBuffer
+		for pathList in (self.pathPoints, self.pathOrientations, self.pathStates, self.pathContacts):
+			del pathList[end:]
+			del pathList[:start]
+		self.failedSteps = [k - start for k in self.failedSteps if start < k < end]
+		self.pathStates[0] = (position, velocity)
+		self.pathPoints[0] = position
+		self.pathOrientations[0] = rotation
+
+		return end - start - 1
+
+	# Rebuilds pathPoints/pathOrientations from the generator states in one backward and one forward pass.
+	# The backward pass keeps every contact point in place and turns the steps before it towards it, like
+	# backward filtering does, but reaches at most smoothingWindow steps back. The forward pass then clamps
+	# the turns still over the limit, moving the rest of the path with them. Every point either pass moved is
+	# tested against the constraints again, a blocked one goes back to the planned point and up to smoothingWindow
+	# steps before it are backward filtered instead, checked the same way. The cost is linear in the path length
+	def smoothPath(self):
+		states = self.pathStates
+		contacts = self.pathContacts
+		count = len(states)
+		turnLimit = self.getTurnLimit(self.maxSteeringAngle)
+		points = [position for position, velocity in states]
+		headings = [velocity for position, velocity in states]
+
+		reach = 0
+		for k in xrange(count - 1, 2, -1):
+			if contacts[k]:
+				reach = self.smoothingWindow
+			if reach == 0:
+				continue
+
+			reach -= 1
+			if not turnLimit.exceeds(headings[k], headings[k - 1]):
+				reach = 0
+				continue
+
+			headings[k - 1] = turnLimit.limited(headings[k], headings[k - 1])
+			points[k - 2] = points[k - 1] - headings[k - 1] * (states[k - 1][0] - states[k - 2][0]).length()
+
+			# the step leading to the moved point joins it with the rest of the path
+			joinStep = points[k - 2] - points[k - 3]
+			if joinStep.lengthSq() > 0:
+				joinStep.normalize()
+				headings[k - 2] = joinStep
+
+		shifted = False
+		for k in xrange(1, count):
+			if turnLimit.exceeds(headings[k - 1], headings[k]):
+				headings[k] = turnLimit.limited(headings[k - 1], headings[k])
+				point = self.pathPoints[k - 1] + headings[k] * (points[k] - points[k - 1]).length()
+				shifted = True
+			elif shifted:
+				point = self.pathPoints[k - 1] + (points[k] - points[k - 1])
+			else:
+				point = points[k]
+
+			# points of the states were checked while planning, moved ones weren't
+			if point is not states[k][0] and self.isBlocked(self.pathPoints[k - 1], point, headings[k]):
+				point, headings[k] = states[k]
+				shifted = False
+				self.pathPoints[k] = point
+				self.pathOrientations[k] = velocityToAngle(headings[k])
+				self.filterBackward(k, self.smoothingWindow)
+
+				for j in xrange(max(1, k - self.smoothingWindow), k):
+					if self.isBlocked(self.pathPoints[j - 1], self.pathPoints[j], angleToVelocity(self.pathOrientations[j])):
+						self.pathPoints[j] = states[j][0]
+						self.pathOrientations[j] = velocityToAngle(states[j][1])
+				continue
+
+			self.pathPoints[k] = point
+			self.pathOrientations[k] = velocityToAngle(headings[k])
+
+		if self.tracer is not None:
+			self.tracer.count("smoothingSteps", count)
+
+	# Whether the point reached from previousPoint violates a constraint, or with continuousCollision
+	# the step to it passes through one
+	def isBlocked(self, previousPoint, point, direction):
+		if self.constraintIndex is None:
+			candidates = self.constraints
 		else:
-			return newVelocity
+			candidates = self.constraintIndex.query(previousPoint, point)
+
+		if self.tracer is not None:
+			self.tracer.count("constraintTests", len(candidates))
+
+		for constraint in candidates:
+			if constraint.willViolate(point, direction):
+				return True
+			if self.continuousCollision and constraint.timeOfImpact(previousPoint, point) is not None:
+				return True
+
+		return False
+
+	# Tells the incremental mode that constraints were added, removed or moved,
+	# the steps of the previous plan passing their bounds get recomputed on the next getPath
+	def constraintsChanged(self, changedConstraints):
+		for constraint in changedConstraints:
+			self.invalidateRegion(constraint.getBounds())
+
+		# the change is accounted for, don't drop the whole plan because the constraints list differs now
+		if self.planKey is not None:
+			self.planKey = (self.planKey[0], self.getConstraintsKey())
+
+	def invalidateRegion(self, bounds):
+		for i in xrange(1, len(self.pathStates)):
+			if bounds is None or segmentOverlapsBounds(self.pathStates[i - 1][0], self.pathStates[i][0], bounds) or \
+				segmentOverlapsBounds(self.pathPoints[i - 1], self.pathPoints[i], bounds):
+				if self.invalidStep is None or i < self.invalidStep:
+					self.invalidStep = i
+				return
+
+	# Runs one pass over the constraints, applying suggestions of the violated ones in order.
+	# With a constraint index only the constraints near the step segment are tested
+	def checkConstraints(self, oldPos, oldVelocity, playerPos, playerVelocity):
+		constraintsViolated = False
+
+		if self.constraintIndex is None:
+			candidates = self.constraints
+		else:
+			candidates = self.constraintIndex.query(oldPos, playerPos)
+
+		tests = 0
+		k = 0
+		while k < len(candidates):
+			constraint = candidates[k]
+			k += 1
+			tests += 1
+
+			if constraint.willViolate(playerPos, playerVelocity):
+				constraintsViolated = True
+				if self.tracer is not None:
+					self.tracer.count("violations")
+				if self.logEnabled:
+					self.log('Constraint violated - %s! Suggesting a new point' % constraint)
+
+				suggestion = constraint.suggestPoint(oldPos, oldVelocity, playerPos, playerVelocity, self.tangentSide)
+				playerPos = suggestion[0]
+				playerVelocity = suggestion[1]
+
+				# the point has moved, look up the rest of the constraints around the new step
+				if self.constraintIndex is not None:
+					candidates = self.constraintIndex.query(oldPos, playerPos, constraint)
+					k = 0
+
+		if self.tracer is not None:
+			self.tracer.count("constraintTests", tests)
+
+		return (playerPos, playerVelocity, constraintsViolated)
+
+	# Resolves the violated constraint hit first along the step. A single suggestion per call,
+	# the caller repeats until the step is clear
+	def checkConstraintsSwept(self, oldPos, oldVelocity, playerPos, playerVelocity):
+		if self.constraintIndex is None:
+			candidates = self.constraints
+		else:
+			candidates = self.constraintIndex.query(oldPos, playerPos)
+
+		firstTime = None
+		firstConstraint = None
+		for constraint in candidates:
+			time = constraint.timeOfImpact(oldPos, playerPos)
+			if time is not None and (firstTime is None or time < firstTime):
+				firstTime = time
+				firstConstraint = constraint
+
+		if self.tracer is not None:
+			self.tracer.count("constraintTests", len(candidates))
+
+		if firstConstraint is None:
+			return (playerPos, playerVelocity, False)
+
+		if self.tracer is not None:
+			self.tracer.count("violations")
+		if self.logEnabled:
+			self.log('Constraint hit at %1.3f of the step - %s! Suggesting a new point' % (firstTime, firstConstraint))
+
+		playerPos, playerVelocity = firstConstraint.suggestPoint(oldPos, oldVelocity, playerPos, playerVelocity, self.tangentSide)
+		return (playerPos, playerVelocity, True)
+
+	def getTurnLimit(self, maxSteeringAngle):
+		if self.turnLimit is None or self.turnLimit.maxAngle != maxSteeringAngle:
+			self.turnLimit = TurnLimit(maxSteeringAngle, steeringAngleTolerance)
+
+		return self.turnLimit
+
+	def filterSteering(self, currentVelocity, newVelocity, maxSteeringAngle):
+		return self.getTurnLimit(maxSteeringAngle).clamp(currentVelocity, newVelocity)
 
 	# Returns tuple, where the first element is the result, if the points were modified
 	# If they were modified - new point is stored in tuple 2nd and 3rd positions
 	def filterSteeringAlt(self, pointSrc, pointDest, maxSteeringAngle):
 		srcVelocity = pointSrc[1]
 		destVelocity = pointDest[1]
-		posDelta = pointDest[0] - pointSrc[0]
-		posDelta.normalize()
-		#print('posDelta: %s' % posDelta)
-		print('srcVelocity: %s' % srcVelocity)
-		print('destVelocity: %s' % destVelocity)
-
-		cos = clamp(dot(srcVelocity, destVelocity), -1, 1)
-		angle = math.acos(cos)
+		turnLimit = self.getTurnLimit(maxSteeringAngle)
 		
-		print('angle: %1.3f' % angle)
-		if angle > maxSteeringAngle:
-			right = rotate(srcVelocity, 90)
-			side = sign(dot(right, destVelocity))
-			
-			filtered = rotate(srcVelocity, degrees(maxSteeringAngle) * side)
-			print('filtered: %s' % filtered)
+		if turnLimit.exceeds(srcVelocity, destVelocity):
+			filtered = turnLimit.limited(srcVelocity, destVelocity)
 			newPos = pointSrc[0] + filtered * self.playerSpeed
 			return (True, newPos, filtered)
 		else:
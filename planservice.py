@@ -0,0 +1,297 @@
+import argparse
+import json
+import multiprocessing
+import Queue
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import headless
+
+# ==================================
+
+# Line based local planning service. Every request line is a condition.json object, optionally with
+# "id", echoed back in the result, and "deadline", seconds after the line was read. Every request gets
+# exactly one result line: the path data of scenario.pathToData or { "error": ... }, both with the id.
+# Results of one connection come back in completion order, callers match them by id.
+# { "metrics": true } returns the service counters instead of planning
+
+# ==================================
+
+class Connection(object):
+	def __init__(self, stream):
+		self.stream = stream
+		self.lock = threading.Lock()
+		self.pending = 0
+		self.done = threading.Condition(self.lock)
+
+	def expect(self):
+		with self.lock:
+			self.pending += 1
+
+	def send(self, data):
+		with self.lock:
+			try:
+				self.stream.write(json.dumps(data))
+				self.stream.write('\n')
+				self.stream.flush()
+			except (IOError, socket.error):
+				# the caller is gone, nobody is left to read the result
+				pass
+
+	def reply(self, data):
+		self.send(data)
+		with self.lock:
+			self.pending -= 1
+			self.done.notify_all()
+
+	def waitPending(self):
+		with self.lock:
+			while self.pending > 0:
+				self.done.wait()
+
+class PlanRequest(object):
+	def __init__(self, connection, requestId, line, deadline):
+		self.connection = connection
+		self.requestId = requestId
+		self.line = line
+		self.deadline = deadline
+
+	def reply(self, data):
+		if self.requestId is not None:
+			data["id"] = self.requestId
+		self.connection.reply(data)
+
+	def fail(self, message):
+		self.reply({ "error": message })
+
+# ==================================
+
+# Collects requests into batches of up to batchSize, waiting at most batchLatency seconds after the first
+# request of a batch, and plans every batch on a pool of headless workers.
+# Backpressure: at most maxPendingBatches batches are planned at once, then the batcher stops taking requests,
+# the queue fills up to maxQueueDepth and connections stop reading until there is room or their request expires.
+# Requests past their deadline are answered with an error instead of being planned
+class PlanService(object):
+	def __init__(self, obstaclesPath, workers=None, batchSize=32, batchLatency=0.005, maxQueueDepth=1024,
+		maxPendingBatches=None, defaultDeadline=1.0, compiled=False, distanceFieldResolution=None):
+		workers = workers or multiprocessing.cpu_count()
+		self.batchSize = batchSize
+		self.batchLatency = batchLatency
+		self.defaultDeadline = defaultDeadline
+		self.queue = Queue.Queue(maxQueueDepth)
+		self.pendingBatches = threading.Semaphore(maxPendingBatches or workers * 2)
+
+		self.metricsLock = threading.Lock()
+		self.metrics = {
+			"requests": 0,
+			"planned": 0,
+			"expired": 0,
+			"rejected": 0,
+			"batches": 0,
+			"batchesInFlight": 0,
+			"peakQueueDepth": 0,
+		}
+
+		# the pool forks before any service thread exists
+		headless.prepareObstacles(obstaclesPath, compiled, distanceFieldResolution)
+		self.pool = multiprocessing.Pool(workers, initializer=headless.initWorker, initargs=(obstaclesPath, compiled, distanceFieldResolution))
+
+		self.batcher = threading.Thread(target=self.batchLoop)
+		self.batcher.daemon = True
+		self.batcher.start()
+
+	def close(self):
+		self.queue.put(None)
+		self.batcher.join()
+		self.pool.close()
+		self.pool.join()
+
+	def count(self, name, value=1):
+		with self.metricsLock:
+			self.metrics[name] += value
+
+	def getMetrics(self):
+		with self.metricsLock:
+			result = dict(self.metrics)
+
+		result["queueDepth"] = self.queue.qsize()
+		result["meanBatchSize"] = float(result["planned"]) / result["batches"] if result["batches"] else 0.0
+		return result
+
+	# Queues one request line of a connection, blocks while the queue is full
+	def submit(self, connection, line):
+		connection.expect()
+		try:
+			data = json.loads(line)
+		except ValueError as e:
+			connection.reply({ "error": "ValueError: %s" % e })
+			return
+
+		if not isinstance(data, dict):
+			connection.reply({ "error": "a request is a JSON object" })
+			return
+
+		request = PlanRequest(connection, data.get("id"), line, None)
+		deadline = data.get("deadline", self.defaultDeadline)
+		if isinstance(deadline, bool) or not isinstance(deadline, (int, long, float)):
+			request.fail("deadline must be a number of seconds")
+			return
+
+		request.deadline = time.time() + deadline
+		if data.get("metrics"):
+			request.reply(self.getMetrics())
+			return
+
+		self.count("requests")
+
+		try:
+			self.queue.put(request, timeout=max(request.deadline - time.time(), 0.0))
+		except Queue.Full:
+			self.count("rejected")
+			request.fail("queue full")
+			return
+
+		depth = self.queue.qsize()
+		with self.metricsLock:
+			self.metrics["peakQueueDepth"] = max(self.metrics["peakQueueDepth"], depth)
+
+	def batchLoop(self):
+		while True:
+			request = self.queue.get()
+			if request is None:
+				return
+
+			batch = [request]
+			batchDeadline = time.time() + self.batchLatency
+			stopping = False
+
+			while len(batch) < self.batchSize:
+				remaining = batchDeadline - time.time()
+				if remaining <= 0:
+					break
+
+				try:
+					request = self.queue.get(timeout=remaining)
+				except Queue.Empty:
+					break
+
+				if request is None:
+					stopping = True
+					break
+				batch.append(request)
+
+			self.dispatch(batch)
+			if stopping:
+				return
+
+	# Answers the expired requests of a batch and returns the others
+	def dropExpired(self, batch):
+		now = time.time()
+		live = []
+		for request in batch:
+			if request.deadline < now:
+				self.count("expired")
+				request.fail("deadline exceeded")
+			else:
+				live.append(request)
+
+		return live
+
+	def dispatch(self, batch):
+		live = self.dropExpired(batch)
+		if not live:
+			return
+
+		# waiting for a free batch slot may take longer than the deadlines left
+		self.pendingBatches.acquire()
+		live = self.dropExpired(live)
+		if not live:
+			self.pendingBatches.release()
+			return
+
+		self.count("batches")
+		self.count("batchesInFlight")
+		self.pool.apply_async(headless.planChunk, ([request.line for request in live],),
+			callback=lambda results: self.finishBatch(live, results))
+
+	# Runs on the pool's result thread
+	def finishBatch(self, batch, results):
+		self.pendingBatches.release()
+		self.count("batchesInFlight", -1)
+		self.count("planned", len(batch))
+
+		for request, result in zip(batch, results):
+			request.reply(json.loads(result))
+
+# ==================================
+
+class PlanRequestHandler(SocketServer.StreamRequestHandler):
+	def handle(self):
+		connection = Connection(self.wfile)
+
+		while True:
+			line = self.rfile.readline()
+			if not line:
+				break
+			if line.strip():
+				self.server.service.submit(connection, line)
+
+		# the stream closes when handle returns, answer everything read so far first
+		connection.waitPending()
+
+class PlanTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+class PlanUnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	daemon_threads = True
+
+def createServer(service, port=None, unixPath=None):
+	if unixPath is not None:
+		server = PlanUnixServer(unixPath, PlanRequestHandler)
+	else:
+		server = PlanTCPServer(('127.0.0.1', port or 0), PlanRequestHandler)
+
+	server.service = service
+	return server
+
+# ==================================
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Serves condition.json plan requests, one JSON object per line, on a local socket.')
+	parser.add_argument('obstacles', help='obstacles JSON file loaded once per worker, or an obstaclestore file')
+	parser.add_argument('--port', type=int, default=7878, help='loopback TCP port')
+	parser.add_argument('--unix', default=None, metavar='PATH', help='listen on a Unix socket instead of TCP')
+	parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes, CPU count by default')
+	parser.add_argument('--batch-size', type=int, default=32, help='most requests planned in one batch')
+	parser.add_argument('--batch-latency', type=float, default=0.005, help='seconds a batch waits to fill up')
+	parser.add_argument('--max-queue', type=int, default=1024, help='queued requests before connections stop being read')
+	parser.add_argument('--max-pending', type=int, default=None, help='batches in flight, 2 per worker by default')
+	parser.add_argument('--deadline', type=float, default=1.0, help='seconds a request may wait without its own deadline')
+	parser.add_argument('--compiled', action='store_true', help='merge obstacles and cache them next to the obstacles file')
+	parser.add_argument('--distance-field', type=float, default=None, metavar='RESOLUTION',
+		help='check obstacles against a distance field of this cell size, cached next to the obstacles file')
+	args = parser.parse_args(argv)
+
+	service = PlanService(args.obstacles, args.workers, args.batch_size, args.batch_latency, args.max_queue,
+		args.max_pending, args.deadline, args.compiled, args.distance_field)
+	server = createServer(service, args.port, args.unix)
+
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		service.close()
+
+	return 0
+
+# ==================================
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
+
+# ==================================
@@ -0,0 +1,44 @@
+import json
+import constraints
+from smath import vec2f
+
+# ==================================
+
+def loadConstraints(obstaclesData):
+	factory = constraints.ConstraintFactory()
+	return constraints.ConstraintList(factory.fromShapeDef(shapeDef) for shapeDef in obstaclesData['data'])
+
+def loadConstraintsFile(path):
+	with open(path) as f:
+		return loadConstraints(json.load(f))
+
+# Converts condition.json data into getPath arguments, the same way the viewer sets up its players
+def parseCondition(conditionData):
+	playerData = conditionData['player']
+	targetData = conditionData['target']
+
+	velocity = vec2f(playerData['direction']['x'], playerData['direction']['y'])
+	velocity.normalize()
+	targetVelocity = vec2f(targetData['direction']['x'], targetData['direction']['y'])
+	targetVelocity.normalize()
+
+	return {
+		"position": vec2f(playerData['position']['x'], playerData['position']['y']),
+		"velocity": velocity,
+		"targetPosition": vec2f(targetData['position']['x'], targetData['position']['y']),
+		"targetVelocity": targetVelocity,
+		"speed": playerData['speed'],
+	}
+
+def planCondition(pathfinder, condition):
+	pathfinder.playerSpeed = condition['speed']
+	return pathfinder.getPath(condition['position'], condition['velocity'], condition['targetPosition'], condition['targetVelocity'])
+
+def pathToData(path):
+	return {
+		"points": [[point.x, point.y] for point in path['points']],
+		"rotations": list(path['rotations']),
+		"failedSteps": list(path['failedSteps']),
+	}
+
+# ==================================
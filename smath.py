@@ -13,10 +13,28 @@ def degrees(rad):
 		
 def rotate(v, deg):
 	radAngle = radians(deg)
-	result = vec2f()
-	result.x = v.x * math.cos(radAngle) - v.y * math.sin(radAngle)
-	result.y = v.x * math.sin(radAngle) + v.y * math.cos(radAngle)
-	return result
+	cos = math.cos(radAngle)
+	sin = math.sin(radAngle)
+	return vec2f(v.x * cos - v.y * sin, v.x * sin + v.y * cos)
+	
+# Radian native helpers: rotations are precomputed (cos, sin) pairs, so applying one needs no trigonometry
+
+def cross(a, b):
+	return a.x * b.y - a.y * b.x
+
+# Same as rotate(v, 90) without the rounding of cos(90)
+def perpendicular(v):
+	return vec2f(-v.y, v.x)
+
+def rotation(rad):
+	return (math.cos(rad), math.sin(rad))
+
+def rotateBy(v, rotation):
+	cos, sin = rotation
+	return vec2f(v.x * cos - v.y * sin, v.x * sin + v.y * cos)
+
+def inverseRotation(rotation):
+	return (rotation[0], -rotation[1])
 	
 def velocityToAngle(v):
 	return math.atan2(v.y, v.x) * 180.0 / math.pi
@@ -31,6 +49,15 @@ def equals(a, b):
 def lerp(a, b, t):
 	return (1 - t) * a + t * b
 	
+# Signed difference of two angles in degrees, wrapped to [-180; 180)
+def angleDifference(a, b):
+	return (a - b + 180.0) % 360.0 - 180.0
+
+# Tests the bounding box of the segment a-b against the (minX, minY, maxX, maxY) box
+def segmentOverlapsBounds(a, b, bounds):
+	return min(a.x, b.x) <= bounds[2] and max(a.x, b.x) >= bounds[0] and \
+		min(a.y, b.y) <= bounds[3] and max(a.y, b.y) >= bounds[1]
+	
 def sign(a):
 	return -1 if a < 0 else 1
 	
@@ -44,44 +71,100 @@ def clamp(a, min, max):
 	
 # ==================================
 
+# Limits the turn between two unit directions to maxAngle radians by comparing the dot product
+# with a precomputed cosine, turns that are too sharp are replaced with a precomputed rotation
+class TurnLimit(object):
+	def __init__(self, maxAngle, tolerance=0.0):
+		self.maxAngle = maxAngle
+		self.tolerance = tolerance
+		self.minCos = math.cos(min(maxAngle + tolerance, math.pi))
+		self.left = rotation(maxAngle)
+		self.right = inverseRotation(self.left)
+
+	def exceeds(self, current, desired):
+		return dot(current, desired) < self.minCos
+
+	# Rotation by maxAngle from current towards the side of desired
+	def limited(self, current, desired):
+		return rotateBy(current, self.left if cross(current, desired) >= 0 else self.right)
+
+	def clamp(self, current, desired):
+		if dot(current, desired) < self.minCos:
+			return self.limited(current, desired)
+
+		return desired
+
+ROTATION_45 = rotation(math.pi / 4)
+	
+# ==================================
+
+# Slotted: no per instance __dict__, which makes vectors smaller and quicker to create.
+# The in-place operators change the vector itself, only use them on vectors nothing else holds
 class vec2f(object):
+	__slots__ = ('x', 'y')
+
 	def __init__(self, x=0.0, y=0.0):
-		super(vec2f, self).__init__()
 		self.x = x
 		self.y = y
+
+	def set(self, x, y):
+		self.x = x
+		self.y = y
+		return self
 		
 	def normalize(self):
 		length = self.length()
 		invLength = 1 / length
 		self.x *= invLength
 		self.y *= invLength
+
+	# Normalized copy, leaves the vector itself untouched
+	def normalized(self):
+		invLength = 1 / self.length()
+		return vec2f(self.x * invLength, self.y * invLength)
 		
 	def length(self):
-		return math.sqrt(self.lengthSq())
+		return math.sqrt(self.x * self.x + self.y * self.y)
 	
 	def lengthSq(self):
 		return self.x * self.x + self.y * self.y
 		
 	def __add__(self, other):
-		result = vec2f()
-		result.x = self.x + other.x
-		result.y = self.y + other.y
-		return result
+		return vec2f(self.x + other.x, self.y + other.y)
 		
 	def __sub__(self, other):
-		result = vec2f()
-		result.x = self.x - other.x
-		result.y = self.y - other.y
-		return result
+		return vec2f(self.x - other.x, self.y - other.y)
 		
 	def __mul__(self, other):
-		result = vec2f()
-		result.x = self.x * other
-		result.y = self.y * other
-		return result
+		return vec2f(self.x * other, self.y * other)
+
+	def __iadd__(self, other):
+		self.x += other.x
+		self.y += other.y
+		return self
+
+	def __isub__(self, other):
+		self.x -= other.x
+		self.y -= other.y
+		return self
+
+	def __imul__(self, other):
+		self.x *= other
+		self.y *= other
+		return self
+
+	# self += other * scale without the temporary vector
+	def addScaled(self, other, scale):
+		self.x += other.x * scale
+		self.y += other.y * scale
+		return self
 
 	def __neg__(self):
 		return vec2f(-self.x, -self.y)
+
+	# slotted classes have no __dict__ to pickle
+	def __reduce__(self):
+		return (vec2f, (self.x, self.y))
 		
 	def __str__(self):
 		return ("vec2f(%1.3f; %1.3f)") % (self.x, self.y)
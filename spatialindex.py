@@ -0,0 +1,168 @@
+import math
+
+# ==================================
+
+# Uniform grid broad-phase over constraints. Every constraint is registered in all cells its
+# violation bounds overlap; constraints without bounds are returned by every query.
+# Queries return constraints in insertion order, so checks stay in the order of the source list.
+# A frozen grid rejects changes and keeps no statistics, so any number of threads may query it
+class ConstraintGrid(object):
+	def __init__(self, cellSize=128.0):
+		self.cellSize = float(cellSize)
+		self.invCellSize = 1.0 / self.cellSize
+		self.cells = {}
+		self.entries = {}
+		self.unbounded = {}
+		self.nextOrder = 0
+		# bumped on every change, lets caches built on top of the index notice edits
+		self.version = 0
+		self.frozen = False
+		self.resetStats()
+
+	@staticmethod
+	def fromConstraints(constraints, cellSize=128.0):
+		grid = ConstraintGrid(cellSize)
+		for constraint in constraints:
+			grid.insert(constraint)
+
+		return grid
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __contains__(self, constraint):
+		return self.keyOf(constraint) in self.entries
+
+	def constraints(self):
+		entries = sorted(self.entries.values(), key=lambda entry: entry[0])
+		return [self.resolve(entry[1]) for entry in entries]
+
+	# Entry key of a constraint and the constraint of a stored entry value, subclasses may store placeholders
+	def keyOf(self, constraint):
+		return id(constraint)
+
+	def resolve(self, value):
+		return value
+
+	def cellRange(self, minX, minY, maxX, maxY):
+		return (int(math.floor(minX * self.invCellSize)), int(math.floor(minY * self.invCellSize)),
+			int(math.floor(maxX * self.invCellSize)), int(math.floor(maxY * self.invCellSize)))
+
+	def insert(self, constraint, order=None):
+		key = self.keyOf(constraint)
+		if key in self.entries:
+			self.remove(constraint)
+
+		if order is None:
+			order = self.nextOrder
+			self.nextOrder += 1
+
+		self.addEntry(key, order, constraint, constraint.getBounds())
+
+	def freeze(self):
+		self.frozen = True
+
+	# Marks a change the grid can't see itself, like an edit of a distance field registered in it
+	def changed(self):
+		if self.frozen:
+			raise RuntimeError('frozen constraint grid can not be changed')
+
+		self.version += 1
+
+	def addEntry(self, key, order, value, bounds):
+		if self.frozen:
+			raise RuntimeError('frozen constraint grid can not be changed')
+
+		entry = (order, value, bounds)
+		self.entries[key] = entry
+		self.version += 1
+
+		if entry[2] is None:
+			self.unbounded[key] = entry
+			return
+
+		x0, y0, x1, y1 = self.cellRange(*entry[2])
+		for x in xrange(x0, x1 + 1):
+			for y in xrange(y0, y1 + 1):
+				self.cells.setdefault((x, y), {})[key] = entry
+
+	def remove(self, constraint):
+		if self.frozen:
+			raise RuntimeError('frozen constraint grid can not be changed')
+
+		key = self.keyOf(constraint)
+		entry = self.entries.pop(key, None)
+		if entry is None:
+			return False
+
+		self.version += 1
+
+		if entry[2] is None:
+			del self.unbounded[key]
+			return True
+
+		x0, y0, x1, y1 = self.cellRange(*entry[2])
+		for x in xrange(x0, x1 + 1):
+			for y in xrange(y0, y1 + 1):
+				cell = self.cells[(x, y)]
+				del cell[key]
+				if not cell:
+					del self.cells[(x, y)]
+
+		return True
+
+	# Re-registers a constraint after its shape has changed, keeping its place in the check order
+	def update(self, constraint):
+		entry = self.entries.get(self.keyOf(constraint))
+		order = entry[0] if entry is not None else None
+		self.insert(constraint, order)
+
+	def orderOf(self, constraint):
+		return self.entries[self.keyOf(constraint)][0]
+
+	# Adds the entries of a cell placed after minOrder to found, by key
+	def collectCell(self, x, y, minOrder, found):
+		cell = self.cells.get((x, y))
+		if cell:
+			for key, entry in cell.iteritems():
+				if entry[0] > minOrder:
+					found[key] = entry
+
+	# Returns constraints whose bounds overlap the bounding box of the segment a-b, optionally
+	# only those placed after the given constraint in the check order
+	def query(self, a, b, after=None):
+		x0, y0, x1, y1 = self.cellRange(min(a.x, b.x), min(a.y, b.y), max(a.x, b.x), max(a.y, b.y))
+		minOrder = -1 if after is None else self.orderOf(after)
+
+		found = {}
+		for key, entry in self.unbounded.iteritems():
+			if entry[0] > minOrder:
+				found[key] = entry
+
+		cellsVisited = 0
+		for x in xrange(x0, x1 + 1):
+			for y in xrange(y0, y1 + 1):
+				cellsVisited += 1
+				self.collectCell(x, y, minOrder, found)
+
+		result = [self.resolve(entry[1]) for entry in sorted(found.values(), key=lambda entry: entry[0])]
+
+		if not self.frozen:
+			self.stats['queries'] += 1
+			self.stats['cellsVisited'] += cellsVisited
+			self.stats['candidates'] += len(result)
+		return result
+
+	def resetStats(self):
+		self.stats = { 'queries': 0, 'cellsVisited': 0, 'candidates': 0 }
+
+	def getStats(self):
+		stats = dict(self.stats)
+		stats['constraints'] = len(self)
+		stats['cells'] = len(self.cells)
+		queries = max(stats['queries'], 1)
+		stats['candidatesPerQuery'] = stats['candidates'] / float(queries)
+		stats['cellsPerQuery'] = stats['cellsVisited'] / float(queries)
+		return stats
+
+# ==================================
@@ -0,0 +1,248 @@
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import anytimeplanner
+import benchmark
+import headless
+import scenario
+from smath import radians
+
+# ==================================
+
+# Planner settings a sweep may vary. maxSteeringAngle is given in degrees, playerSpeed replaces the speed of the scenarios
+SWEEP_PARAMETERS = ("attractionDistance", "pushAwayTreshold", "maxSteeringAngle", "playerSpeed", "pathPointsCount",
+	"pushAwayStrength", "convergenceSteps")
+INTEGER_PARAMETERS = ("pathPointsCount", "convergenceSteps")
+
+# Cached results stay valid while these sources are unchanged
+PLANNER_SOURCES = ("pathfinder.py", "constraints.py", "smath.py", "spatialindex.py", "scenario.py", "anytimeplanner.py",
+	"headless.py", "obstaclecompiler.py", "obstaclestore.py", "distancefield.py")
+
+def parseGrid(text):
+	name, separator, values = text.partition('=')
+	if not separator or name not in SWEEP_PARAMETERS:
+		raise argparse.ArgumentTypeError('expected NAME=V1,V2,... with NAME one of %s' % ', '.join(SWEEP_PARAMETERS))
+
+	itemType = int if name in INTEGER_PARAMETERS else float
+	return (name, benchmark.parseList(values, itemType))
+
+def fileDigest(path):
+	with open(path, 'rb') as f:
+		return hashlib.sha1(f.read()).hexdigest()
+
+def getPlannerDigest():
+	directory = os.path.dirname(os.path.abspath(__file__))
+	digest = hashlib.sha1()
+	for name in PLANNER_SOURCES:
+		with open(os.path.join(directory, name), 'rb') as f:
+			digest.update(f.read())
+
+	return digest.hexdigest()
+
+# ==================================
+
+# Runs in a pool worker set up by headless.initWorker, plans a chunk of scenario lines with one parameter set
+# and returns (key, metrics) pairs
+def planCell(items, parameters):
+	pathfinder = headless.worker.pathfinder
+	for name, value in parameters:
+		if name == "maxSteeringAngle":
+			value = radians(value)
+		if name != "playerSpeed":
+			setattr(pathfinder, name, value)
+
+	speed = dict(parameters).get("playerSpeed")
+	results = []
+	for key, line in items:
+		try:
+			condition = scenario.parseCondition(json.loads(line))
+			if speed is not None:
+				condition['speed'] = speed
+
+			data = scenario.pathToData(scenario.planCondition(pathfinder, condition))
+			results.append((key, {
+				"time": pathfinder.executionTime,
+				"points": len(data["points"]),
+				"failedSteps": len(data["failedSteps"]),
+				"score": anytimeplanner.scorePath(data, condition['targetPosition'], condition['targetVelocity'], pathfinder.attractionDistance),
+			}))
+		except Exception as e:
+			results.append((key, { "error": "%s: %s" % (type(e).__name__, e) }))
+
+	return results
+
+# ==================================
+
+# Results of earlier runs, one JSON [key, metrics] line each, new results are appended as they arrive
+class ResultCache(object):
+	def __init__(self, path):
+		self.path = path
+		self.results = {}
+
+		if path is not None and os.path.exists(path):
+			with open(path) as f:
+				for line in f:
+					try:
+						key, metrics = json.loads(line)
+					except ValueError:
+						# a line cut short by an interrupted run
+						continue
+					self.results[key] = metrics
+
+		self.stream = open(path, 'a') if path is not None else None
+
+	def __contains__(self, key):
+		return key in self.results
+
+	def get(self, key):
+		return self.results[key]
+
+	def add(self, key, metrics):
+		self.results[key] = metrics
+		if self.stream is not None:
+			self.stream.write(json.dumps([key, metrics]))
+			self.stream.write('\n')
+			self.stream.flush()
+
+	def close(self):
+		if self.stream is not None:
+			self.stream.close()
+
+# A malformed line keys on its text, planCell reports it as the error of its cell
+def getCellKey(baseDigest, line, parameters):
+	digest = hashlib.sha1(baseDigest)
+	try:
+		digest.update(json.dumps(json.loads(line), sort_keys=True).encode('utf-8'))
+	except ValueError:
+		digest.update(line.strip())
+	digest.update(repr(parameters).encode('ascii'))
+	return digest.hexdigest()
+
+# ==================================
+
+# Plans every scenario with every combination of the grids on a process pool, skipping cells found in the cache.
+# grids is a list of (name, values). Returns the summary rows, one per combination
+def runSweep(obstaclesPath, scenarioLines, grids, cachePath=None, workers=None, chunkSize=16, compiled=False):
+	workers = workers or multiprocessing.cpu_count()
+	names = [name for name, values in grids]
+	combinations = [tuple(zip(names, values)) for values in itertools.product(*[values for name, values in grids])]
+	baseDigest = (fileDigest(obstaclesPath) + getPlannerDigest() + repr(compiled)).encode('ascii')
+
+	cache = ResultCache(cachePath)
+	cells = {}
+	pending = []
+	computed = 0
+
+	for parameters in combinations:
+		keys = []
+		missing = []
+		for line in scenarioLines:
+			key = getCellKey(baseDigest, line, parameters)
+			keys.append(key)
+			if key not in cache:
+				missing.append((key, line))
+		cells[parameters] = keys
+
+		for first in xrange(0, len(missing), chunkSize):
+			pending.append((missing[first:first + chunkSize], parameters))
+
+	try:
+		if pending:
+			headless.prepareObstacles(obstaclesPath, compiled)
+			pool = multiprocessing.Pool(workers, initializer=headless.initWorker, initargs=(obstaclesPath, compiled))
+			try:
+				for results in pool.imap_unordered(planCellTask, pending):
+					for key, metrics in results:
+						cache.add(key, metrics)
+						computed += 1
+				pool.close()
+			finally:
+				pool.terminate()
+				pool.join()
+
+		rows = [summarize(parameters, [cache.get(key) for key in cells[parameters]]) for parameters in combinations]
+	finally:
+		cache.close()
+
+	return { "rows": rows, "computed": computed, "cached": len(combinations) * len(scenarioLines) - computed }
+
+def planCellTask(task):
+	return planCell(*task)
+
+def summarize(parameters, metricsList):
+	planned = [metrics for metrics in metricsList if "error" not in metrics]
+	times = sorted(metrics["time"] for metrics in planned)
+	count = max(len(planned), 1)
+
+	row = dict(parameters)
+	row.update({
+		"scenarios": len(metricsList),
+		"errors": len(metricsList) - len(planned),
+		"failedSteps": sum(metrics["failedSteps"] for metrics in planned),
+		"scoreMean": sum(metrics["score"] for metrics in planned) / count,
+		"latencyMean": sum(times) / count,
+		"latencyP99": benchmark.percentile(times, 0.99),
+	})
+	return row
+
+# ==================================
+
+def formatTable(rows, names):
+	columns = names + ["scenarios", "errors", "failedSteps", "scoreMean", "latencyMean", "latencyP99"]
+	cells = [columns]
+	for row in rows:
+		line = []
+		for column in columns:
+			value = row[column]
+			if column in ("latencyMean", "latencyP99"):
+				line.append("%.3fms" % (value * 1000.0))
+			elif isinstance(value, float):
+				line.append("%.4g" % value)
+			else:
+				line.append(str(value))
+		cells.append(line)
+
+	widths = [max(len(line[k]) for line in cells) for k in xrange(len(columns))]
+	return '\n'.join('  '.join(text.rjust(width) for text, width in zip(line, widths)) for line in cells)
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Plans JSONL scenarios with every combination of parameter grids and summarizes the results.')
+	parser.add_argument('obstacles', help='obstacles JSON file loaded once per worker, or an obstaclestore file')
+	parser.add_argument('scenarios', help='JSONL scenarios file, condition.json objects one per line')
+	parser.add_argument('-p', '--param', type=parseGrid, action='append', default=[], metavar='NAME=V1,V2',
+		help='values of one parameter, repeat for more: %s' % ', '.join(SWEEP_PARAMETERS))
+	parser.add_argument('--cache', default=None, help='results cache file, obstacles file + .sweep.jsonl by default')
+	parser.add_argument('--no-cache', action='store_true', help='plan every cell again and keep nothing')
+	parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes, CPU count by default')
+	parser.add_argument('--chunk-size', type=int, default=16, help='scenarios sent to a worker at once')
+	parser.add_argument('--compiled', action='store_true', help='merge obstacles and cache them next to the obstacles file')
+	parser.add_argument('--sort', default='scoreMean', help='summary column to sort the table by')
+	parser.add_argument('--json', action='store_true', help='print the summary as JSON instead of a table')
+	args = parser.parse_args(argv)
+
+	with open(args.scenarios) as f:
+		scenarioLines = [line for line in f if line.strip()]
+
+	cachePath = None if args.no_cache else (args.cache or args.obstacles + '.sweep.jsonl')
+	result = runSweep(args.obstacles, scenarioLines, args.param, cachePath, args.workers, args.chunk_size, args.compiled)
+	result["rows"].sort(key=lambda row: row[args.sort])
+
+	if args.json:
+		json.dump(result, sys.stdout, indent=4, sort_keys=True)
+		sys.stdout.write('\n')
+	else:
+		sys.stdout.write(formatTable(result["rows"], [name for name, values in args.param]))
+		sys.stdout.write('\n%d cells planned, %d from the cache\n' % (result["computed"], result["cached"]))
+
+	return 0
+
+# ==================================
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
+
+# ==================================
@@ -0,0 +1,98 @@
+import json
+
+# ==================================
+
+# Collects per call counters and phase durations of PathFindingAlgorithm.getPath.
+# The planner only talks to a tracer when one is attached, so an unset tracer costs nothing
+class Tracer(object):
+	COUNTERS = ("constraintTests", "violations", "suggestionRetries", "backwardFilterSteps", "reusedSteps",
+		"simulatedSteps", "extendedSteps", "smoothingSteps", "resolutionFailures")
+	PHASES = ("steering", "constraints", "backwardFiltering", "smoothing")
+
+	def __init__(self, *sinks):
+		self.sinks = list(sinks)
+		self.counters = {}
+		self.phases = {}
+		self.lastRecord = None
+
+	def addSink(self, sink):
+		self.sinks.append(sink)
+
+	def removeSink(self, sink):
+		self.sinks.remove(sink)
+
+	def beginCall(self):
+		self.counters = dict.fromkeys(self.COUNTERS, 0)
+		self.phases = dict.fromkeys(self.PHASES, 0.0)
+
+	def count(self, name, amount=1):
+		self.counters[name] = self.counters.get(name, 0) + amount
+
+	def addPhase(self, name, duration):
+		self.phases[name] = self.phases.get(name, 0.0) + duration
+
+	def endCall(self, executionTime, pointsCount):
+		self.lastRecord = {
+			"executionTime": executionTime,
+			"points": pointsCount,
+			"counters": self.counters,
+			"phases": self.phases,
+		}
+
+		for sink in self.sinks:
+			sink.write(self.lastRecord)
+
+# ==================================
+
+class MemorySink(object):
+	def __init__(self):
+		self.records = []
+
+	def write(self, record):
+		self.records.append(record)
+
+	def clear(self):
+		self.records = []
+
+	# Sums counters, phases and execution time over all the recorded calls
+	def summary(self):
+		counters = {}
+		phases = {}
+		executionTime = 0.0
+		pointsCount = 0
+
+		for record in self.records:
+			executionTime += record["executionTime"]
+			pointsCount += record["points"]
+			for name, value in record["counters"].iteritems():
+				counters[name] = counters.get(name, 0) + value
+			for name, value in record["phases"].iteritems():
+				phases[name] = phases.get(name, 0.0) + value
+
+		return {
+			"calls": len(self.records),
+			"executionTime": executionTime,
+			"points": pointsCount,
+			"counters": counters,
+			"phases": phases,
+		}
+
+# ==================================
+
+# Writes every record as a JSON line to a file path or an open stream
+class FileSink(object):
+	def __init__(self, target):
+		self.ownsStream = not hasattr(target, 'write')
+		self.stream = open(target, 'a') if self.ownsStream else target
+
+	def write(self, record):
+		self.stream.write(json.dumps(record))
+		self.stream.write('\n')
+
+	def close(self):
+		if self.ownsStream:
+			self.stream.close()
+		else:
+			self.stream.flush()
+
+# ==================================